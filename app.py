@@ -5,17 +5,25 @@ from redshift.database import Redshift
 from redshift.user import RedshiftUser
 from redshift.role import RedshiftRole
 from redshift.group import RedshiftGroup
+from redshift.privilege import Privilege, PrivilegeSet, PrivilegeResolver
+from redshift.role_graph import RoleCycleError, get_role_graph_async
+from redshift.user_import import import_users
+from redshift.clone import parse_target_names, clone_user_access, clone_role_access
+from redshift import access_state
+from redshift.access_state import AccessState, plan_access, apply_plan
+from redshift.metrics import METRICS_ENABLED, MetricsMiddleware, metrics_authorized, render_metrics
 from redshift import sql_queries as sql
 from helpers.session_helper import *
+from helpers.streaming import stream_page
 from monsterui.all import *
+import asyncio
 import json
 from components import *
 
-# listjs
-listjs = Script(src='https://cdnjs.cloudflare.com/ajax/libs/list.js/2.3.1/list.min.js')
-hdrs = (Theme.violet.headers(mode='light'), listjs)
+hdrs = (Theme.violet.headers(mode='light'),)
 app, rt = fast_app(hdrs=hdrs, debug=True, live=True)
 setup_toasts(app)
+app.add_middleware(MetricsMiddleware)
 
 # Helper function to store role in session
 def set_role(session, role: RedshiftRole):
@@ -25,21 +33,89 @@ def set_role(session, role: RedshiftRole):
 def get_role(session) -> RedshiftRole:
     return sess_get_obj(session, 'rsrole')
 
+# ===== Privilege save helpers =====
+def get_selected_privileges(frm_data: dict, rs: Redshift) -> PrivilegeSet:
+    'Privileges ticked in a privileges form, from checkbox ids formatted as priv-{schema}-{object}-{privilege}'
+    ticked = [key.split('-') for key, value in frm_data.items()
+              if key.startswith('priv-') and (isinstance(value, list) and '1' in value)]
+    ticked = [parts for parts in ticked if len(parts) == 4]
+    # Relations of the schemas in the form only, each loaded once and then memoized
+    schema_relations = rs.get_schema_catalog([parts[1] for parts in ticked])
+    selected = PrivilegeSet()
+    for _, schema_name, object_name, privilege_type in ticked:
+        selected.add(Privilege.create(
+            schema_name, object_name,
+            # Determine object type based on database metadata
+            rs.determine_object_type(schema_name, object_name, privilege_type, schema_relations),
+            privilege_type
+        ))
+    return selected
+
+def save_privileges(principal, current_privileges: PrivilegeSet, frm_data: dict, rs: Redshift) -> tuple:
+    """
+    Apply the difference between the privileges selected in the form and the current ones.
+    Blocking, routes await it with rs.run_async
+    
+    Args:
+        principal: RedshiftUser or RedshiftRole to apply the changes to
+        current_privileges: Privileges the principal currently holds
+        frm_data: Submitted privileges form
+        rs: Redshift connection
+        
+    Returns:
+        tuple: (success, granted_count, revoked_count)
+    """
+    to_grant, to_revoke = current_privileges.diff(get_selected_privileges(frm_data, rs))
+    statements = principal.apply_privileges(to_grant, to_revoke, rs)
+    for s in statements:
+        if s.error:
+            print(f"{s.sql} -> {s.error}")
+    success = all(s.success for s in statements)
+    granted_count = sum(len(s.privileges) for s in statements if s.success and s.action == 'GRANT')
+    revoked_count = sum(len(s.privileges) for s in statements if s.success and s.action == 'REVOKE')
+    return success, granted_count, revoked_count
+
+# Whether a name typed into an object picker is a relation of the schema, kind as in Redshift.search_schema_objects
+def is_schema_object(rs: Redshift, schema_name: str, kind: str, name: str) -> bool:
+    relations = rs.get_schema_catalog([schema_name]).get(schema_name)
+    if not relations:
+        return False
+    if kind == 'functions':
+        return name in relations['functions'] or name in relations['procedures']
+    return name in relations[kind]
+
+# Toast summarising a privileges save
+def add_privileges_toast(session, success: bool, granted_count: int, revoked_count: int):
+    if success:
+        if granted_count > 0 and revoked_count > 0:
+            add_toast(session, f'Privileges updated successfully! Granted: {granted_count}, Revoked: {revoked_count}', 'success', True)
+        elif granted_count > 0:
+            add_toast(session, f'Privileges granted successfully! Count: {granted_count}', 'success', True)
+        elif revoked_count > 0:
+            add_toast(session, f'Privileges revoked successfully! Count: {revoked_count}', 'success', True)
+        else:
+            add_toast(session, 'No privilege changes were needed.', 'info', True)
+    else:
+        if granted_count > 0 or revoked_count > 0:
+            add_toast(session, f'Some privileges updated successfully, but errors occurred. Granted: {granted_count}, Revoked: {revoked_count}', 'warning', True)
+        else:
+            add_toast(session, 'Error updating privileges!', 'error', True)
+
 # Home, DB info form
 @rt('/')
-def get(session):
-    session.clear()
+async def get(session):
+    sess_clear(session)
     return MainLayout(mk_db_frm(), nav_btns=False)
 
 # Connect to Redshift, show Nav, User Table
 @rt('/')
-def post(session, rs: Redshift):
-    session.clear()
+async def post(session, rs: Redshift):
+    sess_clear(session)
     if not (rs.host and rs.port and rs.name and rs.user and rs.pwd):
         add_toast(session, 'All connection fields are required!', 'error', True)
         return RedirectResponse('/', status_code=303)
 
-    if not rs.test_conn():
+    if not await rs.test_conn_async():
         add_toast(session, 'There was a problem connecting to Redshift!', 'error', True)
         return RedirectResponse('/', status_code=303)
 
@@ -53,28 +129,39 @@ def post(session, rs: Redshift):
     # )
 
 
-@rt('/user-groups/{user_id}')
-def get(session, user_id: int):
-    groups = RedshiftUser.get_user_groups(user_id, get_rs(session))
-    return BadgeList(groups) if groups else '-'
-
-# Get user roles for each user
-@rt('/user-roles/{user_id}')
-def get(session, user_id: int):
-    roles = RedshiftUser.get_user_roles(user_id, get_rs(session))
-    return BadgeList(roles) if roles else '-'
-
-
-
+# Users list, first page with groups and roles of its users.
+# With stream, the layout is sent straight away and all matching users are streamed in pages.
 @rt('/users')
-def get(session):
-    users = RedshiftUser.get_all(get_rs(session))
-    return MainLayout(mk_user_table(users))
+async def get(req, session, q: str = '', sort: str = 'name', desc: bool = False, stream: bool = False):
+    rs = get_rs(session)
+    if stream:
+        chunks = (mk_user_rows(users) async for users in RedshiftUser.iter_pages_async(rs, q, sort, desc))
+        return stream_page(req, MainLayout(mk_user_table(search=q, sort=sort, desc=desc, stream=True)), chunks,
+                           error=lambda e: ErrorRow(f'Could not load all users: {e}', colspan=6))
+    users, next_after = await RedshiftUser.get_page_async(rs, q, sort, desc)
+    return MainLayout(mk_user_table(users, next_after, q, sort, desc))
+
+# Users list searched or sorted, or its next page when after is given
+@rt('/users/list')
+async def get(session, q: str = '', sort: str = 'name', desc: bool = False, after: str = None):
+    users, next_after = await RedshiftUser.get_page_async(get_rs(session), q, sort, desc, after)
+    if after is not None:
+        return mk_user_rows(users, next_after, q, sort, desc)
+    return mk_user_list(users, next_after, q, sort, desc)
+
+# Bulk create users with their groups and roles from an uploaded CSV or JSON file
+@rt('/users/import')
+async def post(session, file: UploadFile):
+    rs = get_rs(session)
+    rows = await rs.run_async(import_users, await file.read(), file.filename or '', rs)
+    if any(row.status == 'created' for row in rows):
+        add_toast(session, f"{sum(row.status == 'created' for row in rows)} users imported!", 'success', True)
+    return mk_import_report(rows)
 
 
 # ===== User Groups =====
 @rt('/user/add-group')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     user = get_user(session)
     # TODO: group_select returning a list with two values. 1st always 1st option, 2nd is selected val.
     group_name = frm_data['ugroup-select'][1] if frm_data['ugroup-select'] else None
@@ -86,7 +173,7 @@ def post(session, frm_data: dict):
     # return mk_user_groups(session, user)
 
 @rt('/user/remove-group')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     user = get_user(session)
     user.groups = set(user.groups) - set(frm_data.keys())
     set_user(session, user)
@@ -96,9 +183,10 @@ def post(session, frm_data: dict):
     # return mk_user_groups(session, user)
 
 @rt('/user/save-groups')
-def post(session, user: RedshiftUser):
+async def post(session, user: RedshiftUser):
     user = get_user(session)
-    if user.save_groups(get_rs(session)):
+    rs = get_rs(session)
+    if await rs.run_async(user.save_groups, rs):
         add_toast(session, 'User groups saved successfully!', 'success', True)
     else:
         add_toast(session, 'Error saving user groups!', 'error', True)
@@ -106,7 +194,7 @@ def post(session, user: RedshiftUser):
 
 # ===== User Roles =====
 @rt('/user/add-role')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     user = get_user(session)
     # TODO: role_select returning a list with two values. 1st always 1st option, 2nd is selected val.
     role_name = frm_data['urole-select'][1] if frm_data['urole-select'] else None
@@ -117,7 +205,7 @@ def post(session, frm_data: dict):
                          hx_post='/user/remove-role', hx_target=f'#{ls_id}')
 
 @rt('/user/remove-role')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     user = get_user(session)
     user.roles = set(user.roles) - set(frm_data.keys())
     set_user(session, user)
@@ -126,9 +214,10 @@ def post(session, frm_data: dict):
                          hx_post='/user/remove-role', hx_target=f'#{ls_id}')
 
 @rt('/user/save-roles')
-def post(session, user: RedshiftUser):
+async def post(session, user: RedshiftUser):
     user = get_user(session)
-    if user.save_roles(get_rs(session)):
+    rs = get_rs(session)
+    if await rs.run_async(user.save_roles, rs):
         set_user(session, user)
         add_toast(session, 'User roles saved successfully!', 'success', True)
     else:
@@ -137,43 +226,16 @@ def post(session, user: RedshiftUser):
 
 # Show user details
 @rt('/user/{user_id}')
-def get(session, user_id: int):
+async def get(session, user_id: int):
     try:
         rs = get_rs(session)
-        user = RedshiftUser.get_user(user_id, rs)
-        all_groups = RedshiftUser.get_all_groups(rs)
-        all_roles = RedshiftUser.get_all_roles(rs)
-        
-        # Get all schemas
-        schemas = rs.get_all_schemas()
-        session['schemas'] = schemas
-        
-        # Fetch all relations for all schemas
-        schema_relations = {}
-        for schema in schemas:
-            schema_relations[schema] = {
-                'tables': [],
-                'views': [],
-                'functions': [],
-                'procedures': []
-            }
-            
-            # Get tables for the schema
-            schema_relations[schema]['tables'] = rs.get_schema_tables(schema)
-            
-            # Get views for the schema
-            schema_relations[schema]['views'] = rs.get_schema_views(schema)
-            
-            # Get functions for the schema
-            schema_relations[schema]['functions'] = rs.get_schema_functions(schema)
-
-            # Get procedures for the schema
-            schema_relations[schema]['procedures'] = rs.get_schema_procedures(schema)
+        # User, groups, roles and schema names are loaded concurrently, then the relations
+        # of the schemas shown up front. Other schemas are loaded when navigated to.
+        user, all_groups, all_roles, schemas, schema_relations = await RedshiftUser.get_user_page_async(user_id, rs)
+        sess_store_obj(session, 'schemas', schemas)
         
         if user:
             set_user(session, user)
-            # Store schema relations in session
-            session['schema_relations'] = schema_relations
             return MainLayout(mk_user_form(user, all_groups, all_roles, schemas, schema_relations), active_btn='users')
         else:
             add_toast(session, f'User with ID: {user_id} not found', 'error', True)
@@ -183,11 +245,11 @@ def get(session, user_id: int):
         return RedirectResponse('/users')
 
 @rt('/user/create')
-def post(session, user: RedshiftUser):
+async def post(session, user: RedshiftUser):
     # Create the user in Redshift
     rs = get_rs(session)
     try:
-        nu = RedshiftUser.create_user(user, rs=rs) # new user
+        nu = await rs.run_async(RedshiftUser.create_user, user, rs=rs) # new user
         
         if nu:
             add_toast(session, f'User {user.user_name} created successfully!', 'success', True)
@@ -201,8 +263,9 @@ def post(session, user: RedshiftUser):
         return RedirectResponse(url='/users', status_code=303)
 
 @rt('/user/save-props')
-def post(session, user: RedshiftUser):
-    if user.update(get_rs(session)):
+async def post(session, user: RedshiftUser):
+    rs = get_rs(session)
+    if await rs.run_async(user.update, rs):
         add_toast(session, f'User: {user.user_name} saved successfully!', 'success', True)
     else:
         add_toast(session, f'Error saving user: {user.user_name}!', 'error', True)
@@ -210,13 +273,21 @@ def post(session, user: RedshiftUser):
 
 # ===== User Privileges =====
 @rt('/user/load-table/{schema_name}')
-def post(session, schema_name: str, frm_data: dict):
+async def post(session, schema_name: str, frm_data: dict):
     # Get table name from form data
     table_name = frm_data.get('new-table-' + schema_name)
     table_name = table_name[1] if isinstance(table_name, list) else table_name
     if not table_name:
         return None
     
+    # Names are typed into a search box, so check the table exists
+    rs = get_rs(session)
+    if not await rs.run_async(is_schema_object, rs, schema_name, 'tables', table_name):
+        return Div(
+            P(f"Table '{table_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the table already exists in the UI
     existing_table_id = f'table-row-{schema_name}-{table_name}'
     if frm_data.get(existing_table_id) == 'exists':
@@ -237,13 +308,21 @@ def post(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/user/load-view/{schema_name}')
-def post(session, schema_name: str, frm_data: dict):
+async def post(session, schema_name: str, frm_data: dict):
     # Get view name from form data
     view_name = frm_data.get('new-view-' + schema_name)
     view_name = view_name[1] if isinstance(view_name, list) else view_name
     if not view_name:
         return None
     
+    # Names are typed into a search box, so check the view exists
+    rs = get_rs(session)
+    if not await rs.run_async(is_schema_object, rs, schema_name, 'views', view_name):
+        return Div(
+            P(f"View '{view_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the view already exists in the UI
     existing_view_id = f'view-row-{schema_name}-{view_name}'
     if frm_data.get(existing_view_id) == 'exists':
@@ -261,7 +340,7 @@ def post(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/user/load-function/{schema_name}')
-def post(session, schema_name: str, frm_data: dict):
+async def post(session, schema_name: str, frm_data: dict):
     # Get function, procedure name from form data
     func = frm_data.get('new-func-' + schema_name)
     func = func[1] if isinstance(func, list) else func
@@ -279,6 +358,14 @@ def post(session, schema_name: str, frm_data: dict):
     func_type = func_parts[0]
     func_name = func_parts[1]
     
+    # Names are typed into a search box, so check the function exists
+    rs = get_rs(session)
+    if func_type not in ('FUNCTION', 'PROCEDURE') or not await rs.run_async(is_schema_object, rs, schema_name, 'functions', func_name):
+        return Div(
+            P(f"{func_type} '{func_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the function already exists in the UI
     existing_func_id = f'func-row-{schema_name}-{func_name}'
     if frm_data.get(existing_func_id) == 'exists':
@@ -297,33 +384,66 @@ def post(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/user/schema-content/{user_id}/{schema_name}')
-def get(session, user_id: int, schema_name: str):
+async def get(session, user_id: int, schema_name: str):
     try:
         rs = get_rs(session)
-        user = RedshiftUser.get_user(user_id, rs)
-        schema_relations = session.get('schema_relations', {})
+        # The user in session is kept up to date by saves, only reload for another user
+        user = get_user(session)
+        if not user or user.user_id != user_id:
+            user = await RedshiftUser.get_user_async(user_id, rs)
+        schemas = sess_get_obj(session, 'schemas') or await rs.get_schema_list_async()
         
-        if user and schema_name in schema_relations:
-            schemas = session.get('schemas', rs.get_all_schemas())
+        if user and schema_name in schemas:
+            # Loaded on first visit of the schema, then memoized in the catalog cache
+            schema_relations = await rs.get_schema_catalog_async([schema_name])
             return get_user_schema_content(user, schema_name, schema_relations)
         else:
             return Div(P("Error: Schema not found or user not available"), cls='text-red-500')
     except Exception as e:
         return Div(P(f"Error loading schema content: {str(e)}"), cls='text-red-500')
 
+# Direct and inherited privileges of a user, resolved from bulk loaded role grants
+@rt('/user/effective-privileges/{user_id}')
+async def get(session, user_id: int):
+    try:
+        rs = get_rs(session)
+        user = get_user(session)
+        if not user or user.user_id != user_id:
+            user = await RedshiftUser.get_user_async(user_id, rs)
+        if not user:
+            return Div(P("Error: User not available"), cls='text-red-500')
+        resolver = await PrivilegeResolver.load_async(rs)
+        return EffectivePrivilegesTable(resolver.user_effective_privileges(user_id, user.privileges))
+    except Exception as e:
+        return Div(P(f"Error loading effective privileges: {str(e)}"), cls='text-red-500')
+
+# Give other users the groups, roles and privileges of the user being edited
+@rt('/user/clone-access')
+async def post(session, targets: str = '', exact: bool = False):
+    try:
+        rs = get_rs(session)
+        # Clone what is saved, not unsaved edits of the form
+        source = await RedshiftUser.get_user_async(get_user(session).user_id, rs)
+        deltas = await rs.run_async(clone_user_access, source, parse_target_names(targets), rs, exact)
+        if any(d.success for d in deltas):
+            add_toast(session, f'Access of {source.user_name} cloned onto {sum(d.success for d in deltas)} users!', 'success', True)
+        return CloneReport(deltas)
+    except Exception as e:
+        return Div(P(f"Error cloning access: {str(e)}"), cls='text-red-500')
+
 # Delete user
 @rt('/user/{user_id}')
-def delete(session, user_id: int):
+async def delete(session, user_id: int):
     try:
         rs = get_rs(session)
-        user = RedshiftUser.get_user(user_id, rs)
+        user = await RedshiftUser.get_user_async(user_id, rs, all_info=False)
         
         if not user:
             add_toast(session, f'User with ID: {user_id} not found', 'error', True)
             return None
             
         # Delete user
-        if user.delete(rs):
+        if await rs.run_async(user.delete, rs):
             add_toast(session, f'User {user.user_name} deleted successfully', 'success', True)
             return None
         else:
@@ -334,196 +454,55 @@ def delete(session, user_id: int):
         return None
 
 @rt('/user/save-privileges')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     user = get_user(session)
     rs = get_rs(session)
     
     # Get current privileges from the database
-    current_user = RedshiftUser.get_user(user.user_id, rs)
-    current_privileges = current_user.privileges if current_user else []
-    
-    # Get schema relations from session or fetch if not available
-    schema_relations = session.get('schema_relations', {})
-    if not schema_relations:
-        # Fetch all schemas
-        schemas = rs.get_all_schemas()
-        
-        # Fetch all relations for all schemas
-        for schema in schemas:
-            schema_relations[schema] = {
-                'tables': rs.get_schema_tables(schema),
-                'views': rs.get_schema_views(schema),
-                'functions': rs.get_schema_functions(schema),
-                'procedures': rs.get_schema_procedures(schema)
-            }
-        # Store in session for future use
-        session['schema_relations'] = schema_relations
-    
-    # Process form data to extract selected privileges
-    selected_privileges = []
-    for key, value in frm_data.items():
-        if key.startswith('priv-') and (isinstance(value, list) and '1' in value):
-            # Format: priv-{schema}-{object}-{privilege}
-            parts = key.split('-')
-            if len(parts) == 4:
-                schema_name = parts[1]
-                object_name = parts[2]
-                privilege_type = parts[3]
-                
-                # Determine object type based on database metadata
-                object_type = rs.determine_object_type(schema_name, object_name, privilege_type, schema_relations)
-                
-                selected_privileges.append({
-                    'schema_name': schema_name,
-                    'object_name': object_name,
-                    'object_type': object_type,
-                    'privilege_type': privilege_type
-                })
-    
-    # Compare current privileges with selected privileges
-    privileges_to_grant = []
-    privileges_to_revoke = []
-    
-    # Find privileges to grant (selected but not in current)
-    for selected in selected_privileges:
-        found = False
-        for current in current_privileges:
-            if (selected['schema_name'] == current['schema_name'] and
-                selected['object_name'] == current['object_name'] and
-                selected['privilege_type'] == current['privilege_type']):
-                # Note: We're not comparing object_type here because the database might 
-                # report a slightly different type name than what we determine
-                found = True
-                break
-        if not found:
-            privileges_to_grant.append(selected)
-    
-    # Find privileges to revoke (in current but not selected)
-    for current in current_privileges:
-        found = False
-        for selected in selected_privileges:
-            if (current['schema_name'] == selected['schema_name'] and
-                current['object_name'] == selected['object_name'] and
-                current['privilege_type'] == selected['privilege_type']):
-                # Note: We're not comparing object_type here because the database might 
-                # report a slightly different type name than what we determine
-                found = True
-                break
-        if not found:
-            # Use the object_type from the database for revoking
-            privileges_to_revoke.append(current)
-    
-    # Apply changes
-    success = True
-    revoked_count = 0
-    granted_count = 0
-    
-    # Revoke privileges
-    for privilege in privileges_to_revoke:
-        if user.revoke_privilege(
-            privilege['schema_name'],
-            privilege['object_name'],
-            privilege['object_type'],
-            privilege['privilege_type'],
-            rs
-        ):
-            revoked_count += 1
-        else:
-            success = False
-    
-    # Grant privileges
-    for privilege in privileges_to_grant:
-        if user.grant_privilege(
-            privilege['schema_name'],
-            privilege['object_name'],
-            privilege['object_type'],
-            privilege['privilege_type'],
-            rs
-        ):
-            granted_count += 1
-        else:
-            success = False
+    user.privileges = await RedshiftUser.get_user_privileges_async(user.user_name, rs)
     
-    # Refresh user privileges
-    updated_user = RedshiftUser.get_user(user.user_id, rs)
-    if updated_user:
-        set_user(session, updated_user)
+    # Diff selected privileges against current ones and apply all changes in one transaction.
+    # The user's privileges are patched with the applied changes, so no reload is needed.
+    success, granted_count, revoked_count = await rs.run_async(save_privileges, user, user.privileges, frm_data, rs)
+    set_user(session, user)
     
     # Show appropriate message
-    if success:
-        if granted_count > 0 and revoked_count > 0:
-            add_toast(session, f'Privileges updated successfully! Granted: {granted_count}, Revoked: {revoked_count}', 'success', True)
-        elif granted_count > 0:
-            add_toast(session, f'Privileges granted successfully! Count: {granted_count}', 'success', True)
-        elif revoked_count > 0:
-            add_toast(session, f'Privileges revoked successfully! Count: {revoked_count}', 'success', True)
-        else:
-            add_toast(session, 'No privilege changes were needed.', 'info', True)
-    else:
-        if granted_count > 0 or revoked_count > 0:
-            add_toast(session, f'Some privileges updated successfully, but errors occurred. Granted: {granted_count}, Revoked: {revoked_count}', 'warning', True)
-        else:
-            add_toast(session, 'Error updating privileges!', 'error', True)
-    
+    add_privileges_toast(session, success, granted_count, revoked_count)
     return None
 
 # ===== Roles =====
 @rt('/roles')
-def get(session):
-    roles = RedshiftRole.get_all(get_rs(session))
-    return MainLayout(mk_role_table(roles), active_btn='roles')
-
-# Get role users for each role
-@rt('/role-users/{role_name}')
-def get(session, role_name: str):
-    users = RedshiftRole.get_role_users(role_name, get_rs(session))
-    return BadgeList(users) if users else '-'
-
-# Get nested roles for each role
-@rt('/role-nested-roles/{role_name}')
-def get(session, role_name: str):
-    nested_roles = RedshiftRole.get_role_nested_roles(role_name, get_rs(session))
-    return BadgeList(nested_roles) if nested_roles else '-'
+async def get(req, session, q: str = '', sort: str = 'name', desc: bool = False, stream: bool = False):
+    rs = get_rs(session)
+    if stream:
+        chunks = (mk_role_rows(roles) async for roles in RedshiftRole.iter_pages_async(rs, q, sort, desc))
+        return stream_page(req, MainLayout(mk_role_table(search=q, sort=sort, desc=desc, stream=True), active_btn='roles'), chunks,
+                           error=lambda e: ErrorRow(f'Could not load all roles: {e}', colspan=6))
+    # Users and nested roles of the page's roles are loaded in bulk
+    roles, next_after = await RedshiftRole.get_page_async(rs, q, sort, desc)
+    return MainLayout(mk_role_table(roles, next_after, q, sort, desc), active_btn='roles')
+
+# Roles list searched or sorted, or its next page when after is given
+@rt('/roles/list')
+async def get(session, q: str = '', sort: str = 'name', desc: bool = False, after: str = None):
+    roles, next_after = await RedshiftRole.get_page_async(get_rs(session), q, sort, desc, after)
+    if after is not None:
+        return mk_role_rows(roles, next_after, q, sort, desc)
+    return mk_role_list(roles, next_after, q, sort, desc)
 
 # Show role details
 @rt('/role/{role_name}')
-def get(session, role_name: str):
+async def get(session, role_name: str):
     try:
         rs = get_rs(session)
-        role = RedshiftRole.get_role(role_name, rs)
-        all_roles = RedshiftRole.get_all(rs)
-        
-        # Get all schemas
-        schemas = rs.get_all_schemas()
-        session['schemas'] = schemas
-        
-        # Fetch all relations for all schemas
-        schema_relations = {}
-        for schema in schemas:
-            schema_relations[schema] = {
-                'tables': [],
-                'views': [],
-                'functions': [],
-                'procedures': []
-            }
-            
-            # Get tables for the schema
-            schema_relations[schema]['tables'] = rs.get_schema_tables(schema)
-            
-            # Get views for the schema
-            schema_relations[schema]['views'] = rs.get_schema_views(schema)
-            
-            # Get functions for the schema
-            schema_relations[schema]['functions'] = rs.get_schema_functions(schema)
-
-            # Get procedures for the schema
-            schema_relations[schema]['procedures'] = rs.get_schema_procedures(schema)
+        # Role, roles and schema names are loaded concurrently, then the relations
+        # of the schemas shown up front. Other schemas are loaded when navigated to.
+        role, all_roles, schemas, schema_relations, graph = await RedshiftRole.get_role_page_async(role_name, rs)
+        sess_store_obj(session, 'schemas', schemas)
         
         if role:
             set_role(session, role)
-            # Store schema relations in session
-            session['schema_relations'] = schema_relations
-            return MainLayout(mk_role_form(role, all_roles, schemas, schema_relations), active_btn='roles')
+            return MainLayout(mk_role_form(role, all_roles, schemas, schema_relations, graph), active_btn='roles')
         else:
             add_toast(session, f'Role with name: {role_name} not found', 'error', True)
             return RedirectResponse('/roles')
@@ -533,10 +512,10 @@ def get(session, role_name: str):
 
 # Delete role
 @rt('/role/{role_name}')
-def delete(session, role_name: str):
+async def delete(session, role_name: str):
     try:
         rs = get_rs(session)
-        role = RedshiftRole.get_role(role_name, rs)
+        role = await RedshiftRole.get_role_async(role_name, rs)
         
         if not role:
             add_toast(session, f'Role with name: {role_name} not found', 'error', True)
@@ -548,7 +527,7 @@ def delete(session, role_name: str):
             return None
             
         # Delete role
-        if role.delete(rs):
+        if await rs.run_async(role.delete, rs):
             add_toast(session, f'Role {role_name} deleted successfully', 'success', True)
             return None
         else:
@@ -560,7 +539,7 @@ def delete(session, role_name: str):
 
 # Create role
 @rt('/role/create')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     role_name = frm_data.get('role_name')
     
     if not role_name:
@@ -570,7 +549,7 @@ def post(session, frm_data: dict):
     # Create the role in Redshift
     rs = get_rs(session)
     try:
-        role = RedshiftRole.create_role(role_name, rs)
+        role = await rs.run_async(RedshiftRole.create_role, role_name, rs)
         
         if role:
             add_toast(session, f'Role {role_name} created successfully!', 'success', True)
@@ -585,18 +564,23 @@ def post(session, frm_data: dict):
 
 # ===== Role Nested Roles =====
 @rt('/role/add-nested-role')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     role = get_role(session)
     # TODO: nested-role-select returning a list with two values. 1st always 1st option, 2nd is selected val.
     nested_role_name = frm_data['nested-role-select'][1] if frm_data['nested-role-select'] else None
-    if nested_role_name: role.nested_roles = set(role.nested_roles) | set([nested_role_name])
+    if nested_role_name:
+        graph = await get_role_graph_async(get_rs(session))
+        if graph.creates_cycle(role.role_name, nested_role_name):
+            add_toast(session, f'Cannot nest {nested_role_name} in {role.role_name}, it would create a cycle!', 'error', True)
+        else:
+            role.nested_roles = set(role.nested_roles) | set([nested_role_name])
     set_role(session, role)
     ls_id = frm_data['nested_role_list_id']
     return RemovableList(role.nested_roles, id=ls_id, 
                          hx_post='/role/remove-nested-role', hx_target=f'#{ls_id}')
 
 @rt('/role/remove-nested-role')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     role = get_role(session)
     role.nested_roles = set(role.nested_roles) - set(frm_data.keys())
     set_role(session, role)
@@ -605,48 +589,52 @@ def post(session, frm_data: dict):
                          hx_post='/role/remove-nested-role', hx_target=f'#{ls_id}')
 
 @rt('/role/save-nested-roles')
-def post(session, role: RedshiftRole):
+async def post(session, role: RedshiftRole):
     role = get_role(session)
-    if role.update_nested_roles(role.nested_roles, get_rs(session)):
-        add_toast(session, 'Nested roles saved successfully!', 'success', True)
-    else:
-        add_toast(session, 'Error saving nested roles!', 'error', True)
+    rs = get_rs(session)
+    try:
+        if await rs.run_async(role.update_nested_roles, role.nested_roles, rs):
+            add_toast(session, 'Nested roles saved successfully!', 'success', True)
+        else:
+            add_toast(session, 'Error saving nested roles!', 'error', True)
+    except RoleCycleError as e:
+        add_toast(session, str(e), 'error', True)
     return None
 
 # ===== Role Privileges =====
 @rt('/role/get-schema-tables/{schema_name}')
-def get(session, schema_name: str):
+async def get(session, schema_name: str):
     rs = get_rs(session)
     
     # Get tables for the schema
-    tables = rs.get_schema_tables(schema_name)
+    tables = await rs.run_async(rs.get_schema_tables, schema_name)
     
     # Return options for select
     options = SelectOptions(tables)
     return ''.join([str(option) for option in options])
 
 @rt('/role/get-schema-views/{schema_name}')
-def get(session, schema_name: str):
+async def get(session, schema_name: str):
     rs = get_rs(session)
     
     # Get views for the schema
-    views = rs.get_schema_views(schema_name)
+    views = await rs.run_async(rs.get_schema_views, schema_name)
     
     # Return options for select
     options = SelectOptions(views)
     return ''.join([str(option) for option in options])
 
 @rt('/role/get-schema-functions/{schema_name}')
-def get(session, schema_name: str, frm_data: dict):
+async def get(session, schema_name: str, frm_data: dict):
     rs = get_rs(session)
     func_type = frm_data.get('new-func-type-' + schema_name)
     
     if func_type == 'FUNCTION':
         # Get functions for the schema
-        funcs = rs.get_schema_functions(schema_name)
+        funcs = await rs.run_async(rs.get_schema_functions, schema_name)
     else:
         # Get procedures for the schema
-        funcs = rs.get_schema_procedures(schema_name)
+        funcs = await rs.run_async(rs.get_schema_procedures, schema_name)
     
     # Return options for select
     options = SelectOptions(funcs)
@@ -654,13 +642,21 @@ def get(session, schema_name: str, frm_data: dict):
 
 
 @rt('/role/load-table/{schema_name}')
-def post(session, schema_name: str, frm_data: dict):
+async def post(session, schema_name: str, frm_data: dict):
     # Get table name from form data
     table_name = frm_data.get('new-table-' + schema_name)
     table_name = table_name[1] if isinstance(table_name, list) else table_name
     if not table_name:
         return None
     
+    # Names are typed into a search box, so check the table exists
+    rs = get_rs(session)
+    if not await rs.run_async(is_schema_object, rs, schema_name, 'tables', table_name):
+        return Div(
+            P(f"Table '{table_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the table already exists in the UI
     existing_table_id = f'table-row-{schema_name}-{table_name}'
     if frm_data.get(existing_table_id) == 'exists':
@@ -681,13 +677,21 @@ def post(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/role/load-view/{schema_name}')
-def post(session, schema_name: str, frm_data: dict):
+async def post(session, schema_name: str, frm_data: dict):
     # Get view name from form data
     view_name = frm_data.get('new-view-' + schema_name)
     view_name = view_name[1] if isinstance(view_name, list) else view_name
     if not view_name:
         return None
     
+    # Names are typed into a search box, so check the view exists
+    rs = get_rs(session)
+    if not await rs.run_async(is_schema_object, rs, schema_name, 'views', view_name):
+        return Div(
+            P(f"View '{view_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the view already exists in the UI
     existing_view_id = f'view-row-{schema_name}-{view_name}'
     if frm_data.get(existing_view_id) == 'exists':
@@ -708,7 +712,7 @@ def post(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/role/load-function/{schema_name}')
-def get(session, schema_name: str, frm_data: dict):
+async def get(session, schema_name: str, frm_data: dict):
     # Get function, procedure name from form data
     func = frm_data.get('new-func-' + schema_name)
     func = func[1] if isinstance(func, list) else func
@@ -726,6 +730,14 @@ def get(session, schema_name: str, frm_data: dict):
     func_type = func_parts[0]
     func_name = func_parts[1]
     
+    # Names are typed into a search box, so check the function exists
+    rs = get_rs(session)
+    if func_type not in ('FUNCTION', 'PROCEDURE') or not await rs.run_async(is_schema_object, rs, schema_name, 'functions', func_name):
+        return Div(
+            P(f"{func_type} '{func_name}' not found in {schema_name}.", cls="uk-text-warning"),
+            cls="uk-margin-small"
+        )
+    
     # Check if the function already exists in the UI
     existing_func_id = f'func-row-{schema_name}-{func_name}'
     if frm_data.get(existing_func_id) == 'exists':
@@ -744,179 +756,107 @@ def get(session, schema_name: str, frm_data: dict):
             )
 
 @rt('/role/save-privileges')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     role = get_role(session)
     rs = get_rs(session)
     
     # Get current privileges from the database
-    current_role = RedshiftRole.get_role(role.role_name, rs)
-    current_privileges = current_role.privileges if current_role else []
-    
-    # Get schema relations from session or fetch if not available
-    schema_relations = session.get('schema_relations', {})
-    if not schema_relations:
-        # Fetch all schemas
-        schemas = rs.get_all_schemas()
-        
-        # Fetch all relations for all schemas
-        for schema in schemas:
-            schema_relations[schema] = {
-                'tables': rs.get_schema_tables(schema),
-                'views': rs.get_schema_views(schema),
-                'functions': rs.get_schema_functions(schema),
-                'procedures': rs.get_schema_procedures(schema)
-            }
-        # Store in session for future use
-        session['schema_relations'] = schema_relations
-    
-    # Process form data to extract selected privileges
-    selected_privileges = []
-    for key, value in frm_data.items():
-        if key.startswith('priv-') and (isinstance(value, list) and '1' in value):
-            # Format: priv-{schema}-{object}-{privilege}
-            parts = key.split('-')
-            if len(parts) == 4:
-                schema_name = parts[1]
-                object_name = parts[2]
-                privilege_type = parts[3]
-                
-                # Determine object type based on database metadata
-                object_type = rs.determine_object_type(schema_name, object_name, privilege_type, schema_relations)
-                
-                selected_privileges.append({
-                    'schema_name': schema_name,
-                    'object_name': object_name,
-                    'object_type': object_type,
-                    'privilege_type': privilege_type
-                })
-    
-    # Compare current privileges with selected privileges
-    privileges_to_grant = []
-    privileges_to_revoke = []
-    
-    # Find privileges to grant (selected but not in current)
-    for selected in selected_privileges:
-        found = False
-        for current in current_privileges:
-            if (selected['schema_name'] == current['schema_name'] and
-                selected['object_name'] == current['object_name'] and
-                selected['privilege_type'] == current['privilege_type']):
-                # Note: We're not comparing object_type here because the database might 
-                # report a slightly different type name than what we determine
-                found = True
-                break
-        if not found:
-            privileges_to_grant.append(selected)
-    
-    # Find privileges to revoke (in current but not selected)
-    for current in current_privileges:
-        found = False
-        for selected in selected_privileges:
-            if (current['schema_name'] == selected['schema_name'] and
-                current['object_name'] == selected['object_name'] and
-                current['privilege_type'] == selected['privilege_type']):
-                # Note: We're not comparing object_type here because the database might 
-                # report a slightly different type name than what we determine
-                found = True
-                break
-        if not found:
-            # Use the object_type from the database for revoking
-            privileges_to_revoke.append(current)
-    
-    # Apply changes
-    success = True
-    revoked_count = 0
-    granted_count = 0
-    
-    # Revoke privileges
-    for privilege in privileges_to_revoke:
-        if role.revoke_privilege(
-            privilege['schema_name'],
-            privilege['object_name'],
-            privilege['object_type'],
-            privilege['privilege_type'],
-            rs
-        ):
-            revoked_count += 1
-        else:
-            success = False
-    
-    # Grant privileges
-    for privilege in privileges_to_grant:
-        if role.grant_privilege(
-            privilege['schema_name'],
-            privilege['object_name'],
-            privilege['object_type'],
-            privilege['privilege_type'],
-            rs
-        ):
-            granted_count += 1
-        else:
-            success = False
+    role.privileges = await RedshiftRole.get_role_privileges_async(role.role_name, rs)
     
-    # Refresh role privileges
-    updated_role = RedshiftRole.get_role(role.role_name, rs)
-    if updated_role:
-        set_role(session, updated_role)
+    # Diff selected privileges against current ones and apply all changes in one transaction.
+    # The role's privileges are patched with the applied changes, so no reload is needed.
+    success, granted_count, revoked_count = await rs.run_async(save_privileges, role, role.privileges, frm_data, rs)
+    set_role(session, role)
     
     # Show appropriate message
-    if success:
-        if granted_count > 0 and revoked_count > 0:
-            add_toast(session, f'Privileges updated successfully! Granted: {granted_count}, Revoked: {revoked_count}', 'success', True)
-        elif granted_count > 0:
-            add_toast(session, f'Privileges granted successfully! Count: {granted_count}', 'success', True)
-        elif revoked_count > 0:
-            add_toast(session, f'Privileges revoked successfully! Count: {revoked_count}', 'success', True)
-        else:
-            add_toast(session, 'No privilege changes were needed.', 'info', True)
-    else:
-        if granted_count > 0 or revoked_count > 0:
-            add_toast(session, f'Some privileges updated successfully, but errors occurred. Granted: {granted_count}, Revoked: {revoked_count}', 'warning', True)
-        else:
-            add_toast(session, 'Error updating privileges!', 'error', True)
-    
+    add_privileges_toast(session, success, granted_count, revoked_count)
     return None
 
 # ===== Role Schema Content =====
 @rt('/role/schema-nav/{schema_name}')
-def get(session, schema_name: str):
-    schemas = session.get('schemas', get_rs(session).get_all_schemas())
+async def get(session, schema_name: str):
+    schemas = sess_get_obj(session, 'schemas')
+    if not schemas:
+        rs = get_rs(session)
+        schemas = await rs.run_async(rs.get_all_schemas)
     return mk_schema_nav(schemas, schema_name)
 
 @rt('/role/schema-content/{role_name}/{schema_name}')
-def get(session, role_name: str, schema_name: str):
+async def get(session, role_name: str, schema_name: str):
     try:
         rs = get_rs(session)
-        role = RedshiftRole.get_role(role_name, rs)
-        schema_relations = session.get('schema_relations', {})
+        # The role in session is kept up to date by saves, only reload for another role
+        role = get_role(session)
+        if not role or role.role_name != role_name:
+            role = await RedshiftRole.get_role_async(role_name, rs)
+        schemas = sess_get_obj(session, 'schemas') or await rs.get_schema_list_async()
         
-        if role and schema_name in schema_relations:
-            schemas = session.get('schemas', get_rs(session).get_all_schemas())
+        if role and schema_name in schemas:
+            # Loaded on first visit of the schema, then memoized in the catalog cache
+            schema_relations = await rs.get_schema_catalog_async([schema_name])
             return get_schema_content(role, schema_name, schema_relations), mk_schema_nav(role_name, schemas, schema_name)
         else:
             return Div(P("Error: Schema not found or role not available"), cls='text-red-500')
     except Exception as e:
         return Div(P(f"Error loading schema content: {str(e)}"), cls='text-red-500')
 
+# Privileges of a role and inherited through its nested roles, resolved from bulk loaded role grants
+@rt('/role/effective-privileges/{role_name}')
+async def get(session, role_name: str):
+    try:
+        resolver = await PrivilegeResolver.load_async(get_rs(session))
+        return EffectivePrivilegesTable(resolver.role_effective_privileges(role_name))
+    except Exception as e:
+        return Div(P(f"Error loading effective privileges: {str(e)}"), cls='text-red-500')
+
+# Give other roles the nested roles and privileges of the role being edited
+@rt('/role/clone-access')
+async def post(session, targets: str = '', exact: bool = False):
+    try:
+        rs = get_rs(session)
+        source = await RedshiftRole.get_role_async(get_role(session).role_name, rs)
+        deltas = await rs.run_async(clone_role_access, source, parse_target_names(targets), rs, exact)
+        if any(d.success for d in deltas):
+            add_toast(session, f'Access of {source.role_name} cloned onto {sum(d.success for d in deltas)} roles!', 'success', True)
+        return CloneReport(deltas)
+    except Exception as e:
+        return Div(P(f"Error cloning access: {str(e)}"), cls='text-red-500')
+
+# ===== Schema Objects =====
+# Typeahead suggestions of the table, view and function pickers of the privileges forms
+@rt('/schema-objects/{schema_name}/{kind}')
+async def get(session, schema_name: str, kind: str, q: str = ''):
+    rs = get_rs(session)
+    matches = await rs.search_schema_objects_async(schema_name, kind, q)
+    return tuple(Option(name, value=value) for name, value in matches)
+
 # ===== Groups =====
 @rt('/groups')
-def get(session):
-    groups = RedshiftGroup.get_all(get_rs(session))
-    return MainLayout(mk_group_table(groups), active_btn='groups')
-
-# Get group users for each group
-@rt('/group-users/{group_name}')
-def get(session, group_name: str):
-    users = RedshiftGroup.get_group_users(group_name, get_rs(session))
-    return BadgeList(users) if users else '-'
+async def get(req, session, q: str = '', sort: str = 'name', desc: bool = False, stream: bool = False):
+    rs = get_rs(session)
+    if stream:
+        chunks = (mk_group_rows(groups) async for groups in RedshiftGroup.iter_pages_async(rs, q, sort, desc))
+        return stream_page(req, MainLayout(mk_group_table(search=q, sort=sort, desc=desc, stream=True), active_btn='groups'), chunks,
+                           error=lambda e: ErrorRow(f'Could not load all groups: {e}', colspan=3))
+    # Users of the page's groups are loaded in one query
+    groups, next_after = await RedshiftGroup.get_page_async(rs, q, sort, desc)
+    return MainLayout(mk_group_table(groups, next_after, q, sort, desc), active_btn='groups')
+
+# Groups list searched or sorted, or its next page when after is given
+@rt('/groups/list')
+async def get(session, q: str = '', sort: str = 'name', desc: bool = False, after: str = None):
+    groups, next_after = await RedshiftGroup.get_page_async(get_rs(session), q, sort, desc, after)
+    if after is not None:
+        return mk_group_rows(groups, next_after, q, sort, desc)
+    return mk_group_list(groups, next_after, q, sort, desc)
 
 # Show group details
 @rt('/group/{group_name}')
-def get(session, group_name: str):
+async def get(session, group_name: str):
     try:
         rs = get_rs(session)
-        group = RedshiftGroup.get_group(group_name, rs)
-        all_users = RedshiftUser.get_all(rs)
+        group, all_users = await asyncio.gather(RedshiftGroup.get_group_async(group_name, rs),
+                                                RedshiftUser.get_all_async(rs))
         
         if group:
             set_group(session, group)
@@ -930,17 +870,17 @@ def get(session, group_name: str):
 
 # Delete group
 @rt('/group/{group_name}')
-def delete(session, group_name: str):
+async def delete(session, group_name: str):
     try:
         rs = get_rs(session)
-        group = RedshiftGroup.get_group(group_name, rs)
+        group = await RedshiftGroup.get_group_async(group_name, rs)
         
         if not group:
             add_toast(session, f'Group with name: {group_name} not found', 'error', True)
             return None
             
         # Delete group
-        if group.delete(rs):
+        if await rs.run_async(group.delete, rs):
             add_toast(session, f'Group {group_name} deleted successfully', 'success', True)
             return None
         else:
@@ -952,7 +892,7 @@ def delete(session, group_name: str):
 
 # Create group
 @rt('/group/create')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     group_name = frm_data.get('group_name')
     
     if not group_name:
@@ -962,7 +902,7 @@ def post(session, frm_data: dict):
     # Create the group in Redshift
     rs = get_rs(session)
     try:
-        group = RedshiftGroup.create_group(group_name, rs)
+        group = await rs.run_async(RedshiftGroup.create_group, group_name, rs)
         
         if group:
             add_toast(session, f'Group {group_name} created successfully!', 'success', True)
@@ -977,7 +917,7 @@ def post(session, frm_data: dict):
 
 # ===== Group Users =====
 @rt('/group/add-user')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     group = get_group(session)
     user_name = frm_data['user-select'][1] if frm_data['user-select'] else None
     if user_name: group.users = set(group.users) | set([user_name])
@@ -987,7 +927,7 @@ def post(session, frm_data: dict):
                          hx_post='/group/remove-user', hx_target=f'#{ls_id}')
 
 @rt('/group/remove-user')
-def post(session, frm_data: dict):
+async def post(session, frm_data: dict):
     group = get_group(session)
     group.users = set(group.users) - set(frm_data.keys())
     set_group(session, group)
@@ -996,14 +936,68 @@ def post(session, frm_data: dict):
                          hx_post='/group/remove-user', hx_target=f'#{ls_id}')
 
 @rt('/group/save-users')
-def post(session, group: RedshiftGroup):
+async def post(session, group: RedshiftGroup):
     group = get_group(session)
-    if group.update_users(group.users, get_rs(session)):
+    rs = get_rs(session)
+    if await rs.run_async(group.update_users, group.users, rs):
         add_toast(session, 'Group users saved successfully!', 'success', True)
     else:
         add_toast(session, 'Error saving group users!', 'error', True)
     return None
 
+# ===== Access State =====
+@rt('/access')
+async def get(session):
+    return MainLayout(mk_access_page(access_state.yaml is not None), active_btn='access')
+
+@rt('/access/export')
+async def get(session, fmt: str = 'json'):
+    rs = get_rs(session)
+    fmt = 'yaml' if fmt == 'yaml' else 'json'
+    try:
+        text = access_state.export_state(await AccessState.load_async(rs), fmt)
+    except Exception as e:
+        add_toast(session, f'Error exporting access state: {str(e)}', 'error', True)
+        return RedirectResponse('/access')
+    return Response(text, media_type='application/yaml' if fmt == 'yaml' else 'application/json',
+                    headers={'Content-Disposition': f'attachment; filename="{rs.name}-access.{fmt}"'})
+
+# Statements bringing the cluster to an uploaded desired state
+@rt('/access/plan')
+async def post(session, file: UploadFile):
+    try:
+        desired = access_state.read_state(await file.read(), file.filename or '')
+    except ValueError as e:
+        return Div(P(f'Invalid desired state file: {str(e)}'), cls='text-red-500')
+    live = await AccessState.load_async(get_rs(session))
+    set_access_state(session, desired)
+    return mk_access_plan(plan_access(desired, live))
+
+# Apply the plan shown, re-planned against the live state so changes made since are accounted for
+@rt('/access/apply')
+async def post(session, digest: str):
+    desired = get_access_state(session)
+    if desired is None:
+        return Div(P('No plan to apply, upload the desired state file again.'), cls='text-red-500')
+    rs = get_rs(session)
+    plan = plan_access(desired, await AccessState.load_async(rs))
+    if plan.digest != digest:
+        return mk_access_plan(plan, 'The cluster changed since the plan was made. Review the new plan.')
+    batches = await rs.run_async(apply_plan, plan, rs)
+    if all(b.success for b in batches):
+        add_toast(session, f'{len(plan.statements)} statements applied!', 'success', True)
+    return mk_apply_report(batches)
+
+# ===== Metrics =====
+# Query, route, session, pool and cache metrics in Prometheus text format
+@rt('/metrics')
+async def get(req):
+    if not METRICS_ENABLED:
+        return Response('Metrics are disabled', status_code=404)
+    if not metrics_authorized(req.headers):
+        return Response('Unauthorized', status_code=401, headers={'WWW-Authenticate': 'Bearer'})
+    return Response(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ===== End Routes =====
 
 if __name__ == '__main__':
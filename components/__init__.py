@@ -3,3 +3,4 @@ from .user import *
 from .database import *
 from .role import *
 from .group import *
+from .access import *
@@ -0,0 +1,79 @@
+from fasthtml.common import *
+from monsterui.all import *
+from components.common import *
+
+__all__ = ['mk_access_page', 'mk_access_plan', 'mk_apply_report']
+
+# ===== Desired state plan and apply =====
+
+def mk_access_page(yaml_available: bool = True):
+    export_btns = [LinkButton('Export JSON', icon='download', href='/access/export?fmt=json', cls=ButtonT.default)]
+    if yaml_available:
+        export_btns.append(LinkButton('Export YAML', icon='download', href='/access/export?fmt=yaml', cls=ButtonT.default))
+    return Card(
+        FormSectionDiv(
+            H4('Export'),
+            HelpText('Download the groups, roles, users, their memberships and privileges as a desired state file.'),
+            DivLAligned(*export_btns),
+        ),
+        DividerSplit(cls='my-4'),
+        Form(
+            FormSectionDiv(
+                H4('Plan'),
+                HelpText('Upload an edited desired state file to see the statements bringing the cluster to it. '
+                         'Users and roles not in the file are left alone and nothing is dropped.'),
+                Input(type='file', id='file', accept='.json,.yaml,.yml', required=True),
+            ),
+            DivLAligned(
+                Button('Plan', id='btn-access-plan', cls=ButtonT.primary),
+                Loading((LoadingT.bars, LoadingT.lg, 'mx-4'), htmx_indicator=True),
+            ),
+            cls='space-y-4',
+            hx_post='/access/plan', hx_encoding='multipart/form-data',
+            hx_target='#access-plan', hx_disabled_elt='#btn-access-plan'
+        ),
+        Div(id='access-plan', cls='mt-4'),
+        header=(H3('Access State'), Subtitle('Manage access declaratively from a file')),
+        cls='w-full lg:w-4/5 mb-6'
+    )
+
+# Statements of a plan, with an apply button if it can be applied
+def mk_access_plan(plan, notice: str = ''):
+    if plan.errors:
+        return Div(
+            P('The desired state cannot be applied:', cls=(TextT.error, TextT.bold)),
+            Ul(*[Li(e) for e in plan.errors], cls='list-disc ml-6'),
+            cls='space-y-2'
+        )
+    if not plan.statements:
+        return P('Nothing to change, the cluster matches the desired state.', cls=TextT.success)
+    return Div(
+        P(notice, cls=TextT.warning) if notice else '',
+        P(', '.join(f'{label}: {n}' for label, n in plan.counts.items() if n), cls=TextT.bold),
+        Pre(Code('\n'.join(plan.statements)), cls='max-h-96 overflow-y-auto'),
+        Form(
+            Hidden(id='digest', value=plan.digest),
+            DivLAligned(
+                Button(f'Apply {len(plan.statements)} statements', id='btn-access-apply', cls=ButtonT.destructive),
+                Loading((LoadingT.bars, LoadingT.lg, 'mx-4'), htmx_indicator=True),
+            ),
+            hx_post='/access/apply', hx_target='#access-plan', hx_disabled_elt='#btn-access-apply'
+        ),
+        cls='space-y-4'
+    )
+
+# Outcome of applying a plan, one row per transaction
+def mk_apply_report(batches: list):
+    applied = sum(len(b.statements) for b in batches if b.success)
+    total = sum(len(b.statements) for b in batches)
+    return Div(
+        P(f'Applied {applied} of {total} statements.', cls=(TextT.success if applied == total else TextT.error, TextT.bold)),
+        Table(
+            Thead(Tr(Th('Batch'), Th('Statements'), Th('Status'))),
+            Tbody(*[Tr(Td(i), Td(len(b.statements)),
+                       Td('Applied' if b.success else b.error, cls=TextT.success if b.success else TextT.error))
+                    for i, b in enumerate(batches, start=1)]),
+            cls=(TableT.striped, TableT.sm)
+        ),
+        cls='space-y-2'
+    )
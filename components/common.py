@@ -1,9 +1,12 @@
 from fasthtml.common import *
 from monsterui.all import *
+from urllib.parse import urlencode
 
 __all__ = [
     'MainLayout', 'FormSectionDiv', 'HelpText', 'LinkButton', 'mk_brand', 'mk_nav_bar',
-    'LabelList', 'BadgeList', 'SelectOptions', 'RemovableList', 'ListAddRemove'
+    'LabelList', 'BadgeList', 'SelectOptions', 'RemovableList', 'ListAddRemove',
+    'page_url', 'ListParams', 'ListSearch', 'SortHeader', 'LoadMoreRow', 'ErrorRow', 'ShowAllLink',
+    'ObjectPicker', 'EffectivePrivileges', 'EffectivePrivilegesTable', 'CloneAccess', 'CloneReport'
 ]
 
 
@@ -31,10 +34,12 @@ def mk_nav_bar(nav_btns=True, active_btn=None):
         if not active_btn or active_btn == 'users': btn_users_cls = ButtonT.primary
         if active_btn == 'roles': btn_roles_cls = ButtonT.primary
         if active_btn == 'groups': btn_groups_cls = ButtonT.primary
+        btn_access_cls = ButtonT.primary if active_btn == 'access' else ButtonT.default
         btns = (
             LinkButton('Users', icon='users', href='/users', cls=btn_users_cls),
             LinkButton('Roles', icon='user-cog', href='/roles', cls=btn_roles_cls),
             LinkButton('Groups', icon='users', href='/groups', cls=btn_groups_cls),
+            LinkButton('Access', icon='file-check', href='/access', cls=btn_access_cls),
             LinkButton('Switch Database', icon='arrow-left-right', href='/', cls=ButtonT.default),
         )
     else: btns = None
@@ -58,6 +63,16 @@ def SelectOptions(items: list, vals: list=None):
     else:
         return [Option(item, value=item) for item in items]
 
+# Text input suggesting a schema's tables, views or functions as you type, matched on the server.
+# Submitted under id like a Select, with the suggestions' values.
+def ObjectPicker(schema: str, kind: str, id: str, placeholder: str):
+    return Div(
+        Input(id=id, list=f'{id}-options', placeholder=placeholder, autocomplete='off', cls='w-64',
+              hx_get=f'/schema-objects/{schema}/{kind}', hx_vals='js:{q: event.target.value}',
+              hx_trigger='input changed delay:200ms, focus once', hx_target=f'#{id}-options', hx_swap='innerHTML'),
+        Datalist(id=f'{id}-options')
+    )
+
 # Removable list 
 def RemovableList(items: list, id: str, hx_post: str, hx_target: str):
         return Ul(*[Li(
@@ -82,3 +97,114 @@ def ListAddRemove(*options, items, placeholder, id, ls_id, add_hx_post, remove_h
         RemovableList(items, id=ls_id, hx_post=remove_hx_post, hx_target=f'#{ls_id}'),
         id=f'grid{id}'
     )
+
+
+# ===== Paginated lists =====
+# A list is a Div with id {name}-list, holding its sort params and a table. Searching and
+# sorting replace the whole list, scrolling to its end appends the next page of rows.
+
+# URL with query string params, None values left out
+def page_url(path: str, **params):
+    params = {k: (int(v) if isinstance(v, bool) else v) for k, v in params.items() if v is not None}
+    return f'{path}?{urlencode(params)}' if params else path
+
+# Current sort of a list, sent along with searches
+def ListParams(name: str, sort: str, desc: bool):
+    return Div(Hidden(name='sort', value=sort), Hidden(name='desc', value=int(desc)), id=f'{name}-list-params')
+
+# Search box reloading a list from the server, debounced while typing
+def ListSearch(name: str, url: str, value: str = '', placeholder: str = 'Filter...'):
+    return Input(id=f'{name}-search', name='q', value=value, type='search', placeholder=placeholder, cls='w-sm',
+                 hx_get=url, hx_trigger='keyup changed delay:300ms, search', hx_target=f'#{name}-list',
+                 hx_swap='outerHTML', hx_include=f'#{name}-list-params')
+
+# Header reloading a list sorted on its column, flipping the direction if already sorted on it
+def SortHeader(label: str, name: str, url: str, sort: str, current_sort: str, desc: bool):
+    active = sort == current_sort
+    icon = UkIcon('chevron-down' if desc else 'chevron-up', height=14, width=14) if active else ''
+    return Th(A(label, icon, cls='cursor-pointer inline-flex items-center',
+                hx_get=page_url(url, sort=sort, desc=active and not desc), hx_target=f'#{name}-list',
+                hx_swap='outerHTML', hx_include=f'#{name}-search'))
+
+# Row fetching the next page of a list when scrolled into view, replaced by that page's rows
+def LoadMoreRow(url: str, colspan: int):
+    return Tr(Td(Loading((LoadingT.dots, LoadingT.sm)), colspan=colspan, cls='text-center'),
+              hx_get=url, hx_trigger='revealed', hx_swap='outerHTML')
+
+# Row in place of the rest of a list that failed to load
+def ErrorRow(message: str, colspan: int):
+    return Tr(Td(message, colspan=colspan, cls=(TextT.error, 'text-center')))
+
+# Link to the whole list streamed as one page, for lists with more than one page
+def ShowAllLink(path: str, search: str, sort: str, desc: bool):
+    return A('Show all', href=page_url(path, q=search, sort=sort, desc=desc, stream=True),
+             cls=(TextT.sm, 'text-blue-500'))
+
+
+# ===== Effective privileges =====
+
+# Section of a user or role form showing its effective privileges, loaded on demand from url
+def EffectivePrivileges(url: str):
+    return Div(
+        DivFullySpaced(
+            H4('Effective Privileges'),
+            Button('Show', id='btn-effective-privileges', cls=(ButtonT.secondary, ButtonT.sm),
+                   hx_get=url, hx_target='#effective-privileges', hx_disabled_elt='this'),
+        ),
+        HelpText('Privileges granted directly and inherited through roles and nested roles'),
+        Div(id='effective-privileges'),
+        cls='space-y-2'
+    )
+
+# Table of EffectivePrivilege entries, with the roles each one is granted through
+def EffectivePrivilegesTable(entries: list):
+    if not entries:
+        return HelpText('No privileges.')
+    return Table(
+        Thead(Tr(Th('Schema'), Th('Object'), Th('Type'), Th('Privilege'), Th('Granted Via'))),
+        Tbody(*[Tr(
+            Td(e.privilege.schema_name), Td(e.privilege.object_name), Td(e.privilege.object_type),
+            Td(e.privilege.privilege_type), Td(' → '.join(e.via) if e.via else 'Direct')
+        ) for e in entries]),
+        cls=(TableT.striped, TableT.sm)
+    )
+
+
+# ===== Clone access =====
+
+# Section of a user or role form copying its access onto other users or roles, posted to url
+def CloneAccess(url: str, kind: str):
+    return Div(
+        H4('Clone Access'),
+        HelpText(f'Give other {kind}s the same access as this one, in one transaction. '
+                 'Changes are computed from the current state of each target.'),
+        Form(
+            TextArea(id='targets', rows=3, placeholder=f'{kind.capitalize()} names, separated by commas or new lines'),
+            DivFullySpaced(
+                LabelCheckboxX(f'Also remove access this {kind} does not have', id='exact'),
+                DivLAligned(
+                    Loading((LoadingT.bars, LoadingT.sm, 'mr-2'), htmx_indicator=True),
+                    Button('Clone', id='btn-clone-access', cls=(ButtonT.secondary, ButtonT.sm)),
+                ),
+            ),
+            cls='space-y-2',
+            hx_post=url, hx_target='#clone-access-report', hx_disabled_elt='#btn-clone-access'
+        ),
+        Div(id='clone-access-report'),
+        cls='space-y-2'
+    )
+
+# Result of a clone, one row per target with the changes made or the reason it was not
+def CloneReport(deltas: list):
+    if not deltas:
+        return HelpText('No targets given.')
+    return Table(
+        Thead(Tr(Th('Target'), Th('Status'), Th('Changes'))),
+        Tbody(*[Tr(
+            Td(d.target),
+            Td('Cloned' if d.success else ('Failed' if d.error else 'Unchanged'),
+               cls=TextT.success if d.success else (TextT.error if d.error else '')),
+            Td(d.error or d.summary())
+        ) for d in deltas]),
+        cls=(TableT.striped, TableT.sm)
+    )
@@ -1,12 +1,13 @@
 from fasthtml.common import *
 from monsterui.all import *
-import json
 from redshift.group import RedshiftGroup
 from helpers.session_helper import *
+from helpers.streaming import StreamMarker
 from components.common import *
 
 __all__ = [
-    'mk_delete_group_modal', 'mk_group_link', 'mk_group_table', 'mk_group_users', 'mk_group_form'
+    'mk_delete_group_modal', 'mk_group_link', 'mk_group_row', 'mk_group_rows', 'mk_group_list', 'mk_group_table',
+    'mk_group_users', 'mk_group_form'
 ]
 
 # ===== Group list table =====
@@ -37,21 +38,10 @@ def mk_delete_group_modal(group_name):
 def mk_group_link(group: RedshiftGroup):
     return A(group.group_name, href=f'/group/{group.group_name}', cls='text-blue-500')
 
-def mk_group_table(groups: list=None):
-    if not groups:
-        return Div(H3('No groups retrieved from Redshift.'), cls='mt-10 text-red-400')
-
-    rows = []
-    for group in groups:
-        rows.append(
-            Tr(
+def mk_group_row(group: RedshiftGroup):
+    return Tr(
                 Td(mk_group_link(group), cls='GroupName'),
-                Td(
-                    Loading((LoadingT.dots, LoadingT.xs), htmx_indicator=True),
-                    hx_get=f'/group-users/{group.group_name}',
-                    hx_trigger='revealed',
-                    cls='Users',
-                ),
+                Td(BadgeList(sorted(group.users)) if group.users else '-', cls='Users'),
                 Td(
                     Button(UkIcon('trash-2'), cls=(ButtonT.destructive, ButtonT.xs), 
                            data_uk_toggle=f"target: #delete-group-modal-{group.group_name}"),
@@ -60,13 +50,35 @@ def mk_group_table(groups: list=None):
                 ),
                 id=f'group-row-{group.group_name}'
             )
-        )
 
-    tbl_headers = ['Group Name', 'Users', 'Actions']
-    tbl = Table(Thead(Tr(*map(Th, tbl_headers))), Tbody(*rows, cls='list'), cls=(TableT.striped))
+def mk_group_rows(groups: list, next_after=None, search: str='', sort: str='name', desc: bool=False):
+    'Rows of one page of groups, followed by a row loading the next page if there is one'
+    rows = [mk_group_row(group) for group in groups]
+    if next_after is not None:
+        rows.append(LoadMoreRow(page_url('/groups/list', q=search, sort=sort, desc=desc, after=next_after), colspan=3))
+    return tuple(rows)
+
+def mk_group_list(groups: list, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    'Groups table with a sortable name header, showing the first page of groups'
+    if stream:
+        # Rows are streamed in place of the marker
+        rows = (StreamMarker(),)
+    else:
+        rows = mk_group_rows(groups, next_after, search, sort, desc) or (Tr(Td('No matching groups.', colspan=3)),)
+    headers = (SortHeader('Group Name', 'groups', '/groups/list', 'name', sort, desc), *map(Th, ['Users', 'Actions']))
+    return Div(ListParams('groups', sort, desc),
+               Table(Thead(Tr(*headers)), Tbody(*rows), cls=(TableT.striped)),
+               ShowAllLink('/groups', search, sort, desc) if next_after is not None else '',
+               id='groups-list')
+
+def mk_group_table(groups: list=None, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    'Create the groups list, a page at a time, searched and sorted on the server. With stream, rows are streamed in.'
+    if not groups and not search and not stream:
+        return Div(H3('No groups retrieved from Redshift.'), cls='mt-10 text-red-400')
+
     card_header=(H4('Redshift Groups'), Subtitle('Click on each group name to manage group details'))
     ctrls = DivFullySpaced(
-                Div(Input(cls='w-sm search', placeholder='Filter groups...')),
+                Div(ListSearch('groups', '/groups/list', search, placeholder='Filter groups...')),
                 Button(UkIcon('plus'), 'Add Group', 
                        cls=ButtonT.primary,
                        data_uk_toggle="target: #new-group-modal")
@@ -95,10 +107,10 @@ def mk_group_table(groups: list=None):
         id='new-group-modal'
     )
 
-    card = Card(ctrls, tbl, header=card_header, id='groups-table', cls='w-full lg:w-4/5 mb-6')
-    list_script = Script(f"new List('groups-table', {{ valueNames: {json.dumps(tbl_headers)} }})")
+    card = Card(ctrls, mk_group_list(groups, next_after, search, sort, desc, stream), header=card_header,
+                id='groups-table', cls='w-full lg:w-4/5 mb-6')
 
-    return DivVStacked(card, list_script, new_group_modal, cls='w-full lg:w-4/5')
+    return DivVStacked(card, new_group_modal, cls='w-full lg:w-4/5')
 
 # ===== Group Management =====
 
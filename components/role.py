@@ -1,13 +1,14 @@
 from fasthtml.common import *
 from monsterui.all import *
-import json
 from redshift.role import RedshiftRole
 from helpers.session_helper import *
+from helpers.streaming import StreamMarker
 from fasthtml.common import CheckboxX as fhCheckboxX
 from components.common import *
 
 __all__ = [
-    'mk_delete_role_modal', 'mk_role_link', 'mk_role_table', 'mk_role_nested_roles',
+    'mk_delete_role_modal', 'mk_role_link', 'mk_role_row', 'mk_role_rows', 'mk_role_list', 'mk_role_table',
+    'mk_role_nested_roles', 'mk_role_hierarchy_stats',
     'mk_schema_content', 'get_schema_content', 'mk_schema_nav', 'mk_role_privileges', 'mk_role_form'
 ]
 
@@ -42,29 +43,13 @@ def mk_role_link(role: RedshiftRole):
     else:
         return A(role.role_name, href='#', cls=TextT.muted)
 
-def mk_role_table(roles: list=None):
-    if not roles:
-        return Div(H3('No roles retrieved from Redshift.'), cls='mt-10 text-red-400')
-
-    rows = []
-    for role in roles:
-        rows.append(
-            Tr(
+def mk_role_row(role: RedshiftRole):
+    return Tr(
                 Td(role.role_id, cls='ID'),
                 Td(mk_role_link(role), cls='RoleName'),
                 Td(role.owner_name if role.owner_name else '-', cls='Owner'),
-                Td(
-                    Loading((LoadingT.dots, LoadingT.xs), htmx_indicator=True),
-                    hx_get=f'/role-users/{role.role_name}',
-                    hx_trigger='revealed',
-                    cls='Users',
-                ),
-                Td(
-                    Loading((LoadingT.dots, LoadingT.xs), htmx_indicator=True),
-                    hx_get=f'/role-nested-roles/{role.role_name}',
-                    hx_trigger='revealed',
-                    cls='NestedRoles',
-                ),
+                Td(BadgeList(sorted(role.users)) if role.users else '-', cls='Users'),
+                Td(BadgeList(sorted(role.nested_roles)) if role.nested_roles else '-', cls='NestedRoles'),
                 Td(
                     (Button(UkIcon('trash-2'), cls=(ButtonT.destructive, ButtonT.xs), 
                            data_uk_toggle=f"target: #delete-role-modal-{role.role_name}") if role.role_id >= 200_000 else '-'),
@@ -74,13 +59,37 @@ def mk_role_table(roles: list=None):
                 ),
                 id=f'role-row-{role.role_name}'
             )
-        )
 
-    tbl_headers = ['ID', 'Role Name', 'Owner', 'Users', 'Nested Roles', 'Actions']
-    tbl = Table(Thead(Tr(*map(Th, tbl_headers))), Tbody(*rows, cls='list'), cls=(TableT.striped))
+def mk_role_rows(roles: list, next_after=None, search: str='', sort: str='name', desc: bool=False):
+    'Rows of one page of roles, followed by a row loading the next page if there is one'
+    rows = [mk_role_row(role) for role in roles]
+    if next_after is not None:
+        rows.append(LoadMoreRow(page_url('/roles/list', q=search, sort=sort, desc=desc, after=next_after), colspan=6))
+    return tuple(rows)
+
+def mk_role_list(roles: list, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    'Roles table with sortable headers, showing the first page of roles'
+    if stream:
+        # Rows are streamed in place of the marker
+        rows = (StreamMarker(),)
+    else:
+        rows = mk_role_rows(roles, next_after, search, sort, desc) or (Tr(Td('No matching roles.', colspan=6)),)
+    headers = (SortHeader('ID', 'roles', '/roles/list', 'id', sort, desc),
+               SortHeader('Role Name', 'roles', '/roles/list', 'name', sort, desc),
+               *map(Th, ['Owner', 'Users', 'Nested Roles', 'Actions']))
+    return Div(ListParams('roles', sort, desc),
+               Table(Thead(Tr(*headers)), Tbody(*rows), cls=(TableT.striped)),
+               ShowAllLink('/roles', search, sort, desc) if next_after is not None else '',
+               id='roles-list')
+
+def mk_role_table(roles: list=None, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    'Create the roles list, a page at a time, searched and sorted on the server. With stream, rows are streamed in.'
+    if not roles and not search and not stream:
+        return Div(H3('No roles retrieved from Redshift.'), cls='mt-10 text-red-400')
+
     card_header=(H4('Redshift Roles'), Subtitle('Click on each role name to manage role details'))
     ctrls = DivFullySpaced(
-                Div(Input(cls='w-sm search', placeholder='Filter roles...')),
+                Div(ListSearch('roles', '/roles/list', search, placeholder='Filter roles...')),
                 Button(UkIcon('plus'), 'Add Role', 
                        cls=ButtonT.primary,
                        data_uk_toggle="target: #new-role-modal")
@@ -109,15 +118,22 @@ def mk_role_table(roles: list=None):
         id='new-role-modal'
     )
 
-    card = Card(ctrls, tbl, header=card_header, id='roles-table', cls='w-full lg:w-4/5 mb-6')
-    list_script = Script(f"new List('roles-table', {{ valueNames: {json.dumps(tbl_headers)} }})")
+    card = Card(ctrls, mk_role_list(roles, next_after, search, sort, desc, stream), header=card_header,
+                id='roles-table', cls='w-full lg:w-4/5 mb-6')
 
-    return DivVStacked(card, list_script, new_role_modal, cls='w-full lg:w-4/5')
+    return DivVStacked(card, new_role_modal, cls='w-full lg:w-4/5')
 
 # ===== Role Management =====
 
 # === Role Nested Roles ===
-def mk_role_nested_roles(role: RedshiftRole, all_roles: list):
+def mk_role_hierarchy_stats(stats: dict):
+    return HelpText(f"Nesting depth: {stats['depth']} · Nested roles: {stats['fan_out']} direct, "
+                    f"{stats['descendants']} in total · Inherited by {stats['ancestors']} roles")
+
+def mk_role_nested_roles(role: RedshiftRole, all_roles: list, graph=None):
+    # Roles that would make this role inherit from itself are not offered
+    options = [r.role_name for r in all_roles if r.role_name != role.role_name
+               and not (graph and graph.creates_cycle(role.role_name, r.role_name))]
     role_nested_roles_frm = Form(
                 DivFullySpaced(
                     H4('Nested Roles'), 
@@ -131,7 +147,8 @@ def mk_role_nested_roles(role: RedshiftRole, all_roles: list):
                 Div(
                     Hidden(id='role_name', value=role.role_name),
                     Hidden(id='nested_role_list_id', value='nested-role-list'),
-                    ListAddRemove(*SelectOptions([r.role_name for r in all_roles if r.role_name != role.role_name]), 
+                    (mk_role_hierarchy_stats(graph.stats(role.role_name)) if graph else ''),
+                    ListAddRemove(*SelectOptions(options), 
                                   items=role.nested_roles, placeholder='Select Role', 
                                   id='nested-role-select', ls_id='nested-role-list', 
                                   add_hx_post='/role/add-nested-role', remove_hx_post='/role/remove-nested-role'),
@@ -220,15 +237,14 @@ def mk_schema_content(schema: str, schema_privileges: dict, schema_relations: di
     )
         
     # Add new table relation section
-    # Use pre-loaded tables
+    # Tables are searched on the server as you type, schemas can hold thousands of them
     tables = schema_relations[schema]['tables']
     add_table_section = (Div(
         Form(
             DivFullySpaced(
                 H5('Tables'),
                 DivRAligned(
-                    Select(*SelectOptions(tables), id=f'new-table-{schema}', name=f'new-table-{schema}', 
-                        placeholder='Select Table'),
+                    ObjectPicker(schema, 'tables', id=f'new-table-{schema}', placeholder=f'Search {len(tables)} tables'),
                     Button('Load Table', id=f'btn-load-table-{schema}', cls=(ButtonT.secondary, ButtonT.sm)), 
                 ),
                 cls='space-x-2'
@@ -253,14 +269,14 @@ def mk_schema_content(schema: str, schema_privileges: dict, schema_relations: di
     )
         
     # Add new view relation section
-    # Use pre-loaded views
+    # Views are searched on the server as you type
     views = schema_relations[schema]['views']
     add_view_section = Div(
         Form(
             DivFullySpaced(
                 H5('Views'),
                 DivRAligned(
-                    Select(*SelectOptions(views), id=f'new-view-{schema}', placeholder='Select View'),
+                    ObjectPicker(schema, 'views', id=f'new-view-{schema}', placeholder=f'Search {len(views)} views'),
                     Button('Load View', id=f'btn-load-view-{schema}', cls=(ButtonT.secondary, ButtonT.sm)),
                 ),
                 cls='space-x-2'
@@ -285,25 +301,17 @@ def mk_schema_content(schema: str, schema_privileges: dict, schema_relations: di
     )
         
     # Add new function/procedure relation section
-    # Use pre-loaded functions and procedures
+    # Functions and procedures are searched on the server as you type
     # TODO: Both functions and procedures are combined, to make better UX.
-    funcs = schema_relations[schema]['functions']
-    funcs_vals = [f'FUNCTION:{f}' for f in funcs]
-    procs = schema_relations[schema]['procedures']
-    procs_vals = [f'PROCEDURE:{p}' for p in procs]
-    funcs_procs = funcs + procs
-    funcs_procs_vals = funcs_vals + procs_vals
+    funcs_count = len(schema_relations[schema]['functions']) + len(schema_relations[schema]['procedures'])
     
     add_func_section = Div(
         Form(
             DivFullySpaced(
                 H5('Functions & Procedures'),
                 DivRAligned(
-                    Select(
-                        *SelectOptions(funcs_procs, funcs_procs_vals),  
-                        id=f'new-func-{schema}', 
-                        placeholder='Select Function/Procedure'
-                    ),
+                    ObjectPicker(schema, 'functions', id=f'new-func-{schema}',
+                                 placeholder=f'Search {funcs_count} functions/procedures'),
                     Button('Load Function', id=f'btn-load-func-{schema}', cls=(ButtonT.secondary, ButtonT.sm)),
                 ),
                 cls='space-x-2'
@@ -331,25 +339,8 @@ def mk_schema_content(schema: str, schema_privileges: dict, schema_relations: di
 
 # Method to return schema content for HTMX
 def get_schema_content(role: RedshiftRole, schema: str, schema_relations=None):
-    # Group privileges by schema and object
-    privileges_by_schema = {}
-    for privilege in role.privileges:
-        schema_name = privilege['schema_name']
-        object_name = privilege['object_name']
-        object_type = privilege['object_type']
-        privilege_type = privilege['privilege_type']
-        
-        if schema_name not in privileges_by_schema:
-            privileges_by_schema[schema_name] = {}
-            
-        key = f"{object_type}:{object_name}"
-        if key not in privileges_by_schema[schema_name]:
-            privileges_by_schema[schema_name][key] = []
-            
-        privileges_by_schema[schema_name][key].append(privilege_type)
-    
-    # Get privileges for this schema
-    schema_privileges = privileges_by_schema.get(schema, {})
+    # Privileges of this schema from the index kept by the role's privilege set
+    schema_privileges = role.schema_privileges(schema)
     
     # Create and return schema content
     return mk_schema_content(schema, schema_privileges, schema_relations)
@@ -372,23 +363,6 @@ def mk_schema_nav(role_name:str, schemas: list, active_schema: str):
     )
 
 def mk_role_privileges(role: RedshiftRole, schemas: list, schema_relations=None):
-    # Group privileges by schema and object
-    privileges_by_schema = {}
-    for privilege in role.privileges:
-        schema_name = privilege['schema_name']
-        object_name = privilege['object_name']
-        object_type = privilege['object_type']
-        privilege_type = privilege['privilege_type']
-        
-        if schema_name not in privileges_by_schema:
-            privileges_by_schema[schema_name] = {}
-            
-        key = f"{object_type}:{object_name}"
-        if key not in privileges_by_schema[schema_name]:
-            privileges_by_schema[schema_name][key] = []
-            
-        privileges_by_schema[schema_name][key].append(privilege_type)
-    
     # Create initial schema content for the first schema
     initial_schema = schemas[0] if schemas else None
     initial_schema_content = get_schema_content(role, initial_schema, schema_relations) if initial_schema else Div()
@@ -426,7 +400,7 @@ def mk_role_privileges(role: RedshiftRole, schemas: list, schema_relations=None)
     return role_privileges_frm
 
 # ===== Main Role Form =====
-def mk_role_form(role: RedshiftRole, all_roles: list, schemas: list, schema_relations=None):
+def mk_role_form(role: RedshiftRole, all_roles: list, schemas: list, schema_relations=None, graph=None):
     rfrm = Card(
                 CardHeader(
                     DivFullySpaced(
@@ -437,9 +411,13 @@ def mk_role_form(role: RedshiftRole, all_roles: list, schemas: list, schema_rela
                     )
                 ),
                 CardBody(
-                    Div(mk_role_nested_roles(role, all_roles), id='role-nested-roles'),
+                    Div(mk_role_nested_roles(role, all_roles, graph), id='role-nested-roles'),
+                    DividerSplit(cls='my-4'),
+                    Div(mk_role_privileges(role, schemas, schema_relations), id='role-privileges'),
+                    DividerSplit(cls='my-4'),
+                    EffectivePrivileges(f'/role/effective-privileges/{role.role_name}'),
                     DividerSplit(cls='my-4'),
-                    Div(mk_role_privileges(role, schemas, schema_relations), id='role-privileges')
+                    CloneAccess('/role/clone-access', 'role')
                 ),
                 cls='w-full lg:w-4/5 mb-6'
         )
@@ -1,14 +1,13 @@
 from fasthtml.common import *
 from monsterui.all import *
-import json
 from redshift.user import RedshiftUser
 from helpers import *
 from fasthtml.common import CheckboxX as fhCheckboxX
 from components.common import *
 
 __all__ = [
-    'mk_delete_user_modal', 'mk_user_link', 'mk_user_table', 'mk_user_props', 
-    'mk_user_groups', 'mk_user_roles', 'mk_user_privileges',
+    'mk_delete_user_modal', 'mk_user_link', 'mk_user_row', 'mk_user_rows', 'mk_user_list', 'mk_user_table', 'mk_user_props', 
+    'mk_user_groups', 'mk_user_roles', 'mk_user_privileges', 'mk_import_users_modal', 'mk_import_report',
     'mk_user_schema_content', 'get_user_schema_content', 'mk_user_schema_nav', 'mk_user_form'
 ]
 
@@ -43,29 +42,13 @@ def mk_user_link(user: RedshiftUser):
     else:
         return A(user.user_name, href='#', cls=TextT.muted)
 
-def mk_user_table(users: RedshiftUser=None):
-    if not users:
-        return Div(H3('No users retrieved from Redshift.'), cls='mt-10 text-red-400')
-
-    rows = []
-    for user in users:
-        rows.append(
-            Tr(
+def mk_user_row(user: RedshiftUser):
+    return Tr(
                 Td(user.user_id, cls='ID'),
                 Td(mk_user_link(user), cls='Username'),
                 Td('✅' if user.super_user else '-'),
-                Td(
-                    Loading((LoadingT.dots, LoadingT.xs), htmx_indicator=True),
-                    hx_get=f'/user-groups/{user.user_id}',
-                    hx_trigger='revealed',
-                    cls='Groups',
-                ),
-                Td(
-                    Loading((LoadingT.dots, LoadingT.xs), htmx_indicator=True),
-                    hx_get=f'/user-roles/{user.user_id}',
-                    hx_trigger='revealed',
-                    cls='Roles',
-                ),
+                Td(BadgeList(user.groups) if user.groups else '-', cls='Groups'),
+                Td(BadgeList(user.roles) if user.roles else '-', cls='Roles'),
                 Td(
                     (Button(UkIcon('trash-2'), cls=(ButtonT.destructive, ButtonT.xs), 
                            data_uk_toggle=f"target: #delete-user-modal-{user.user_id}") if user.user_id > 100 else '-'),
@@ -75,17 +58,50 @@ def mk_user_table(users: RedshiftUser=None):
                 ),
                 id=f'user-row-{user.user_id}'
             )
-        )
 
-    tbl_headers = ['ID', 'Username', 'Super', 'Groups', 'Roles', 'Actions']
-    tbl = Table(Thead(Tr(*map(Th, tbl_headers))), Tbody(*rows, cls='list'), 
-                cls=(TableT.striped))
+def mk_user_rows(users: list, next_after=None, search: str='', sort: str='name', desc: bool=False):
+    'Rows of one page of users, followed by a row loading the next page if there is one'
+    rows = [mk_user_row(user) for user in users]
+    if next_after is not None:
+        rows.append(LoadMoreRow(page_url('/users/list', q=search, sort=sort, desc=desc, after=next_after), colspan=6))
+    return tuple(rows)
+
+def mk_user_list(users: list, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    'Users table with sortable headers, showing the first page of users'
+    if stream:
+        # Rows are streamed in place of the marker
+        rows = (StreamMarker(),)
+    else:
+        rows = mk_user_rows(users, next_after, search, sort, desc) or (Tr(Td('No matching users.', colspan=6)),)
+    headers = (SortHeader('ID', 'users', '/users/list', 'id', sort, desc),
+               SortHeader('Username', 'users', '/users/list', 'name', sort, desc),
+               *map(Th, ['Super', 'Groups', 'Roles', 'Actions']))
+    return Div(ListParams('users', sort, desc),
+               Table(Thead(Tr(*headers)), Tbody(*rows), cls=(TableT.striped)),
+               ShowAllLink('/users', search, sort, desc) if next_after is not None else '',
+               id='users-list')
+
+def mk_user_table(users: list=None, next_after=None, search: str='', sort: str='name', desc: bool=False, stream: bool=False):
+    """
+    Create the users list. Users are shown a page at a time, further pages are loaded
+    as the list is scrolled, and searching or sorting reloads it from the server.
+    With stream, the rows are left out, to be streamed in place of a StreamMarker.
+    """
+    if not users and not search and not stream:
+        return Div(H3('No users retrieved from Redshift.'), cls='mt-10 text-red-400')
+
     card_header=(H4('Redshift Users'), Subtitle('Click on each username to manage user details'))
     ctrls = DivFullySpaced(
-                Div(Input(cls='w-sm search', placeholder='Filter users...')),
-                Button(UkIcon('plus'), 'Add User', 
-                       cls=ButtonT.primary,
-                       data_uk_toggle="target: #new-user-modal")
+                Div(ListSearch('users', '/users/list', search, placeholder='Filter users...')),
+                DivRAligned(
+                    Button(UkIcon('upload'), 'Import Users',
+                           cls=ButtonT.default,
+                           data_uk_toggle="target: #import-users-modal"),
+                    Button(UkIcon('plus'), 'Add User', 
+                           cls=ButtonT.primary,
+                           data_uk_toggle="target: #new-user-modal"),
+                    cls='space-x-2'
+                )
     )
 
     # Create new user modal
@@ -131,12 +147,58 @@ def mk_user_table(users: RedshiftUser=None):
         id='new-user-modal'
     )
 
-    card = Card((ctrls, tbl), header=card_header, id='users-table', cls='w-full lg:w-4/5 mb-6')
-    list_script = Script(f"new List('users-table', {{ valueNames: {json.dumps(tbl_headers)} }})")
+    card = Card((ctrls, mk_user_list(users, next_after, search, sort, desc, stream)), header=card_header,
+                id='users-table', cls='w-full lg:w-4/5 mb-6')
 
-    return card, list_script, new_user_modal
+    return card, new_user_modal, mk_import_users_modal()
     # return DivVStacked(card, list_script, new_user_modal)
 
+# === Bulk user import ===
+def mk_import_users_modal():
+    return Modal(
+        ModalHeader(H3('Import Users')),
+        ModalBody(
+            Form(
+                FormSectionDiv(
+                    Input(type='file', id='file', accept='.csv,.json,.jsonl', required=True),
+                    HelpText('CSV with a header row, or JSON. Columns: user_name, password, super_user, can_create_db, '
+                             'connection_limit, session_timeout, syslog_access, password_expiry, groups, roles. '
+                             'Separate groups and roles with ; in CSV.'),
+                    HelpText('Every row is checked first. Nothing is created unless all rows are valid.'),
+                ),
+                DivFullySpaced(
+                    ModalCloseButton('Close', cls=ButtonT.default),
+                    Button('Import', id='btn-import-users', cls=ButtonT.primary),
+                    Loading((LoadingT.bars, LoadingT.lg, 'mx-4'), htmx_indicator=True),
+                ),
+                Div(id='import-users-report'),
+                cls='space-y-6',
+                hx_post='/users/import', hx_encoding='multipart/form-data',
+                hx_target='#import-users-report', hx_disabled_elt='#btn-import-users'
+            )
+        ),
+        id='import-users-modal'
+    )
+
+# Result of an import, one row per user of the file
+def mk_import_report(rows: list):
+    if not rows:
+        return P('No users found in the file.', cls=TextT.warning)
+    counts = {}
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    status_cls = {'created': TextT.success, 'failed': TextT.error, 'invalid': TextT.error}
+    return Div(
+        P(', '.join(f'{status.capitalize()}: {count}' for status, count in counts.items()), cls=TextT.bold),
+        Div(Table(
+            Thead(Tr(Th('Line'), Th('User'), Th('Status'), Th('Message'))),
+            Tbody(*[Tr(Td(row.line), Td(row.user_name), Td(row.status, cls=status_cls.get(row.status, '')),
+                       Td(row.message)) for row in rows]),
+            cls=(TableT.striped, TableT.sm)
+        ), cls='max-h-96 overflow-y-auto'),
+        cls='space-y-2'
+    )
+
 # ===== User Management =====
 
 # === User Properties ===
@@ -293,15 +355,14 @@ def mk_user_schema_content(schema: str, schema_privileges: dict, schema_relation
     )
         
     # Add new table relation section
-    # Use pre-loaded tables
+    # Tables are searched on the server as you type, schemas can hold thousands of them
     tables = schema_relations[schema]['tables']
     add_table_section = (Div(
         Form(
             DivFullySpaced(
                 H5('Tables'),
                 DivRAligned(
-                    Select(*SelectOptions(tables), id=f'new-table-{schema}', name=f'new-table-{schema}', 
-                        placeholder='Select Table'),
+                    ObjectPicker(schema, 'tables', id=f'new-table-{schema}', placeholder=f'Search {len(tables)} tables'),
                     Button('Load Table', id=f'btn-load-table-{schema}', cls=(ButtonT.secondary, ButtonT.sm)), 
                 ),
                 cls='space-x-2'
@@ -326,14 +387,14 @@ def mk_user_schema_content(schema: str, schema_privileges: dict, schema_relation
     )
         
     # Add new view relation section
-    # Use pre-loaded views
+    # Views are searched on the server as you type
     views = schema_relations[schema]['views']
     add_view_section = Div(
         Form(
             DivFullySpaced(
                 H5('Views'),
                 DivRAligned(
-                    Select(*SelectOptions(views), id=f'new-view-{schema}', placeholder='Select View'),
+                    ObjectPicker(schema, 'views', id=f'new-view-{schema}', placeholder=f'Search {len(views)} views'),
                     Button('Load View', id=f'btn-load-view-{schema}', cls=(ButtonT.secondary, ButtonT.sm)),
                 ),
                 cls='space-x-2'
@@ -358,25 +419,17 @@ def mk_user_schema_content(schema: str, schema_privileges: dict, schema_relation
     )
         
     # Add new function/procedure relation section
-    # Use pre-loaded functions and procedures
+    # Functions and procedures are searched on the server as you type
     # TODO: Both functions and procedures are combined, to make better UX.
-    funcs = schema_relations[schema]['functions']
-    funcs_vals = [f'FUNCTION:{f}' for f in funcs]
-    procs = schema_relations[schema]['procedures']
-    procs_vals = [f'PROCEDURE:{p}' for p in procs]
-    funcs_procs = funcs + procs
-    funcs_procs_vals = funcs_vals + procs_vals
+    funcs_count = len(schema_relations[schema]['functions']) + len(schema_relations[schema]['procedures'])
     
     add_func_section = Div(
         Form(
             DivFullySpaced(
                 H5('Functions & Procedures'),
                 DivRAligned(
-                    Select(
-                        *SelectOptions(funcs_procs, funcs_procs_vals),  
-                        id=f'new-func-{schema}', 
-                        placeholder='Select Function/Procedure'
-                    ),
+                    ObjectPicker(schema, 'functions', id=f'new-func-{schema}',
+                                 placeholder=f'Search {funcs_count} functions/procedures'),
                     Button('Load Function', id=f'btn-load-func-{schema}', cls=(ButtonT.secondary, ButtonT.sm)),
                 ),
                 cls='space-x-2'
@@ -404,25 +457,8 @@ def mk_user_schema_content(schema: str, schema_privileges: dict, schema_relation
 
 # Method to return schema content for HTMX
 def get_user_schema_content(user: RedshiftUser, schema: str, schema_relations=None):
-    # Group privileges by schema and object
-    privileges_by_schema = {}
-    for privilege in user.privileges:
-        schema_name = privilege['schema_name']
-        object_name = privilege['object_name']
-        object_type = privilege['object_type']
-        privilege_type = privilege['privilege_type']
-        
-        if schema_name not in privileges_by_schema:
-            privileges_by_schema[schema_name] = {}
-            
-        key = f"{object_type}:{object_name}"
-        if key not in privileges_by_schema[schema_name]:
-            privileges_by_schema[schema_name][key] = []
-            
-        privileges_by_schema[schema_name][key].append(privilege_type)
-    
-    # Get privileges for this schema
-    schema_privileges = privileges_by_schema.get(schema, {})
+    # Privileges of this schema from the index kept by the user's privilege set
+    schema_privileges = user.schema_privileges(schema)
     
     # Create and return schema content
     return mk_user_schema_content(schema, schema_privileges, schema_relations)
@@ -443,23 +479,6 @@ def mk_user_schema_nav(user_id: int, schemas: list, active_schema: str):
     )
 
 def mk_user_privileges(user: RedshiftUser, schemas: list, schema_relations=None):
-    # Group privileges by schema and object
-    privileges_by_schema = {}
-    for privilege in user.privileges:
-        schema_name = privilege['schema_name']
-        object_name = privilege['object_name']
-        object_type = privilege['object_type']
-        privilege_type = privilege['privilege_type']
-        
-        if schema_name not in privileges_by_schema:
-            privileges_by_schema[schema_name] = {}
-            
-        key = f"{object_type}:{object_name}"
-        if key not in privileges_by_schema[schema_name]:
-            privileges_by_schema[schema_name][key] = []
-            
-        privileges_by_schema[schema_name][key].append(privilege_type)
-    
     # Create initial schema content for the first schema
     initial_schema = schemas[0] if schemas else None
     initial_schema_content = get_user_schema_content(user, initial_schema, schema_relations) if initial_schema else Div()
@@ -520,7 +539,12 @@ def mk_user_form(user: RedshiftUser, all_groups: list, all_roles: list, schemas:
                     
                     # Add privileges section if schemas are provided
                     (Div(mk_user_privileges(user, schemas, schema_relations), id='user-privileges') 
-                     if schemas else '')
+                     if schemas else ''),
+                    DividerSplit(cls='my-4'),
+
+                    EffectivePrivileges(f'/user/effective-privileges/{user.user_id}'),
+                    DividerSplit(cls='my-4'),
+                    CloneAccess('/user/clone-access', 'user')
                 )
         )
 
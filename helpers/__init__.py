@@ -1 +1,2 @@
-from .session_helper import *
\ No newline at end of file
+from .session_helper import *
+from .streaming import *
\ No newline at end of file
@@ -1,32 +1,53 @@
 from typing import Any
 import pickle
+import secrets
 from redshift.database import Redshift
 from redshift.user import RedshiftUser
 from redshift.role import RedshiftRole
 from redshift.group import RedshiftGroup
+from helpers.session_store import get_session_store
+from redshift.metrics import observe_session_payload
 
 
 __all__ = [
-    'sess_store_obj', 'sess_get_obj', 'get_rs', 'set_rs',
+    'sess_id', 'sess_store_obj', 'sess_get_obj', 'sess_clear', 'get_rs', 'set_rs',
     'get_user', 'set_user', 'get_role', 'set_role',
-    'get_group', 'set_group'
+    'get_group', 'set_group', 'get_access_state', 'set_access_state'
     ]
 
+# Objects are kept in the server-side session store, the cookie session only carries an opaque id.
+def sess_id(session: dict) -> str:
+    'get session id, assigning a new one if the session has none'
+    if 'sid' not in session:
+        session['sid'] = secrets.token_urlsafe(32)
+    return session['sid']
+
 def sess_store_obj(session: dict, key: str, obj:Any):
-    'store pickled object in session'
+    'store pickled object in server-side session store'
     try:
-        session[key] = pickle.dumps(obj).hex()
+        data = pickle.dumps(obj)
+        observe_session_payload(key, len(data))
+        get_session_store().set(sess_id(session), key, data)
     except Exception as e:
         print(f'Error pickling {key}: {e}')
 
 def sess_get_obj(session: dict, key: str):
-    'get pickled object from session'
+    'get pickled object from server-side session store'
     try:
-        return pickle.loads(bytes.fromhex(session.get(key)))
+        sid = session.get('sid')
+        data = get_session_store().get(sid, key) if sid else None
+        return pickle.loads(data) if data is not None else None
     except Exception as e:
         print(f'Error unpickling {key}: {e}')
         return None
 
+def sess_clear(session: dict):
+    'clear session and its server-side objects'
+    sid = session.get('sid')
+    if sid:
+        get_session_store().delete(sid)
+    session.clear()
+
 def set_rs(session: dict, rs: Redshift):
     sess_store_obj(session, 'redshift', rs)
 
@@ -50,3 +71,10 @@ def set_group(session, group: RedshiftGroup):
 
 def get_group(session) -> RedshiftGroup:
     return sess_get_obj(session, 'rsgroup')
+
+# Desired state of the last plan, applied once confirmed
+def set_access_state(session, state):
+    sess_store_obj(session, 'access_state', state)
+
+def get_access_state(session):
+    return sess_get_obj(session, 'access_state')
@@ -0,0 +1,153 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from cryptography.fernet import InvalidToken
+from redshift.cache import TTLCache
+from redshift.database import Redshift
+
+__all__ = ['SessionStore', 'MemorySessionStore', 'SQLiteSessionStore',
+           'get_session_store', 'set_session_store']
+
+# Session store settings, overridable through env vars
+SESSION_BACKEND = os.environ.get('RSMATE_SESSION_BACKEND', 'memory')
+SESSION_DB = os.environ.get('RSMATE_SESSION_DB', 'rsmate_sessions.db')
+SESSION_TTL = float(os.environ.get('RSMATE_SESSION_TTL', 8 * 60 * 60))
+SESSION_MAX = int(os.environ.get('RSMATE_SESSION_MAX', 1000))
+
+
+class SessionStore(ABC):
+    'Server-side storage of pickled session objects, keyed by session id and key.'
+
+    @abstractmethod
+    def get(self, sid: str, key: str):
+        ...
+
+    @abstractmethod
+    def set(self, sid: str, key: str, value: bytes):
+        ...
+
+    @abstractmethod
+    def delete(self, sid: str, key: str = None):
+        'Delete one key of a session, or the whole session if key is None.'
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store. Sessions expire ttl seconds after their last write
+    and the least recently used ones are evicted beyond max_sessions.
+    Only suitable for a single worker process.
+    """
+
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX):
+        self._sessions = TTLCache(maxsize=max_sessions, ttl=ttl, name='sessions')
+        self._lock = threading.Lock()
+
+    def get(self, sid, key):
+        data = self._sessions.get(sid)
+        return data.get(key) if data else None
+
+    def set(self, sid, key, value):
+        with self._lock:
+            data = self._sessions.get(sid) or {}
+            data[key] = value
+            # re-setting refreshes the expiry and LRU position
+            self._sessions.set(sid, data)
+
+    def delete(self, sid, key=None):
+        with self._lock:
+            if key is None:
+                self._sessions.pop(sid)
+            else:
+                data = self._sessions.get(sid)
+                if data:
+                    data.pop(key, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in a SQLite file, shared by all worker processes on the host.
+    Sessions expire ttl seconds after their last write.
+
+    Values hold connection details, passwords included, so they are encrypted with
+    Redshift.get_fernet() and the file is only readable by its owner. Workers must
+    share RSMATE_FERNET_KEY to read each other's sessions.
+    """
+
+    def __init__(self, path: str = SESSION_DB, ttl: float = SESSION_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fernet = Redshift.get_fernet()
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        os.chmod(path, 0o600)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid     TEXT NOT NULL,
+                key     TEXT NOT NULL,
+                value   BLOB,
+                expires REAL NOT NULL,
+                PRIMARY KEY (sid, key)
+            )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+        self._last_purge = 0.0
+
+    def _purge_expired(self, now: float):
+        # At most once a minute
+        if now - self._last_purge > 60:
+            self._conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+            self._last_purge = now
+
+    def get(self, sid, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM sessions WHERE sid = ? AND key = ? AND expires >= ?',
+                                     (sid, key, time.time())).fetchone()
+        if not row or row[0] is None:
+            return None
+        try:
+            return self._fernet.decrypt(row[0])
+        except InvalidToken:
+            # Written with another key, e.g. before a restart without RSMATE_FERNET_KEY
+            return None
+
+    def set(self, sid, key, value):
+        now = time.time()
+        value = self._fernet.encrypt(value) if value is not None else None
+        with self._lock:
+            self._purge_expired(now)
+            self._conn.execute('INSERT OR REPLACE INTO sessions (sid, key, value, expires) VALUES (?, ?, ?, ?)',
+                               (sid, key, value, now + self.ttl))
+            # keep the other keys of the session alive too
+            self._conn.execute('UPDATE sessions SET expires = ? WHERE sid = ?', (now + self.ttl, sid))
+
+    def delete(self, sid, key=None):
+        with self._lock:
+            if key is None:
+                self._conn.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+            else:
+                self._conn.execute('DELETE FROM sessions WHERE sid = ? AND key = ?', (sid, key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store() -> SessionStore:
+    'Get the configured session store, created on first use from RSMATE_SESSION_BACKEND.'
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_BACKEND == 'sqlite':
+                _store = SQLiteSessionStore()
+            elif SESSION_BACKEND == 'memory':
+                _store = MemorySessionStore()
+            else:
+                raise ValueError(f'Unknown session backend: {SESSION_BACKEND}')
+        return _store
+
+def set_session_store(store: SessionStore):
+    'Plug in a session store, e.g. a custom backend.'
+    global _store
+    with _store_lock:
+        _store = store
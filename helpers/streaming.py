@@ -0,0 +1,44 @@
+from fasthtml.common import *
+
+__all__ = ['StreamMarker', 'stream_page']
+
+# Placeholder in a page that streamed chunks are written in place of
+STREAM_MARKER = '<!--rsmate-stream-->'
+
+def StreamMarker(): return NotStr(STREAM_MARKER)
+
+def stream_page(req, page, chunks, error=None) -> StreamingResponse:
+    """
+    Stream a page containing a StreamMarker
+    
+    The page is rendered as usual (a full document, or a fragment for htmx requests) and
+    sent up to the marker straight away. Each chunk of FT components from the async
+    iterable chunks is then sent as soon as it is produced, followed by the rest of the page.
+    
+    Args:
+        req: The request
+        page: FT components of the page, e.g. a MainLayout
+        chunks: Async iterable of FT components rendered in place of the marker
+        error: Function of an exception raised by chunks, returning FT components sent
+               in its place, e.g. an error row. A paragraph with the error by default
+        
+    Returns:
+        StreamingResponse: Chunked HTML response
+    """
+    page = flat_tuple(page)
+    heads, bdy = partition(page, lambda o: getattr(o, 'tag', '') in ('title', 'meta', 'link', 'style', 'base'))
+    html = to_xml(bdy if 'hx-request' in req.headers else respond(req, heads, bdy))
+    head, tail = html.split(STREAM_MARKER, 1)
+
+    async def body():
+        yield head
+        try:
+            async for chunk in chunks:
+                yield to_xml(chunk)
+        except Exception as e:
+            # Headers are already sent, so show the error and end the page instead of failing the response
+            print(f"Error streaming page: {e}")
+            yield to_xml(error(e) if error else P(f'Error loading the page: {e}', cls='text-red-400'))
+        yield tail
+
+    return StreamingResponse(body(), media_type='text/html; charset=utf-8')
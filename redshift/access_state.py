@@ -0,0 +1,374 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass, field
+import redshift.sql_queries as sql
+from redshift.database import Redshift, map_rows
+from redshift.privilege import Privilege, PrivilegeSet, build_privilege_statements
+from redshift.role_graph import RoleGraph, role_graph_cache
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Plan statements run per transaction on apply, overridable through env var
+APPLY_BATCH_SIZE = int(os.environ.get('RSMATE_APPLY_BATCH_SIZE', 500))
+
+# Principal names go into DDL as is. Role names may have a : as Redshift's sys: roles do
+PRINCIPAL_NAME_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_$:]{0,126}$')
+# Schema and object names must not break out of a statement
+OBJECT_NAME_RE = re.compile(r'^[^\s;\'"(),]+$')
+OBJECT_TYPES = ('TABLE', 'VIEW', 'FUNCTION', 'PROCEDURE')
+PRIVILEGE_TYPES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REFERENCES', 'DROP',
+                   'ALTER', 'TRUNCATE', 'RULE', 'TRIGGER', 'EXECUTE')
+
+
+@dataclass
+class PrincipalAccess:
+    'Access of one user or role. roles are the roles granted to it, nested roles for a role.'
+    groups: set = field(default_factory=set)
+    roles: set = field(default_factory=set)
+    privileges: PrivilegeSet = field(default_factory=PrivilegeSet)
+
+
+@dataclass
+class AccessState:
+    """
+    Users, groups and roles of a cluster with group memberships, granted roles and privileges
+
+    The same shape holds the live state of a cluster and the desired state of a file.
+    Desired state only covers the users and roles in the file, others are left alone.
+    """
+    users: dict = field(default_factory=dict)     # user name -> PrincipalAccess
+    groups: set = field(default_factory=set)
+    roles: dict = field(default_factory=dict)     # role name -> PrincipalAccess
+
+    # ===== Live state =====
+
+    @classmethod
+    def from_rows(cls, users, group_users, user_roles, roles, nested_roles,
+                  user_privileges, role_privileges) -> 'AccessState':
+        'Build the state from the rows of the bulk queries run by load'
+        state = cls()
+        # System users (ids up to 100) are not managed by RSMate
+        names = {u.user_id: u.user_name for u in map_rows(users) if u.user_id > 100}
+        state.users = {name: PrincipalAccess() for name in names.values()}
+        for group_name, user_name in group_users or []:
+            state.groups.add(group_name)
+            if user_name in state.users:
+                state.users[user_name].groups.add(group_name)
+        for user_id, role_name in user_roles or []:
+            if user_id in names:
+                state.users[names[user_id]].roles.add(role_name)
+        # Redshift's built-in sys: roles cannot be changed
+        state.roles = {r.role_name: PrincipalAccess() for r in map_rows(roles) if not r.role_name.startswith('sys:')}
+        for role_name, nested_role_name in nested_roles or []:
+            if role_name in state.roles:
+                state.roles[role_name].roles.add(nested_role_name)
+        for principals, rows in ((state.users, user_privileges), (state.roles, role_privileges)):
+            privileges = {}
+            for row in rows or []:
+                privileges.setdefault(row[0], []).append(row[1:])
+            for name, access in principals.items():
+                access.privileges = PrivilegeSet.from_rows(privileges.get(name))
+        return state
+
+    @classmethod
+    def load(cls, rs: Redshift) -> 'AccessState':
+        'Load the live state of a cluster in seven queries, whatever its size'
+        return cls.from_rows(
+            rs.execute_query(sql.GET_ALL_USERS),
+            rs.execute_query(sql.GET_ALL_GROUP_USERS),
+            rs.execute_query(sql.GET_ALL_USER_ROLES),
+            rs.execute_query(sql.GET_ALL_ROLES),
+            rs.execute_query(sql.GET_ALL_ROLE_NESTED_ROLES),
+            rs.execute_query(sql.GET_ALL_USERS_PRIVILEGES, (rs.name, rs.name)),
+            rs.execute_query(sql.GET_ALL_ROLES_PRIVILEGES, (rs.name, rs.name)),
+        )
+
+    @classmethod
+    async def load_async(cls, rs: Redshift) -> 'AccessState':
+        'Load the live state, the queries run concurrently on pooled connections'
+        results = await asyncio.gather(
+            rs.execute_query_async(sql.GET_ALL_USERS),
+            rs.execute_query_async(sql.GET_ALL_GROUP_USERS),
+            rs.execute_query_async(sql.GET_ALL_USER_ROLES),
+            rs.execute_query_async(sql.GET_ALL_ROLES),
+            rs.execute_query_async(sql.GET_ALL_ROLE_NESTED_ROLES),
+            rs.execute_query_async(sql.GET_ALL_USERS_PRIVILEGES, (rs.name, rs.name)),
+            rs.execute_query_async(sql.GET_ALL_ROLES_PRIVILEGES, (rs.name, rs.name)),
+        )
+        return cls.from_rows(*results)
+
+    # ===== Desired state files =====
+
+    def to_dict(self) -> dict:
+        'Plain dict of the state, sorted so exports of the same state are identical'
+        def privileges(privilege_set):
+            return {schema: {obj: sorted(types) for obj, types in sorted(privilege_set.schema_privileges(schema).items())}
+                    for schema in sorted(privilege_set.schemas())}
+        return {
+            'groups': sorted(self.groups),
+            'roles': {name: {'nested_roles': sorted(a.roles), 'privileges': privileges(a.privileges)}
+                      for name, a in sorted(self.roles.items())},
+            'users': {name: {'groups': sorted(a.groups), 'roles': sorted(a.roles), 'privileges': privileges(a.privileges)}
+                      for name, a in sorted(self.users.items())},
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> 'AccessState':
+        """
+        Desired state from a dict in the shape to_dict makes
+
+        Privileges are {schema: {'TYPE:object_name': [privilege types]}}.
+
+        Raises:
+            ValueError: Listing every malformed name or value found
+        """
+        if not isinstance(data, dict):
+            raise ValueError('Desired state must be an object with groups, roles and users')
+        errors = []
+
+        def names(value, what: str) -> set:
+            if not isinstance(value, list):
+                errors.append(f'{what} must be a list')
+                return set()
+            bad = [n for n in value if not isinstance(n, str) or not PRINCIPAL_NAME_RE.match(n)]
+            errors.extend(f'{what}: invalid name {n!r}' for n in bad)
+            # Redshift folds unquoted names to lower case, as the live state lists them
+            return {n.lower() for n in value if n not in bad}
+
+        def privileges(value, what: str) -> PrivilegeSet:
+            privilege_set = PrivilegeSet()
+            if not isinstance(value, dict):
+                errors.append(f'{what} privileges must be an object of schemas')
+                return privilege_set
+            for schema_name, objects in value.items():
+                if not isinstance(schema_name, str) or not OBJECT_NAME_RE.match(schema_name) or not isinstance(objects, dict):
+                    errors.append(f'{what} privileges: invalid schema {schema_name!r}')
+                    continue
+                for key, types in objects.items():
+                    object_type, _, object_name = key.partition(':') if isinstance(key, str) else ('', '', '')
+                    if object_type not in OBJECT_TYPES or not OBJECT_NAME_RE.match(object_name):
+                        errors.append(f'{what} privileges: invalid object {schema_name}.{key}, expected TYPE:name')
+                        continue
+                    if not isinstance(types, list):
+                        errors.append(f'{what} privileges: {schema_name}.{key} must be a list of privileges')
+                        continue
+                    for privilege_type in types:
+                        if privilege_type not in PRIVILEGE_TYPES:
+                            errors.append(f'{what} privileges: invalid privilege {privilege_type!r} on {schema_name}.{object_name}')
+                        else:
+                            privilege_set.add(Privilege.create(schema_name, object_name, object_type, privilege_type))
+            return privilege_set
+
+        def principals(value, what: str, fields: tuple) -> dict:
+            if not isinstance(value, dict):
+                errors.append(f'{what} must be an object')
+                return {}
+            result = {}
+            for name, spec in value.items():
+                if not isinstance(name, str) or not PRINCIPAL_NAME_RE.match(name) or not isinstance(spec, dict):
+                    errors.append(f'{what}: invalid entry {name!r}')
+                    continue
+                if name.lower() in result:
+                    errors.append(f'{what}: {name!r} is listed twice, names are not case sensitive')
+                    continue
+                access = PrincipalAccess()
+                for key, attr in fields:
+                    setattr(access, attr, names(spec.get(key, []), f'{name} {key}'))
+                access.privileges = privileges(spec.get('privileges', {}), name)
+                result[name.lower()] = access
+            return result
+
+        state = cls(groups=names(data.get('groups', []), 'groups'),
+                    roles=principals(data.get('roles', {}), 'roles', (('nested_roles', 'roles'),)),
+                    users=principals(data.get('users', {}), 'users', (('groups', 'groups'), ('roles', 'roles'))))
+        if errors:
+            raise ValueError('; '.join(errors))
+        return state
+
+
+def export_state(state: AccessState, fmt: str = 'json') -> str:
+    'Desired state file text of a state, JSON or YAML'
+    if fmt == 'yaml':
+        if yaml is None:
+            raise ValueError('YAML needs PyYAML, pip install pyyaml')
+        return yaml.safe_dump(state.to_dict(), sort_keys=False)
+    return json.dumps(state.to_dict(), indent=2)
+
+
+def read_state(data, filename: str = '') -> AccessState:
+    """
+    Desired state from the text of a JSON or YAML file
+
+    Raises:
+        ValueError: If the file cannot be read or the state is malformed
+    """
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    if filename.lower().endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise ValueError('YAML needs PyYAML, pip install pyyaml')
+        try:
+            return AccessState.from_dict(yaml.safe_load(text))
+        except yaml.YAMLError as e:
+            raise ValueError(f'Could not read file: {e}')
+    return AccessState.from_dict(json.loads(text))
+
+
+# ===== Plan =====
+
+@dataclass
+class AccessPlan:
+    'Statements taking a cluster from its live state to a desired state, and why it cannot if it cannot.'
+    statements: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    counts: dict = field(default_factory=dict)
+
+    @property
+    def digest(self) -> str:
+        'Fingerprint of the statements, to check the plan applied is the plan shown'
+        return hashlib.sha256('\n'.join(self.statements).encode()).hexdigest()
+
+
+def merge_privilege_changes(changes: dict, action: str) -> list:
+    """
+    GRANT or REVOKE statements for privilege changes of many grantees
+
+    Grantees getting the same privileges share statements, e.g. GRANT SELECT ON s.t1, s.t2 TO a, b,
+    so a change applied to many users or roles costs about as many statements as for one.
+
+    Args:
+        changes: Grantee clause (a user name or ROLE role_name) -> list of privileges
+        action: 'GRANT' or 'REVOKE'
+    """
+    grantees = {}
+    for grantee, privileges in changes.items():
+        for privilege in privileges:
+            grantees.setdefault(privilege._replace(is_grantable=False), set()).add(grantee)
+    groups = {}
+    for privilege, grantee_set in grantees.items():
+        groups.setdefault(frozenset(grantee_set), []).append(privilege)
+    statements = []
+    for grantee_set, privileges in sorted(groups.items(), key=lambda g: sorted(g[0])):
+        grantee = ', '.join(sorted(grantee_set))
+        privileges.sort()
+        if action == 'GRANT':
+            statements += [s.sql for s in build_privilege_statements(grantee, grants=privileges)]
+        else:
+            statements += [s.sql for s in build_privilege_statements(grantee, revokes=privileges)]
+    return statements
+
+
+def plan_access(desired: AccessState, live: AccessState) -> AccessPlan:
+    """
+    Minimal statements taking the live state to the desired one, computed in memory
+
+    Users and roles in the desired state get exactly its groups, roles and privileges.
+    Users and roles not in it are left alone, and nothing is ever dropped. Missing
+    groups and roles are created. Users are not, as they need passwords.
+
+    Statements are ordered creates, then removals, then additions, so every step
+    of the plan is valid on its own.
+
+    Returns:
+        AccessPlan: With errors instead of statements if the desired state cannot be reached
+    """
+    plan = AccessPlan()
+    groups = live.groups | desired.groups
+    # sys: roles are not in the states but can be granted
+    roles = set(live.roles) | set(desired.roles)
+
+    plan.errors += [f'User {u} does not exist, create it first' for u in sorted(set(desired.users) - set(live.users))]
+    for name, access in sorted(desired.users.items()):
+        plan.errors += [f'User {name}: group {g} does not exist' for g in sorted(access.groups - groups)]
+        plan.errors += [f'User {name}: role {r} does not exist' for r in sorted(access.roles - roles) if not r.startswith('sys:')]
+    for name, access in sorted(desired.roles.items()):
+        plan.errors += [f'Role {name}: nested role {r} does not exist' for r in sorted(access.roles - roles) if not r.startswith('sys:')]
+    # Nested roles once the plan is applied: desired roles as in the file, others as they are
+    edges = [(name, r) for name, a in {**live.roles, **desired.roles}.items() for r in a.roles]
+    graph = RoleGraph(edges)
+    plan.errors += [f'Role {r} would inherit from itself' for r in sorted({e[0] for e in edges}) if r in graph.descendants(r)]
+    if plan.errors:
+        return plan
+
+    creates = ([f'CREATE GROUP {g};' for g in sorted(desired.groups - live.groups)]
+               + [f'CREATE ROLE {r};' for r in sorted(set(desired.roles) - set(live.roles))])
+    drop_members, add_members = {}, {}
+    role_revokes, role_grants = [], []
+    privilege_revokes, privilege_grants = {}, {}
+    for principals, live_principals, grantee in ((desired.users, live.users, lambda n: n),
+                                                 (desired.roles, live.roles, lambda n: f'ROLE {n}')):
+        for name, access in sorted(principals.items()):
+            current = live_principals.get(name, PrincipalAccess())
+            for g in sorted(current.groups - access.groups):
+                drop_members.setdefault(g, []).append(name)
+            for g in sorted(access.groups - current.groups):
+                add_members.setdefault(g, []).append(name)
+            role_revokes += [f'REVOKE ROLE {r} FROM {grantee(name)};' for r in sorted(current.roles - access.roles)]
+            role_grants += [f'GRANT ROLE {r} TO {grantee(name)};' for r in sorted(access.roles - current.roles)]
+            to_grant, to_revoke = current.privileges.diff(access.privileges)
+            if to_revoke:
+                privilege_revokes[grantee(name)] = to_revoke
+            if to_grant:
+                privilege_grants[grantee(name)] = to_grant
+
+    plan.statements = (
+        creates
+        + [f"ALTER GROUP {g} DROP USER {', '.join(users)};" for g, users in sorted(drop_members.items())]
+        + role_revokes
+        + merge_privilege_changes(privilege_revokes, 'REVOKE')
+        + [f"ALTER GROUP {g} ADD USER {', '.join(users)};" for g, users in sorted(add_members.items())]
+        + role_grants
+        + merge_privilege_changes(privilege_grants, 'GRANT')
+    )
+    plan.counts = {
+        'Creates': len(creates),
+        'Membership changes': sum(map(len, drop_members.values())) + sum(map(len, add_members.values())),
+        'Role grants and revokes': len(role_revokes) + len(role_grants),
+        'Privileges revoked': sum(map(len, privilege_revokes.values())),
+        'Privileges granted': sum(map(len, privilege_grants.values())),
+    }
+    return plan
+
+
+# ===== Apply =====
+
+@dataclass
+class BatchResult:
+    'Outcome of one transaction of an applied plan.'
+    statements: list
+    success: bool = False
+    error: str = ''
+
+
+def apply_plan(plan: AccessPlan, rs: Redshift, batch_size: int = APPLY_BATCH_SIZE) -> list:
+    """
+    Run a plan's statements in order, batch_size statements per transaction
+
+    Stops at the first batch that fails, as later statements can depend on it.
+    That batch is rolled back, batches before it stay applied and applying a new
+    plan of the same file picks up from there.
+
+    Returns:
+        list: BatchResult per batch, not run batches included with error Not executed
+    """
+    batches = [BatchResult(plan.statements[i:i + batch_size]) for i in range(0, len(plan.statements), batch_size)]
+    failed = False
+    for batch in batches:
+        if failed:
+            batch.error = 'Not executed'
+            continue
+        results = rs.execute_batch(batch.statements)
+        batch.success = all(r.success for r in results)
+        if not batch.success:
+            failed = True
+            error = next((r for r in results if r.error and r.error not in ('Rolled back', 'Not executed')), None)
+            batch.error = f'{error.sql} {error.error}' if error else 'Rolled back'
+    if any(b.success for b in batches):
+        # Roles may have been created and nested
+        role_graph_cache.pop(rs.catalog_key())
+    return batches
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from . import metrics
+
+# Catalog cache settings, overridable through env vars
+CATALOG_CACHE_SIZE = int(os.environ.get('RSMATE_CATALOG_CACHE_SIZE', 16))
+CATALOG_CACHE_TTL = float(os.environ.get('RSMATE_CATALOG_CACHE_TTL', 300))
+
+_MISSING = object()
+
+
+# Caches reporting on /metrics, by name
+named_caches = {}
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire ttl seconds after they were stored.
+
+    Once maxsize entries are held, the least recently used one is evicted.
+    Caches given a name report their stats on /metrics.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 300, name: str = None):
+        if name:
+            named_caches[name] = self
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()      # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING and item[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_load(self, key, loader):
+        'Get a cached value, calling loader() and caching its result on a miss.'
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, _MISSING)
+            return default if item is _MISSING else item[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> dict:
+        'Current occupancy and hit/miss counters.'
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+# Process-wide cache of schema relations, keyed by (host, port, database)
+catalog_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL, name='catalog')
+
+
+def _register_metrics():
+    'Occupancy and hit/miss counters of the named caches, read when metrics are rendered'
+    def samples(stat):
+        return lambda: [((name,), cache.stats()[stat]) for name, cache in list(named_caches.items())]
+    metrics.registry.register(metrics.Gauge('rsmate_cache_size', 'Entries held by each cache', ('cache',), samples('size')))
+    metrics.registry.register(metrics.Gauge('rsmate_cache_maxsize', 'Max entries of each cache', ('cache',), samples('maxsize')))
+    metrics.registry.register(metrics.Counter('rsmate_cache_hits_total', 'Lookups served by each cache', ('cache',), samples('hits')))
+    metrics.registry.register(metrics.Counter('rsmate_cache_misses_total', 'Lookups missed by each cache', ('cache',), samples('misses')))
+
+
+_register_metrics()
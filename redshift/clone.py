@@ -0,0 +1,233 @@
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+import redshift.sql_queries as sql
+from redshift.database import Redshift
+from redshift.privilege import PrivilegeSet, build_privilege_statements
+from redshift.role_graph import get_role_graph
+from redshift.user import RedshiftUser
+from redshift.role import RedshiftRole
+
+
+@dataclass
+class AccessDelta:
+    'Changes giving one target user or role the groups, roles and privileges of a source.'
+    target: str
+    add_groups: list = field(default_factory=list)
+    drop_groups: list = field(default_factory=list)
+    grant_roles: list = field(default_factory=list)
+    revoke_roles: list = field(default_factory=list)
+    grants: list = field(default_factory=list)
+    revokes: list = field(default_factory=list)
+    error: Optional[str] = None
+    success: bool = False
+
+    def is_empty(self) -> bool:
+        return not (self.add_groups or self.drop_groups or self.grant_roles
+                    or self.revoke_roles or self.grants or self.revokes)
+
+    def summary(self) -> str:
+        'Short description of the changes, for reports.'
+        parts = [(len(self.add_groups), 'groups added'), (len(self.drop_groups), 'groups dropped'),
+                 (len(self.grant_roles), 'roles granted'), (len(self.revoke_roles), 'roles revoked'),
+                 (len(self.grants), 'privileges granted'), (len(self.revokes), 'privileges revoked')]
+        return ', '.join(f'{n} {label}' for n, label in parts if n) or 'Already up to date'
+
+
+def parse_target_names(text: str) -> list:
+    'Lower case principal names, as DDL folds them, from text separated by commas, semicolons, spaces or new lines, in order without duplicates.'
+    return list(dict.fromkeys(n.lower() for n in re.split(r'[\s,;]+', text or '') if n))
+
+
+def _delta(target: str, source_privileges: PrivilegeSet, privileges: PrivilegeSet, source_roles, roles,
+           source_groups=(), groups=(), exact: bool = False) -> AccessDelta:
+    # Computed in memory from bulk loaded state, the same way privileges forms are diffed
+    to_grant, to_revoke = privileges.diff(source_privileges)
+    delta = AccessDelta(target,
+                        add_groups=sorted(set(source_groups) - set(groups)),
+                        grant_roles=sorted(set(source_roles) - set(roles)),
+                        grants=[p._replace(is_grantable=False) for p in to_grant])
+    if exact:
+        delta.drop_groups = sorted(set(groups) - set(source_groups))
+        delta.revoke_roles = sorted(set(roles) - set(source_roles))
+        delta.revokes = to_revoke
+    return delta
+
+
+def plan_user_clone(source: RedshiftUser, target_names: list, rs: Redshift, exact: bool = False) -> list:
+    """
+    Changes giving each target user the groups, roles and privileges of a source user
+
+    The targets' current state is read in bulk, four queries whatever the number of targets.
+
+    Args:
+        source: Source user with groups, roles and privileges loaded
+        target_names: Names of the target users
+        rs: Redshift connection
+        exact: Also drop groups, roles and privileges the source does not have
+
+    Returns:
+        list: AccessDelta per target, with error set for targets that cannot be cloned onto
+    """
+    names = [n for n in target_names if n != source.user_name]
+    if not names:
+        return []
+    query = sql.GET_USER_IDS_BY_NAMES.format(names=rs.placeholders(len(names)))
+    ids = {user_name: user_id for user_id, user_name in rs.execute_query(query, tuple(names)) or []}
+    user_ids = list(ids.values())
+    groups = RedshiftUser.get_all_user_groups(rs, user_ids)
+    roles = RedshiftUser.get_all_user_roles(rs, user_ids)
+    privileges = {}
+    if user_ids:
+        query = sql.GET_USERS_PRIVILEGES.format(ids=rs.placeholders(len(user_ids)))
+        for row in rs.execute_query(query, (rs.name, *user_ids, rs.name, *user_ids)) or []:
+            privileges.setdefault(row[0], []).append(row[1:])
+
+    deltas = []
+    for name in names:
+        if name not in ids:
+            deltas.append(AccessDelta(name, error='User not found'))
+            continue
+        user_id = ids[name]
+        deltas.append(_delta(name, source.privileges, PrivilegeSet.from_rows(privileges.get(user_id)),
+                             source.roles, roles.get(user_id, []), source.groups, groups.get(user_id, []), exact))
+    return deltas
+
+
+def plan_role_clone(source: RedshiftRole, target_names: list, rs: Redshift, exact: bool = False) -> list:
+    """
+    Changes giving each target role the nested roles and privileges of a source role
+
+    The targets' current state is read in bulk and nested roles are checked against
+    the role graph, targets that would end up inheriting from themselves are left out.
+
+    Args:
+        source: Source role with nested roles and privileges loaded
+        target_names: Names of the target roles
+        rs: Redshift connection
+        exact: Also revoke nested roles and privileges the source does not have
+
+    Returns:
+        list: AccessDelta per target, with error set for targets that cannot be cloned onto
+    """
+    names = [n for n in target_names if n != source.role_name]
+    if not names:
+        return []
+    existing = {r.role_name for r in rs.fetch_as(None, sql.GET_ALL_ROLES)}
+    found = [n for n in names if n in existing]
+    nested_roles = RedshiftRole.get_all_role_nested_roles(rs, found)
+    privileges = {}
+    if found:
+        query = sql.GET_ROLES_PRIVILEGES.format(names=rs.placeholders(len(found)))
+        for row in rs.execute_query(query, (rs.name, *found, rs.name, *found)) or []:
+            privileges.setdefault(row[0], []).append(row[1:])
+    graph = get_role_graph(rs)
+
+    deltas = []
+    for name in names:
+        if name not in existing:
+            deltas.append(AccessDelta(name, error='Role not found'))
+            continue
+        delta = _delta(name, source.privileges, PrivilegeSet.from_rows(privileges.get(name)),
+                       source.nested_roles, nested_roles.get(name, set()), exact=exact)
+        cycles = [r for r in delta.grant_roles if graph.creates_cycle(name, r)]
+        if cycles:
+            delta = AccessDelta(name, error=f"Nesting {', '.join(cycles)} would create a cycle")
+        deltas.append(delta)
+    return deltas
+
+
+def build_clone_statements(deltas: list, roles: bool = False) -> list:
+    """
+    Statements applying clone deltas, merged across targets
+
+    Group changes become one ALTER GROUP per group listing every target, and
+    targets with identical privilege changes share multi-grantee GRANT and REVOKE
+    statements, so cloning onto many new principals costs about as many statements
+    as cloning onto one.
+
+    Args:
+        deltas: AccessDelta per target, ones with an error are left out
+        roles: Targets are roles rather than users
+
+    Returns:
+        list: SQL statements, removals first
+    """
+    deltas = [d for d in deltas if not d.error]
+    grantee = (lambda name: f'ROLE {name}') if roles else (lambda name: name)
+    statements = []
+
+    def merged(attr: str) -> dict:
+        # change -> targets, changes grouped by identical value across targets
+        targets = {}
+        for d in deltas:
+            value = getattr(d, attr)
+            if value:
+                targets.setdefault(frozenset(value), []).append(d)
+        return targets
+
+    for attr, action in (('drop_groups', 'DROP'), ('add_groups', 'ADD')):
+        members = {}
+        for d in deltas:
+            for group in getattr(d, attr):
+                members.setdefault(group, []).append(d.target)
+        statements += [f"ALTER GROUP {g} {action} USER {', '.join(users)};" for g, users in members.items()]
+
+    for d in deltas:
+        statements += [f'REVOKE ROLE {r} FROM {grantee(d.target)};' for r in d.revoke_roles]
+        statements += [f'GRANT ROLE {r} TO {grantee(d.target)};' for r in d.grant_roles]
+
+    for attr in ('revokes', 'grants'):
+        for group in merged(attr).values():
+            privileges = getattr(group[0], attr)
+            grantees = ', '.join(grantee(d.target) for d in group)
+            if attr == 'revokes':
+                statements += [s.sql for s in build_privilege_statements(grantees, revokes=privileges)]
+            else:
+                statements += [s.sql for s in build_privilege_statements(grantees, grants=privileges)]
+    return statements
+
+
+def apply_clone(deltas: list, rs: Redshift, roles: bool = False) -> bool:
+    """
+    Apply clone deltas in a single transaction, all or nothing
+
+    Sets success on every delta without an error, or an error on each if the transaction
+    was rolled back. Nested roles granted to roles are recorded in the cached role graph.
+
+    Returns:
+        bool: True if the changes were applied
+    """
+    statements = build_clone_statements(deltas, roles)
+    results = rs.execute_batch(statements)
+    success = all(r.success for r in results)
+    failed = next((r for r in results if r.error and r.error not in ('Rolled back', 'Not executed')), None)
+    for d in deltas:
+        if d.error is None:
+            d.success = success
+            if not success:
+                d.error = f'Rolled back: {failed.error}' if failed else 'Rolled back'
+    if success and roles:
+        graph = get_role_graph(rs)
+        for d in deltas:
+            for r in d.revoke_roles:
+                graph.remove_edge(d.target, r)
+            for r in d.grant_roles:
+                graph.add_edge(d.target, r)
+    return success
+
+
+def clone_user_access(source: RedshiftUser, target_names: list, rs: Redshift, exact: bool = False) -> list:
+    'Plan and apply cloning a user onto target users. Returns the AccessDelta per target.'
+    deltas = plan_user_clone(source, target_names, rs, exact)
+    if any(not d.error and not d.is_empty() for d in deltas):
+        apply_clone(deltas, rs)
+    return deltas
+
+
+def clone_role_access(source: RedshiftRole, target_names: list, rs: Redshift, exact: bool = False) -> list:
+    'Plan and apply cloning a role onto target roles. Returns the AccessDelta per target.'
+    deltas = plan_role_clone(source, target_names, rs, exact)
+    if any(not d.error and not d.is_empty() for d in deltas):
+        apply_clone(deltas, rs, roles=True)
+    return deltas
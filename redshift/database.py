@@ -1,17 +1,121 @@
 from ast import Tuple
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, asdict, field, fields, is_dataclass
 from cryptography.fernet import Fernet
 from nbclient import execute
 import redshift_connector
+import asyncio
+import functools
 import json
 import os
+import threading
+import time
+from collections import namedtuple
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 from .sql_queries import *
+from .pool import ConnectionPool, get_pool, BROKEN_CONN_ERRORS
+from .cache import catalog_cache
+from .name_index import relation_index
+from .metrics import observe_query
 
 # TODO: Add proper logging mechnism instead of prints
 
 redshift_connector.paramstyle = 'pyformat'
 
+# Threads that run blocking driver calls for the async API, overridable through env var.
+# redshift_connector has no async interface, so awaited queries are handed to this bounded
+# executor: any number of requests can await queries while at most SQL_WORKERS run at once.
+SQL_WORKERS = int(os.environ.get('RSMATE_SQL_WORKERS', 32))
+_sql_executor = ThreadPoolExecutor(max_workers=SQL_WORKERS, thread_name_prefix='rsmate-sql')
+
+# Rows per page of the users, roles and groups lists
+PAGE_SIZE = int(os.environ.get('RSMATE_PAGE_SIZE', 50))
+
+# Load schema relations of the privileges pages per schema, on demand, instead of the whole
+# catalog at once. RSMATE_LAZY_CATALOG=0 switches back to loading the whole catalog.
+LAZY_CATALOG = os.environ.get('RSMATE_LAZY_CATALOG', '1') != '0'
+
+
+@dataclass
+class StatementResult:
+    'Outcome of one statement run by Redshift.execute_batch.'
+    sql: str
+    success: bool = False
+    error: Optional[str] = None
+
+
+class Rows(list):
+    'Rows of a query result, with the column names from its cursor.description.'
+    def __init__(self, rows=(), columns=()):
+        super().__init__(rows)
+        self.columns = tuple(columns)
+
+
+def description_columns(description) -> tuple:
+    'Column names of a cursor.description'
+    return tuple(d[0].decode() if isinstance(d[0], bytes) else d[0] for d in description or ())
+
+
+class RowMapper:
+    """
+    Maps rows of one query shape to model instances, or to named tuples
+    
+    Built once per target and column names: columns are matched to the target's
+    fields by name, renamed through the target's COLUMN_FIELDS if it has one, and the
+    (field, row position) pairs are kept. Mapping a row then only reads those positions,
+    with no name matching per row and no reliance on column order.
+    Columns without a matching field are left out.
+    """
+    # (target, columns) -> RowMapper. Query shapes are fixed by the SQL in sql_queries, so this stays small
+    _mappers = {}
+    _lock = threading.Lock()
+
+    def __init__(self, target, columns: tuple):
+        self.target = target
+        self.columns = columns
+        if target is None:
+            # Field names must be identifiers, e.g. ?column? is not
+            self.map_row = namedtuple('Row', columns, rename=True)._make
+            return
+        renames = getattr(target, 'COLUMN_FIELDS', {})
+        names = {f.name for f in fields(target)} if is_dataclass(target) else set(target._fields)
+        pairs = [(renames.get(c, c), i) for i, c in enumerate(columns) if renames.get(c, c) in names]
+        field_names = tuple(f for f, _ in pairs)
+        positions = [i for _, i in pairs]
+        # itemgetter returns a tuple for two or more positions only
+        values = itemgetter(*positions) if len(positions) > 1 else lambda row: tuple(row[i] for i in positions)
+        self.map_row = lambda row: target(**dict(zip(field_names, values(row))))
+
+    @classmethod
+    def get(cls, target, columns: tuple) -> 'RowMapper':
+        'Mapper of target for rows with columns, built on first use'
+        key = (target, columns)
+        mapper = cls._mappers.get(key)
+        if mapper is None:
+            with cls._lock:
+                mapper = cls._mappers.setdefault(key, cls(target, columns))
+        return mapper
+
+    def map(self, rows) -> list:
+        return list(map(self.map_row, rows))
+
+
+def map_rows(rows: Rows, target=None) -> list:
+    """
+    Map rows of a query to instances of target
+    
+    Args:
+        rows: Rows returned by execute_query
+        target: Dataclass or NamedTuple class. None maps to named tuples of the columns
+        
+    Returns:
+        list: One target instance per row, empty if there are no rows
+    """
+    if not rows:
+        return []
+    return RowMapper.get(target, rows.columns).map(rows)
+
 
 @dataclass
 class Redshift: 
@@ -57,23 +161,144 @@ class Redshift:
             print(e)
             return None
 
+    @staticmethod
+    def placeholders(n: int) -> str:
+        'Comma separated %s placeholders for an IN list of n values.'
+        return ', '.join(['%s'] * n)
+
+    @staticmethod
+    def like_pattern(text: str) -> str:
+        'ILIKE pattern matching names containing text, with LIKE wildcards in text escaped.'
+        text = (text or '').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f'%{text}%'
+
+    @staticmethod
+    def page_clauses(sort_column: str, desc: bool = False, after=None, limit: int = None) -> tuple:
+        """
+        SQL fragments and args for one keyset page of a listing query
+        
+        Args:
+            sort_column: Unique column to sort and page on. From a fixed list, never user input
+            desc: Sort descending
+            after: Sort key of the last row of the previous page, None for the first page
+            limit: Max number of rows, None for all
+            
+        Returns:
+            tuple: (dict of keyset, order and limit fragments to format the query with,
+                    tuple of args following the query's own args)
+        """
+        args = ()
+        keyset = ''
+        if after is not None:
+            keyset = f"AND {sort_column} {'<' if desc else '>'} %s"
+            args += (after,)
+        limit_clause = ''
+        if limit is not None:
+            limit_clause = 'LIMIT %s'
+            args += (int(limit),)
+        order = f"{sort_column} {'DESC' if desc else 'ASC'}"
+        return {'keyset': keyset, 'order': order, 'limit': limit_clause}, args
+
+    def get_pool(self) -> ConnectionPool:
+        'Get the shared connection pool for this connection identity.'
+        return get_pool(self.host, self.port, self.name, self.user, self.pwd)
+
     def run_sql(self, query: str, args=None, fetch=True) -> Tuple | int | None:
-        try:
-            with redshift_connector.connect(
-                host=self.host, port=self.port, database=self.name, user=self.user, password=self.pwd
-            ) as conn:
+        # Borrow a pooled connection. A connection with a broken socket is
+        # discarded and a read retried once on a fresh connection. Writes are not
+        # retried, the statement may have been committed before the socket broke.
+        # Fetched rows are returned as Rows, carrying their column names for map_rows.
+        # Run time, rows and errors are recorded per query for /metrics.
+        pool = self.get_pool()
+        start = time.perf_counter()
+        for attempt in range(2):
+            try:
+                conn = pool.acquire()
+            except Exception as e:
+                print(f"Database connection error: {e}")
+                observe_query(query, time.perf_counter() - start, error=True)
+                return None
+
+            try:
                 with conn.cursor() as cursor:
                     cursor.execute(query, args=args)
 
                     if fetch:
-                        results = cursor.fetchall()
-                        return results
+                        results = Rows(cursor.fetchall(), description_columns(cursor.description))
                     else:
                         conn.commit()
-                        return cursor.rowcount
+                        results = cursor.rowcount
+                pool.release(conn)
+                observe_query(query, time.perf_counter() - start, len(results) if fetch else results)
+                return results
+            except BROKEN_CONN_ERRORS as e:
+                pool.release(conn, discard=True)
+                if attempt == 0 and fetch:
+                    continue
+                print(f"Database error: {e}")
+                observe_query(query, time.perf_counter() - start, error=True)
+                return None
+            except Exception as e:
+                pool.release(conn)
+                print(f"Database error: {e}")
+                observe_query(query, time.perf_counter() - start, error=True)
+                return None 
+
+    def execute_batch(self, statements: list) -> list:
+        """
+        Run statements in order on one pooled connection inside a single transaction
+        
+        All or nothing: if any statement fails, the transaction is rolled back and
+        every statement is reported as not successful.
+        
+        Args:
+            statements: List of SQL statements without parameters
+            
+        Returns:
+            list: StatementResult for each statement, in order
+        """
+        results = [StatementResult(sql=stmt) for stmt in statements]
+        if not statements:
+            return results
+
+        pool = self.get_pool()
+        start = time.perf_counter()
+        try:
+            conn = pool.acquire()
         except Exception as e:
-            print(f"Database error: {e}")
-            return None 
+            print(f"Database connection error: {e}")
+            for result in results:
+                result.error = f'Not executed: {e}'
+            observe_query('', time.perf_counter() - start, error=True, name='batch')
+            return results
+
+        failed = None
+        try:
+            with conn.cursor() as cursor:
+                for i, stmt in enumerate(statements):
+                    try:
+                        cursor.execute(stmt)
+                    except Exception as e:
+                        failed = i
+                        results[i].error = str(e)
+                        raise
+            conn.commit()
+            for result in results:
+                result.success = True
+            pool.release(conn)
+        except Exception as e:
+            print(f"Database error, batch rolled back: {e}")
+            pool.release(conn, discard=isinstance(e, BROKEN_CONN_ERRORS))
+            for i, result in enumerate(results):
+                if failed is None:
+                    result.error = result.error or f'Not committed: {e}'
+                elif i < failed:
+                    result.error = 'Rolled back'
+                elif i > failed:
+                    result.error = 'Not executed'
+        # A batch's statements are built at run time, they are recorded together
+        observe_query('', time.perf_counter() - start, error=not results[0].success, name='batch')
+        return results
 
     def execute_query(self, query: str, args=None) -> Tuple | None:
         try:
@@ -82,6 +307,10 @@ class Redshift:
             print(e)
             return None 
 
+    def fetch_as(self, target, query: str, args=None) -> list:
+        'Run a query and map its rows to instances of target, see map_rows. Empty on error.'
+        return map_rows(self.execute_query(query, args), target)
+
     def execute_cmd(self, query: str, args=None) -> bool:
         try:
             return self.run_sql(query, args, fetch=False) == -1
@@ -89,6 +318,85 @@ class Redshift:
             print(e)
             return False
 
+    # ===== Async API =====
+
+    async def run_async(self, fn, *args, **kwargs):
+        """
+        Await a blocking call, e.g. a model loader taking this Redshift, on the SQL executor
+        
+        Args:
+            fn: Blocking callable
+            *args, **kwargs: Arguments passed to fn
+            
+        Returns:
+            The result of fn
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_sql_executor, functools.partial(fn, *args, **kwargs))
+
+    async def iter_async(self, iterator):
+        'Iterate a blocking iterator, e.g. a model iter_pages, asynchronously, each step running on the SQL executor.'
+        done = object()
+        try:
+            while (item := await self.run_async(next, iterator, done)) is not done:
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                await self.run_async(iterator.close)
+
+    async def run_sql_async(self, query: str, args=None, fetch=True) -> Tuple | int | None:
+        return await self.run_async(self.run_sql, query, args, fetch)
+
+    async def execute_query_async(self, query: str, args=None) -> Tuple | None:
+        return await self.run_async(self.execute_query, query, args)
+
+    async def fetch_as_async(self, target, query: str, args=None) -> list:
+        return await self.run_async(self.fetch_as, target, query, args)
+
+    async def execute_cmd_async(self, query: str, args=None) -> bool:
+        return await self.run_async(self.execute_cmd, query, args)
+
+    async def execute_batch_async(self, statements: list) -> list:
+        return await self.run_async(self.execute_batch, statements)
+
+    async def test_conn_async(self) -> bool:
+        return await self.run_async(self.test_conn)
+
+    async def get_catalog_async(self, refresh: bool = False) -> dict:
+        'Same as get_catalog, but on a miss the schemas and relations queries run concurrently'
+        if refresh:
+            self.invalidate_catalog()
+        schema_relations = catalog_cache.get(self.catalog_key())
+        if schema_relations is None:
+            schemas, results = await asyncio.gather(
+                self.run_async(self.get_all_schemas),
+                self.execute_query_async(GET_ALL_SCHEMA_RELATIONS, (self.name, self.name,)),
+            )
+            schema_relations = self.map_schema_relations(schemas, results)
+            catalog_cache.set(self.catalog_key(), schema_relations)
+        return schema_relations
+
+    async def search_schema_objects_async(self, schema: str, kind: str, text: str, limit: int = 20) -> list:
+        return await self.run_async(self.search_schema_objects, schema, kind, text, limit)
+
+    async def get_schema_list_async(self, refresh: bool = False) -> list:
+        return await self.run_async(self.get_schema_list, refresh)
+
+    async def get_schema_catalog_async(self, schemas: list) -> dict:
+        return await self.run_async(self.get_schema_catalog, schemas)
+
+    async def get_privileges_catalog_async(self, schemas: list, held_schemas: list) -> dict:
+        """
+        Relations a privileges section renders up front: the first schema, shown initially,
+        and the schemas privileges are held in. Other schemas are loaded when navigated to.
+        
+        Args:
+            schemas: All schema names, in nav order
+            held_schemas: Names of schemas the principal holds privileges in
+        """
+        held = set(held_schemas)
+        return await self.get_schema_catalog_async([s for i, s in enumerate(schemas) if i == 0 or s in held])
+
     def test_conn(self) -> bool:
         'Test connection by selecting 1. Returns True if successful.'
         return self.execute_query('SELECT 1') is not None
@@ -113,7 +421,116 @@ class Redshift:
         results = self.execute_query(GET_SCHEMA_PROCEDURES, (self.name, schema,))
         return [row[0] for row in results] if results else []
         
-    def determine_object_type(self, schema_name: str, object_name: str, privilege_type: str, schema_relations: dict) -> str:
+    def get_schema_relations(self) -> dict:
+        """
+        Get tables, views, functions and procedures of all schemas in two queries
+        
+        Returns:
+            dict: schema name -> {'tables': [], 'views': [], 'functions': [], 'procedures': []},
+                  in schema name order. Schemas without any relation are included with empty lists.
+        """
+        return self.map_schema_relations(self.get_all_schemas(),
+                                         self.execute_query(GET_ALL_SCHEMA_RELATIONS, (self.name, self.name,)))
+
+    @staticmethod
+    def map_schema_relations(schemas: list, results) -> dict:
+        'Schema relations dict from schema names and GET_ALL_SCHEMA_RELATIONS rows'
+        schema_relations = {schema: {'tables': [], 'views': [], 'functions': [], 'procedures': []}
+                            for schema in schemas}
+        for schema, relation_type, relation_name in results or []:
+            if schema in schema_relations:
+                schema_relations[schema][relation_type].append(relation_name)
+        return schema_relations
+        
+    def catalog_key(self) -> tuple:
+        'Key of this cluster, database and user in the catalog cache. Catalog views only list what the user can see.'
+        return (self.host, int(self.port) if self.port else None, self.name, self.user)
+
+    def get_catalog(self, refresh: bool = False) -> dict:
+        """
+        Get schema relations from the process-wide catalog cache, loading them on a miss
+        
+        Args:
+            refresh: Reload from Redshift even if a cached catalog exists
+            
+        Returns:
+            dict: Schema relations as returned by get_schema_relations. Shared between
+                  requests, so it must not be modified by callers.
+        """
+        if refresh:
+            self.invalidate_catalog()
+        return catalog_cache.get_or_load(self.catalog_key(), self.get_schema_relations)
+
+    def invalidate_catalog(self):
+        'Drop the cached catalog of this cluster and database, whole or loaded per schema.'
+        catalog_cache.pop(self.catalog_key())
+        catalog_cache.pop(('schemas',) + self.catalog_key())
+        catalog_cache.pop(('partial',) + self.catalog_key())
+
+    def get_schema_list(self, refresh: bool = False) -> list:
+        'Get schema names from the catalog cache, loading them on a miss.'
+        if refresh:
+            self.invalidate_catalog()
+        schema_relations = catalog_cache.get(self.catalog_key())
+        if schema_relations is not None:
+            return list(schema_relations)
+        return catalog_cache.get_or_load(('schemas',) + self.catalog_key(), self.get_all_schemas)
+
+    def search_schema_objects(self, schema: str, kind: str, text: str, limit: int = 20) -> list:
+        """
+        Typeahead search of a schema's relations through an in-memory index, built on first use
+        
+        Args:
+            schema: Schema name
+            kind: 'tables', 'views' or 'functions' (functions and procedures)
+            text: Text to search for, case-insensitive
+            limit: Max number of matches
+            
+        Returns:
+            list: (name, value) pairs, prefix matches first. Values of functions
+                  and procedures are formatted as FUNCTION:name or PROCEDURE:name
+        """
+        relations = self.get_schema_catalog([schema]).get(schema)
+        if relations is None or kind not in ('tables', 'views', 'functions'):
+            return []
+        return relation_index(self.catalog_key() + (schema,), relations, kind).search(text, limit)
+
+    def get_schemas_relations(self, schemas: list) -> dict:
+        'Same as get_schema_relations for the given schemas only, in one query'
+        if not schemas:
+            return {}
+        query = GET_SCHEMAS_RELATIONS.format(names=self.placeholders(len(schemas)))
+        results = self.execute_query(query, (self.name, *schemas, self.name, *schemas))
+        return self.map_schema_relations(schemas, results)
+
+    def get_schema_catalog(self, schemas: list) -> dict:
+        """
+        Get relations of some schemas, loading only the ones not cached yet
+        
+        Schemas loaded this way are memoized in the catalog cache next to the whole catalog,
+        which is used instead when it is cached already or LAZY_CATALOG is off.
+        
+        Args:
+            schemas: Schema names
+            
+        Returns:
+            dict: Schema relations of the given schemas, as returned by get_schema_relations.
+                  Shared between requests, so it must not be modified by callers.
+        """
+        schema_relations = catalog_cache.get(self.catalog_key())
+        if schema_relations is None and not LAZY_CATALOG:
+            schema_relations = self.get_catalog()
+        if schema_relations is None:
+            partial_key = ('partial',) + self.catalog_key()
+            schema_relations = catalog_cache.get(partial_key) or {}
+            missing = [s for s in dict.fromkeys(schemas) if s not in schema_relations]
+            if missing:
+                # copied rather than updated in place, other requests may be reading it
+                schema_relations = {**schema_relations, **self.get_schemas_relations(missing)}
+                catalog_cache.set(partial_key, schema_relations)
+        return {s: schema_relations[s] for s in schemas if s in schema_relations}
+        
+    def determine_object_type(self, schema_name: str, object_name: str, privilege_type: str, schema_relations: dict = None) -> str:
         """
         Determine the type of database object based on schema relations and privilege type
         
@@ -121,11 +538,14 @@ class Redshift:
             schema_name: The name of the schema
             object_name: The name of the object
             privilege_type: The type of privilege (SELECT, INSERT, UPDATE, DELETE, EXECUTE)
-            schema_relations: Dictionary of schema relations from session
+            schema_relations: Dictionary of schema relations, defaults to the cached relations of the schema
             
         Returns:
             str: The object type (TABLE, VIEW, FUNCTION, PROCEDURE, SCHEMA)
         """
+        if schema_relations is None:
+            schema_relations = self.get_schema_catalog([schema_name])
+
         # Check if we have schema relations for this schema
         if schema_name in schema_relations:
             schema_data = schema_relations[schema_name]
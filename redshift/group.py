@@ -1,5 +1,6 @@
+import asyncio
 import redshift.sql_queries as sql
-from redshift.database import Redshift
+from redshift.database import Redshift, PAGE_SIZE, map_rows
 from dataclasses import dataclass, field
 from typing import Optional, List, Set
 
@@ -13,32 +14,133 @@ class RedshiftGroup:
         if isinstance(self.users, list):
             self.users = set(self.users)
     
+    # List sort options: sort name -> (column, attribute holding the sort key)
+    SORT_COLUMNS = {'name': ('groname', 'group_name')}
+
     @classmethod
-    def get_all(cls, rs: Redshift) -> list:
+    def get_all(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                after=None, limit: int = None) -> list:
         """
-        Get all Redshift groups
+        Get all Redshift groups, or a filtered, sorted keyset page of them
+        
+        Args:
+            rs: Redshift connection
+            search: Only groups whose name contains this text, case insensitive
+            sort: Sort on 'name'
+            desc: Sort descending
+            after: Sort key of the last group of the previous page
+            limit: Max number of groups
         
         Returns:
             list: List of RedshiftGroup objects
         """
         try:
-            results = rs.execute_query(sql.GET_ALL_GROUPS)
-            groups = []
+            if search is None and sort is None and after is None and limit is None:
+                return rs.fetch_as(cls, sql.GET_ALL_GROUPS)
+            return rs.fetch_as(cls, *cls.page_query(rs, search, sort, desc, after, limit))
+        except Exception as e:
+            print(f"Error getting all groups: {e}")
+            return []
+
+    @classmethod
+    def get_page(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                 after=None, page_size: int = PAGE_SIZE) -> tuple:
+        """
+        One page of groups with their users
+        
+        Returns:
+            tuple: (groups, sort key to pass as after for the next page, or None on the last page)
+        """
+        groups = cls.get_all(rs, search, sort, desc, after, page_size + 1)
+        next_after = None
+        if len(groups) > page_size:
+            groups = groups[:page_size]
+            next_after = getattr(groups[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+        return cls.load_users(groups, rs), next_after
+
+    @classmethod
+    def page_query(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                   after=None, limit: int = None) -> tuple:
+        'Query and args listing a filtered, sorted keyset page of groups'
+        column = cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[0]
+        clauses, page_args = rs.page_clauses(column, desc, after, limit)
+        return sql.GET_GROUPS_PAGE.format(**clauses), (rs.like_pattern(search),) + page_args
+
+    @classmethod
+    def iter_pages(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                   page_size: int = PAGE_SIZE):
+        """
+        Yield all matching groups in lists of page_size, with users
+
+        Pages are fetched one keyset query at a time, so each page's connection is back in the
+        pool before the users of its groups are loaded.
+
+        Raises:
+            RuntimeError: If a page cannot be fetched
+        """
+        after = None
+        while True:
+            results = rs.execute_query(*cls.page_query(rs, search, sort, desc, after, page_size))
+            if results is None:
+                raise RuntimeError('Could not load groups')
+            groups = map_rows(results, cls)
+            if groups:
+                yield cls.load_users(groups, rs)
+            if len(groups) < page_size:
+                return
+            after = getattr(groups[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+
+    @classmethod
+    def load_users(cls, groups: list, rs: Redshift) -> list:
+        'Set users of the given groups with one query'
+        group_users = cls.get_all_group_users(rs, [g.group_name for g in groups])
+        for group in groups:
+            group.users = group_users.get(group.group_name, set())
+        return groups
+    
+    @staticmethod
+    def get_all_group_users(rs: Redshift, group_names: list = None) -> dict:
+        """
+        Get users of all groups, or only of the given groups, in one query
+        
+        Args:
+            rs: Redshift connection
+            group_names: Optional list of group names to limit the lookup to
+        
+        Returns:
+            dict: Dictionary mapping every group name to a set of usernames, empty for groups without users
+        """
+        try:
+            if group_names is None:
+                results = rs.execute_query(sql.GET_ALL_GROUP_USERS)
+            elif group_names:
+                query = sql.GET_GROUPS_USERS.format(names=rs.placeholders(len(group_names)))
+                results = rs.execute_query(query, tuple(group_names))
+            else:
+                return {}
+            group_users = {}
             
             if results:
-                for row in results:
-                    group_name = row[0]
+                for group_name, user_name in results:
+                    users = group_users.setdefault(group_name, set())
+                    if user_name is not None:
+                        users.add(user_name)
                     
-                    # Create group object with the available information
-                    group = cls(
-                        group_name=group_name
-                    )
-                    groups.append(group)
-                
-            return groups
+            return group_users
         except Exception as e:
-            print(f"Error getting all groups: {e}")
-            return []
+            print(f"Error getting group users: {e}")
+            return {}
+    
+    @classmethod
+    def get_all_with_users(cls, rs: Redshift) -> list:
+        """
+        Get all Redshift groups with their users in one query
+        
+        Returns:
+            list: List of RedshiftGroup objects with users set
+        """
+        return [cls(group_name=group_name, users=users)
+                for group_name, users in cls.get_all_group_users(rs).items()]
     
     @classmethod
     def get_group(cls, group_name: str, rs: Redshift) -> 'RedshiftGroup':
@@ -192,6 +294,7 @@ class RedshiftGroup:
             success = rs.execute_cmd(create_sql)
             
             if success:
+                rs.invalidate_catalog()
                 return cls(group_name=group_name)
             return None
         except Exception as e:
@@ -213,7 +316,46 @@ class RedshiftGroup:
             delete_sql = f"DROP GROUP {self.group_name};"
             
             # Execute SQL
-            return rs.execute_cmd(delete_sql)
+            success = rs.execute_cmd(delete_sql)
+            if success:
+                rs.invalidate_catalog()
+            return success
         except Exception as e:
             print(f"Error deleting group {self.group_name}: {e}")
             return False
+
+    # ===== Async loaders =====
+    # Awaitable counterparts of the loaders above, run on the Redshift SQL executor
+
+    @classmethod
+    async def get_all_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all, rs)
+
+    @classmethod
+    async def get_all_with_users_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all_with_users, rs)
+
+    @classmethod
+    def iter_pages_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                         page_size: int = PAGE_SIZE):
+        return rs.iter_async(cls.iter_pages(rs, search, sort, desc, page_size))
+
+    @classmethod
+    async def get_page_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                             after=None, page_size: int = PAGE_SIZE) -> tuple:
+        return await rs.run_async(cls.get_page, rs, search, sort, desc, after, page_size)
+
+    @classmethod
+    async def get_group_async(cls, group_name: str, rs: Redshift) -> 'RedshiftGroup':
+        'Get a specific group by name, running the info and users queries concurrently'
+        try:
+            results, users = await asyncio.gather(
+                rs.execute_query_async(sql.GET_GROUP_INFO, (group_name,)),
+                rs.run_async(cls.get_group_users, group_name, rs),
+            )
+            if not results:
+                return None
+            return cls(group_name=group_name, users=set(users))
+        except Exception as e:
+            print(f"Error getting group {group_name}: {e}")
+            return None
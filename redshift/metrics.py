@@ -0,0 +1,274 @@
+import hmac
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# Record metrics and serve them on /metrics, overridable through env var. Off unless RSMATE_METRICS=1
+METRICS_ENABLED = os.environ.get('RSMATE_METRICS', '0') == '1'
+# Bearer token /metrics requires when set, overridable through env var
+METRICS_TOKEN = os.environ.get('RSMATE_METRICS_TOKEN', '')
+
+# Histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named family of samples, one per combination of label values
+
+    Metrics of state kept elsewhere, e.g. pool occupancy, take a collect callback
+    returning (label values, value) pairs, called when the metrics are rendered.
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}       # label values -> value
+        self._collect = collect
+        self._lock = threading.Lock()
+
+    def samples(self) -> list:
+        'Prometheus text format lines of the samples, without HELP and TYPE'
+        if self._collect is not None:
+            values = dict(self._collect())
+            with self._lock:
+                self._values = values
+        with self._lock:
+            return [f'{self.name}{_labels(self.label_names, key)} {_number(value)}'
+                    for key, value in sorted(self._values.items())]
+
+    def render(self) -> list:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}', *self.samples()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    'Cumulative bucket counts, sum and count per label values.'
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # Per-bucket counts (the last one for +Inf), sum
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def samples(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float('inf')), counts):
+                    cumulative += count
+                    le = 'le="%s"' % _number(bound)
+                    lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    'Metrics by name, rendered together in Prometheus text exposition format.'
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        'Add a metric, or return the one already registered under its name'
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# ===== Queries =====
+
+query_count = registry.register(Counter('rsmate_queries_total', 'Queries run, by sql_queries constant', ('query',)))
+query_errors = registry.register(Counter('rsmate_query_errors_total', 'Queries that failed, by sql_queries constant', ('query',)))
+query_latency = registry.register(Histogram('rsmate_query_duration_seconds', 'Query run time, fetch included', ('query',)))
+query_rows = registry.register(Histogram('rsmate_query_rows', 'Rows returned or affected per query', ('query',), ROWS_BUCKETS))
+connection_open = registry.register(Histogram('rsmate_connection_open_seconds', 'Time to open a new Redshift connection'))
+connection_errors = registry.register(Counter('rsmate_connection_errors_total', 'Redshift connections that failed to open'))
+
+# ===== Routes and sessions =====
+
+route_count = registry.register(Counter('rsmate_requests_total', 'HTTP requests, by route and status', ('method', 'route', 'status')))
+route_latency = registry.register(Histogram('rsmate_request_duration_seconds', 'HTTP request handling time, by route', ('method', 'route')))
+session_payload = registry.register(Histogram('rsmate_session_payload_bytes', 'Size of pickled objects written to the session store',
+                                              ('key',), SIZE_BUCKETS))
+
+
+# Statements not in sql_queries are labelled by their leading keyword if it is one of these
+STATEMENT_KEYWORDS = {'GRANT', 'REVOKE', 'ALTER', 'CREATE', 'DROP', 'SELECT'}
+_query_names = {}       # query text -> label, filled on first use of each text
+_query_templates = []   # (text before the first {, name) of formatted queries, longest first
+_query_names_lock = threading.Lock()
+
+
+def _load_query_names():
+    from redshift import sql_queries
+    with _query_names_lock:
+        if _query_names:
+            return
+        constants = {n: v for n, v in vars(sql_queries).items() if n.isupper() and isinstance(v, str)}
+        _query_templates[:] = sorted(((v[:v.index('{')], n) for n, v in constants.items() if '{' in v),
+                                     key=lambda t: -len(t[0]))
+        # Filled last, a non empty _query_names means the templates are loaded
+        _query_names.update({v: n for n, v in constants.items()})
+
+
+def query_name(query: str) -> str:
+    """
+    Label of a query: the name of the sql_queries constant it is, or was formatted from
+
+    Other statements are labelled by their leading keyword, e.g. GRANT, or other,
+    so the number of labels stays bounded whatever SQL is run.
+    """
+    if not _query_names:
+        _load_query_names()
+    name = _query_names.get(query)
+    if name is None:
+        name = next((n for prefix, n in _query_templates if query.startswith(prefix)), None)
+        if name is not None:
+            # Formatted variants are few per template (placeholder counts, sort orders)
+            if len(_query_names) < 4096:
+                _query_names[query] = name
+        else:
+            keyword = query.lstrip().split(None, 1)[0].upper() if query.strip() else ''
+            name = keyword if keyword in STATEMENT_KEYWORDS else 'other'
+    return name
+
+
+def observe_query(query: str, seconds: float, rows: int = None, error: bool = False, name: str = None):
+    'Record one run of a query, labelled name if given, else by query_name'
+    if not METRICS_ENABLED:
+        return
+    name = name or query_name(query)
+    query_count.inc(name)
+    query_latency.observe(seconds, name)
+    if error:
+        query_errors.inc(name)
+    elif rows is not None and rows >= 0:
+        query_rows.observe(rows, name)
+
+
+class timed:
+    'Context manager recording the seconds its block took into a histogram.'
+
+    def __init__(self, histogram: Histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if METRICS_ENABLED:
+            self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+# ===== HTTP =====
+
+class MetricsMiddleware:
+    """
+    ASGI middleware counting requests and timing them per route
+
+    Requests are labelled by the matched route's path, e.g. /user/{user_id},
+    so ids in URLs do not create new label values. Unmatched paths share one label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None      # endpoint -> route path
+
+    def route_path(self, scope) -> str:
+        if self._paths is None and 'app' in scope:
+            self._paths = {getattr(r, 'endpoint', None): r.path for r in scope['app'].routes if hasattr(r, 'path')}
+        return (self._paths or {}).get(scope.get('endpoint'), 'unmatched')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = self.route_path(scope)
+            route_count.inc(scope['method'], route, str(status[0]))
+            route_latency.observe(time.perf_counter() - start, scope['method'], route)
+
+
+def observe_session_payload(key: str, size: int):
+    'Record the size of an object written to the session store'
+    if METRICS_ENABLED:
+        session_payload.observe(size, key)
+
+
+def metrics_authorized(headers) -> bool:
+    'Whether a request may read /metrics: always without METRICS_TOKEN, else with it as bearer token'
+    if not METRICS_TOKEN:
+        return True
+    scheme, _, token = headers.get('authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode())
+
+
+def render_metrics() -> str:
+    'All metrics in Prometheus text format'
+    return registry.render()
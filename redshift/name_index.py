@@ -0,0 +1,81 @@
+from bisect import bisect_left
+from .cache import TTLCache, CATALOG_CACHE_TTL
+
+# Max number of schema relation indexes kept, built on first search of a schema
+NAME_INDEX_SIZE = 256
+
+
+class NameIndex:
+    """
+    Names sorted case-insensitively for typeahead search.
+
+    Prefix matches are found with bisect, then a scan adds names containing the text
+    elsewhere until limit matches are found.
+    """
+
+    def __init__(self, names: list, values: list = None, source=None):
+        items = sorted(zip((n.lower() for n in names), names, values or names))
+        self._keys = [key for key, _, _ in items]
+        self._names = [name for _, name, _ in items]
+        self._values = [value for _, _, value in items]
+        # Object the index was built from, to tell when it is outdated
+        self.source = source
+
+    def search(self, text: str, limit: int = 20) -> list:
+        """
+        Names matching text, prefix matches first, each group in name order
+
+        Args:
+            text: Text to search for, case-insensitive. Empty matches every name
+            limit: Max number of matches
+
+        Returns:
+            list: (name, value) pairs
+        """
+        text = (text or '').lower()
+        matches = []
+        i = bisect_left(self._keys, text)
+        while i < len(self._keys) and len(matches) < limit and self._keys[i].startswith(text):
+            matches.append(i)
+            i += 1
+        if text and len(matches) < limit:
+            for i, key in enumerate(self._keys):
+                if text in key and not key.startswith(text):
+                    matches.append(i)
+                    if len(matches) >= limit:
+                        break
+        return [(self._names[i], self._values[i]) for i in matches]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+_indexes = TTLCache(maxsize=NAME_INDEX_SIZE, ttl=CATALOG_CACHE_TTL, name='name_index')
+
+
+def relation_index(key: tuple, relations: dict, kind: str) -> NameIndex:
+    """
+    Get the index of one kind of relations of a schema, built on first use
+
+    An index is rebuilt once the relations it was built from are reloaded.
+
+    Args:
+        key: Cache key of the schema, e.g. catalog key + schema name
+        relations: The schema's relations, as in a get_schema_relations value
+        kind: 'tables', 'views' or 'functions'. Functions include procedures,
+              with values formatted as FUNCTION:name or PROCEDURE:name
+
+    Returns:
+        NameIndex: Index of the relation names
+    """
+    index = _indexes.get(key + (kind,))
+    if index is None or index.source is not relations:
+        if kind == 'functions':
+            names = relations['functions'] + relations['procedures']
+            values = ([f'FUNCTION:{f}' for f in relations['functions']]
+                      + [f'PROCEDURE:{p}' for p in relations['procedures']])
+            index = NameIndex(names, values, source=relations)
+        else:
+            index = NameIndex(relations[kind], source=relations)
+        _indexes.set(key + (kind,), index)
+    return index
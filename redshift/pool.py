@@ -0,0 +1,268 @@
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import redshift_connector
+from . import metrics
+
+# Pool settings, overridable through env vars
+POOL_MIN_SIZE = int(os.environ.get('RSMATE_POOL_MIN_SIZE', 0))
+POOL_MAX_SIZE = int(os.environ.get('RSMATE_POOL_MAX_SIZE', 8))
+POOL_IDLE_TIMEOUT = float(os.environ.get('RSMATE_POOL_IDLE_TIMEOUT', 300))
+POOL_PING_AFTER = float(os.environ.get('RSMATE_POOL_PING_AFTER', 10))
+POOL_ACQUIRE_TIMEOUT = float(os.environ.get('RSMATE_POOL_ACQUIRE_TIMEOUT', 30))
+
+# Errors raised by redshift_connector when the socket underneath is gone
+BROKEN_CONN_ERRORS = (redshift_connector.InterfaceError, OSError)
+
+
+class PoolTimeout(Exception):
+    'Raised when no connection becomes available within the acquire timeout.'
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of reusable redshift_connector connections for one connection identity.
+
+    Idle connections are reused most-recently-used first, closed once they have been idle
+    longer than idle_timeout (keeping min_size around) and pinged with SELECT 1 when borrowed
+    after being idle for more than ping_after seconds (0 pings on every borrow).
+    """
+
+    def __init__(self, connect, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE,
+                 idle_timeout: float = POOL_IDLE_TIMEOUT, ping_after: float = POOL_PING_AFTER):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1.')
+        self._connect = connect
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self._idle = deque()        # (conn, last_used) pairs, most recently used on the right
+        self._size = 0              # open connections, idle + borrowed
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _open(self):
+        'Open a new connection, timing it for metrics.'
+        with metrics.timed(metrics.connection_open):
+            try:
+                return self._connect()
+            except Exception:
+                metrics.connection_errors.inc()
+                raise
+
+    def fill(self):
+        'Open connections until min_size are available.'
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    @staticmethod
+    def is_healthy(conn) -> bool:
+        'Check a connection is still usable by selecting 1.'
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchall()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close_conn(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reap_idle(self) -> list:
+        'Pop idle connections past idle_timeout, keeping min_size open. Caller holds the lock.'
+        expired = []
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def acquire(self, timeout: float = POOL_ACQUIRE_TIMEOUT):
+        """
+        Borrow a connection from the pool, opening a new one if none is idle and max_size allows.
+
+        Args:
+            timeout: Seconds to wait for a connection when the pool is exhausted
+
+        Returns:
+            A healthy redshift_connector connection, to be handed back with release()
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            conn, last_used, wait = None, None, False
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout('Connection pool is closed.')
+                expired = self._reap_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f'No connection available after {timeout}s (max_size={self.max_size}).')
+                    self._cond.wait(remaining)
+                    wait = True
+            for c in expired:
+                self._close_conn(c)
+            if wait:
+                continue
+
+            if conn is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if time.monotonic() - last_used <= self.ping_after or self.is_healthy(conn):
+                return conn
+            # stale connection, drop it and try again
+            self.release(conn, discard=True)
+
+    def release(self, conn, discard: bool = False):
+        """
+        Hand a borrowed connection back to the pool.
+
+        Any open transaction is rolled back. Connections that fail to roll back,
+        or are released with discard=True, are closed instead of being reused.
+        """
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+        if discard or self._closed:
+            self._close_conn(conn)
+
+    @contextmanager
+    def connection(self):
+        'Borrow a connection for the duration of a with block, discarding it on broken sockets.'
+        conn = self.acquire()
+        try:
+            yield conn
+        except BROKEN_CONN_ERRORS:
+            self.release(conn, discard=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        'Close all idle connections. Borrowed ones are closed when released.'
+        with self._cond:
+            self._closed = True
+            idle = [c for c, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close_conn(conn)
+
+    def stats(self) -> dict:
+        'Current pool occupancy.'
+        with self._cond:
+            return {'size': self._size, 'idle': len(self._idle),
+                    'in_use': self._size - len(self._idle), 'max_size': self.max_size}
+
+
+# ===== Pool registry =====
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(host, port, database, user, password) -> tuple:
+    """
+    Connection identity a pool is shared by.
+    The password is part of the key (as a digest) so a pooled connection is never
+    handed out to someone who connects with the right user but a wrong password.
+    """
+    pwd_digest = hashlib.sha256((password or '').encode()).hexdigest()
+    return (host, int(port) if port else None, database, user, pwd_digest)
+
+
+def get_pool(host, port, database, user, password) -> ConnectionPool:
+    'Get or create the process-wide pool for a connection identity.'
+    key = pool_key(host, port, database, user, password)
+    with _pools_lock:
+        pool = _pools.get(key)
+        created = pool is None
+        if created:
+            pool = ConnectionPool(lambda: redshift_connector.connect(
+                host=host, port=port, database=database, user=user, password=password
+            ))
+            _pools[key] = pool
+    if created and pool.min_size:
+        try:
+            pool.fill()
+        except Exception as e:
+            # not fatal, connections are opened on demand
+            print(f'Error pre-filling connection pool: {e}')
+    return pool
+
+
+def all_pools() -> dict:
+    'Snapshot of registered pools by identity.'
+    with _pools_lock:
+        return dict(_pools)
+
+
+def close_all_pools():
+    'Close and forget every registered pool.'
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def pool_label(key: tuple) -> str:
+    'Metrics label of a pool: a digest of its key, so host and user names are not published.'
+    return hashlib.sha256(repr(key).encode()).hexdigest()[:12]
+
+
+def _register_metrics():
+    'Occupancy of the registered pools, read when metrics are rendered'
+    def samples(stat):
+        return lambda: [((pool_label(key),), pool.stats()[stat]) for key, pool in all_pools().items()]
+    for stat, description in (('size', 'Open connections'), ('idle', 'Idle connections'),
+                              ('in_use', 'Borrowed connections'), ('max_size', 'Max connections')):
+        metrics.registry.register(metrics.Gauge(f'rsmate_pool_{stat}', f'{description} of each connection pool',
+                                                ('pool',), samples(stat)))
+
+
+_register_metrics()
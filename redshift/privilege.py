@@ -1,7 +1,10 @@
 import redshift.sql_queries as sql
 from redshift.database import Redshift
+from redshift.role_graph import get_role_graph, get_role_graph_async
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import NamedTuple, Optional
+import asyncio
+import sys
 
 @dataclass
 class RedshiftPrivilege:
@@ -46,4 +49,339 @@ class RedshiftPrivileges:
     def get_user_privileges_by_schema(self, schema_name: str) -> list[RedshiftPrivilege]:
         query = sql.GET_USER_PRIVILEGES_BY_SCHEMA
         results = self.redshift.query(query, schema_name)
-        return [RedshiftPrivilege(**row) for row in results]
\ No newline at end of file
+        return [RedshiftPrivilege(**row) for row in results]
+
+# ===== Bulk privilege statements =====
+
+# Max objects merged into one GRANT/REVOKE statement
+MAX_OBJECTS_PER_STATEMENT = 200
+
+@dataclass
+class PrivilegeStatement:
+    'A GRANT or REVOKE statement covering one or more privileges of the same type.'
+    action: str
+    privileges: list
+    sql: str
+    success: bool = False
+    error: Optional[str] = None
+
+def privilege_object_kind(object_type: str) -> str:
+    'Kind of object a privilege is on: RELATION (table or view), FUNCTION, PROCEDURE or SCHEMA.'
+    object_type = (object_type or '').upper()
+    if object_type in ('TABLE', 'VIEW'):
+        return 'RELATION'
+    if object_type in ('FUNCTION', 'PROCEDURE'):
+        return object_type
+    return 'SCHEMA'
+
+def build_privilege_statements(grantee: str, grants: list = (), revokes: list = ()) -> list:
+    """
+    Merge privilege changes into as few GRANT/REVOKE statements as possible
+    
+    Privileges with the same action, privilege type and object kind are combined
+    into multi-object statements, e.g. GRANT SELECT ON s.t1, s.t2 TO user.
+    Revokes come before grants.
+    
+    Args:
+        grantee: Grantee clause, a user name or ROLE role_name
+        grants: Privileges to grant
+        revokes: Privileges to revoke
+        
+    Returns:
+        list: PrivilegeStatement objects, not yet executed
+    """
+    statements = []
+    for action, privileges in (('REVOKE', revokes), ('GRANT', grants)):
+        direction = 'TO' if action == 'GRANT' else 'FROM'
+        
+        # Group compatible privileges, keeping their order
+        groups = {}
+        for privilege in privileges:
+            kind = privilege_object_kind(privilege.object_type)
+            privilege_type = 'EXECUTE' if kind in ('FUNCTION', 'PROCEDURE') else privilege.privilege_type
+            groups.setdefault((privilege_type, kind), []).append(privilege)
+        
+        for (privilege_type, kind), group in groups.items():
+            for i in range(0, len(group), MAX_OBJECTS_PER_STATEMENT):
+                chunk = group[i:i + MAX_OBJECTS_PER_STATEMENT]
+                if kind == 'SCHEMA':
+                    objects = 'SCHEMA ' + ', '.join(dict.fromkeys(p.schema_name for p in chunk))
+                else:
+                    objects = ', '.join(f"{p.schema_name}.{p.object_name}" for p in chunk)
+                    if kind != 'RELATION':
+                        objects = f'{kind} {objects}'
+                sql_stmt = f'{action} {privilege_type} ON {objects} {direction} {grantee};'
+                statements.append(PrivilegeStatement(action, chunk, sql_stmt))
+    return statements
+
+def execute_privilege_statements(statements: list, rs: Redshift) -> bool:
+    """
+    Run privilege statements on one connection in a single transaction
+    
+    Sets success and error on each statement.
+    
+    Returns:
+        bool: True if all statements were applied, False if the transaction was rolled back
+    """
+    results = rs.execute_batch([s.sql for s in statements])
+    for statement, result in zip(statements, results):
+        statement.success = result.success
+        statement.error = result.error
+    return all(result.success for result in results)
+
+
+# ===== Privilege sets =====
+
+class Privilege(NamedTuple):
+    """
+    One privilege held by a user or role
+    
+    Tuple-backed, so a privilege costs no per-instance dict. Build it with
+    Privilege.create to intern the names, which repeat across thousands of grants.
+    """
+    schema_name: str
+    object_name: str
+    object_type: str
+    privilege_type: str
+    is_grantable: bool = False
+
+    @classmethod
+    def create(cls, schema_name: str, object_name: str, object_type: str,
+               privilege_type: str, is_grantable: bool = False) -> 'Privilege':
+        intern = lambda v: sys.intern(v) if isinstance(v, str) else v
+        return cls(intern(schema_name), intern(object_name), intern(object_type),
+                   intern(privilege_type), bool(is_grantable))
+
+    @property
+    def key(self) -> tuple:
+        return (self.schema_name, self.object_name, self.privilege_type)
+
+
+class PrivilegeSet:
+    """
+    Set of privileges indexed by (schema_name, object_name), then by privilege type
+    
+    The object type is kept on each privilege but is not part of the key, as the type
+    Redshift reports can differ from the one determined for a form selection.
+    Membership checks, object lookups and set algebra are hash lookups, so diffing is linear.
+    
+    A per-schema index in the shape the schema content components render,
+    {'TYPE:object_name': [privilege types]}, is kept up to date by add and discard.
+    """
+    def __init__(self, privileges=()):
+        self._objects = {}      # (schema_name, object_name) -> {privilege_type: Privilege}
+        self._schemas = {}      # schema_name -> {'TYPE:object_name': [privilege_type, ...]}
+        self._len = 0
+        for privilege in privileges:
+            self.add(privilege)
+
+    @classmethod
+    def from_rows(cls, results) -> 'PrivilegeSet':
+        'Privileges from privilege query rows of (schema, object, object type, privilege type, grantable)'
+        return cls(Privilege.create(*row[:5]) for row in results or [])
+
+    def _index(self, privilege: Privilege):
+        objects = self._schemas.setdefault(privilege.schema_name, {})
+        objects.setdefault(f'{privilege.object_type}:{privilege.object_name}', []).append(privilege.privilege_type)
+
+    def _unindex(self, privilege: Privilege):
+        objects = self._schemas[privilege.schema_name]
+        key = f'{privilege.object_type}:{privilege.object_name}'
+        objects[key].remove(privilege.privilege_type)
+        if not objects[key]:
+            del objects[key]
+            if not objects:
+                del self._schemas[privilege.schema_name]
+
+    def add(self, privilege: Privilege):
+        privileges = self._objects.setdefault((privilege.schema_name, privilege.object_name), {})
+        replaced = privileges.get(privilege.privilege_type)
+        if replaced is None:
+            self._len += 1
+        else:
+            self._unindex(replaced)
+        privileges[privilege.privilege_type] = privilege
+        self._index(privilege)
+
+    def discard(self, privilege: Privilege):
+        obj = (privilege.schema_name, privilege.object_name)
+        privileges = self._objects.get(obj)
+        removed = privileges.pop(privilege.privilege_type, None) if privileges else None
+        if removed is not None:
+            self._len -= 1
+            self._unindex(removed)
+            if not privileges:
+                del self._objects[obj]
+
+    def get_object(self, schema_name: str, object_name: str) -> dict:
+        'Privileges on one object, privilege type -> Privilege. Empty if there are none.'
+        return self._objects.get((schema_name, object_name), {})
+
+    def objects(self) -> list:
+        '(schema_name, object_name) pairs with at least one privilege.'
+        return list(self._objects)
+
+    def schema_privileges(self, schema_name: str) -> dict:
+        """
+        Privileges in one schema, grouped by object
+        
+        Returns:
+            dict: 'TYPE:object_name' -> list of privilege types. Empty if there are none.
+                  Shared with the set, so it must not be modified by callers.
+        """
+        return self._schemas.get(schema_name, {})
+
+    def schemas(self) -> list:
+        'Names of schemas with at least one privilege.'
+        return list(self._schemas)
+
+    def __contains__(self, privilege: Privilege) -> bool:
+        return privilege.privilege_type in self._objects.get((privilege.schema_name, privilege.object_name), ())
+
+    def __iter__(self):
+        for privileges in self._objects.values():
+            yield from privileges.values()
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PrivilegeSet) and self._objects == other._objects
+
+    def __repr__(self) -> str:
+        return f'PrivilegeSet({list(self)!r})'
+
+    def __sub__(self, other: 'PrivilegeSet') -> 'PrivilegeSet':
+        'Privileges of this set not in the other.'
+        return PrivilegeSet(p for p in self if p not in other)
+
+    def __and__(self, other: 'PrivilegeSet') -> 'PrivilegeSet':
+        'Privileges of this set also in the other.'
+        return PrivilegeSet(p for p in self if p in other)
+
+    def __or__(self, other: 'PrivilegeSet') -> 'PrivilegeSet':
+        'Privileges in either set, taken from the other set when in both.'
+        return PrivilegeSet([*self, *other])
+
+    def diff(self, desired: 'PrivilegeSet') -> tuple:
+        """
+        Changes needed to go from this set to the desired one
+        
+        Returns:
+            tuple: (to_grant, to_revoke) lists. Grants come from the desired set,
+                   revokes from this set so they keep the object type Redshift reported.
+        """
+        return list(desired - self), list(self - desired)
+
+
+# ===== Effective privileges =====
+
+class EffectivePrivilege(NamedTuple):
+    'A privilege a user or role can use, and the chain of roles it is granted through. Empty for direct grants.'
+    privilege: Privilege
+    via: tuple = ()
+
+
+class PrivilegeResolver:
+    """
+    Resolves effective privileges, direct grants plus the ones inherited through nested roles
+    
+    User role grants and role privileges are loaded in two bulk queries, nested role grants
+    come from the cached RoleGraph. The roles reachable from each role, with the path to
+    them, are computed once and memoized, so every lookup after that is in memory.
+    """
+    def __init__(self, user_roles: dict, nested_roles: dict, role_privileges: dict):
+        self.user_roles = user_roles            # user_id -> {role_name, ...}
+        self.nested_roles = nested_roles        # role_name -> {granted role_name, ...}
+        self.role_privileges = role_privileges  # role_name -> [Privilege, ...]
+        self._closures = {}                     # role_name -> {reachable role_name: path}
+
+    @classmethod
+    def from_rows(cls, user_role_rows, nested_role_rows, role_privilege_rows) -> 'PrivilegeResolver':
+        'Resolver from GET_ALL_USER_ROLES, GET_ALL_ROLE_NESTED_ROLES and GET_ALL_ROLES_PRIVILEGES rows'
+        user_roles, nested_roles, role_privileges = {}, {}, {}
+        for user_id, role_name in user_role_rows or []:
+            user_roles.setdefault(user_id, set()).add(role_name)
+        for role_name, granted_role_name in nested_role_rows or []:
+            nested_roles.setdefault(role_name, set()).add(granted_role_name)
+        for row in role_privilege_rows or []:
+            role_privileges.setdefault(row[0], []).append(Privilege.create(*row[1:6]))
+        return cls(user_roles, nested_roles, role_privileges)
+
+    @staticmethod
+    def _graph_rows(graph) -> list:
+        # Nested role grants of the cached role graph, as GET_ALL_ROLE_NESTED_ROLES rows
+        return [(role_name, granted) for role_name, children in graph.edges().items() for granted in children]
+
+    @classmethod
+    def load(cls, rs: Redshift) -> 'PrivilegeResolver':
+        'Load all user role grants and role privileges. Nested role grants come from the role graph.'
+        return cls.from_rows(rs.execute_query(sql.GET_ALL_USER_ROLES),
+                             cls._graph_rows(get_role_graph(rs)),
+                             rs.execute_query(sql.GET_ALL_ROLES_PRIVILEGES, (rs.name, rs.name)))
+
+    @classmethod
+    async def load_async(cls, rs: Redshift) -> 'PrivilegeResolver':
+        'Same as load, with the queries run concurrently'
+        user_roles, graph, role_privileges = await asyncio.gather(
+            rs.execute_query_async(sql.GET_ALL_USER_ROLES),
+            get_role_graph_async(rs),
+            rs.execute_query_async(sql.GET_ALL_ROLES_PRIVILEGES, (rs.name, rs.name)),
+        )
+        return cls.from_rows(user_roles, cls._graph_rows(graph), role_privileges)
+
+    def role_closure(self, role_name: str) -> dict:
+        """
+        Roles a role inherits privileges from, itself included
+        
+        Returns:
+            dict: reachable role name -> shortest path of role names from role_name to it,
+                  e.g. {'r1': ('r1',), 'r2': ('r1', 'r2')}. Shared, must not be modified.
+        """
+        closure = self._closures.get(role_name)
+        if closure is None:
+            # Redshift rejects circular role grants, the placeholder only stops a corrupt graph looping
+            self._closures[role_name] = {role_name: (role_name,)}
+            closure = {role_name: (role_name,)}
+            for granted in sorted(self.nested_roles.get(role_name, ())):
+                for reached, path in self.role_closure(granted).items():
+                    if reached not in closure or len(path) + 1 < len(closure[reached]):
+                        closure[reached] = (role_name,) + path
+            self._closures[role_name] = closure
+        return closure
+
+    def _resolve(self, paths: dict, direct=()) -> list:
+        # Keep one entry per privilege key, direct grants first, then the shortest path
+        effective = {p.key: EffectivePrivilege(p) for p in direct}
+        for reached, path in sorted(paths.items(), key=lambda item: (len(item[1]), item[1])):
+            for p in self.role_privileges.get(reached, ()):
+                effective.setdefault(p.key, EffectivePrivilege(p, path))
+        return sorted(effective.values(), key=lambda e: e.privilege.key)
+
+    def role_effective_privileges(self, role_name: str) -> list:
+        """
+        Effective privileges of a role
+        
+        Returns:
+            list: EffectivePrivilege sorted by schema, object and privilege type. Paths start
+                  at the first nested role, privileges of the role itself have an empty via
+        """
+        return self._resolve({reached: path[1:] for reached, path in self.role_closure(role_name).items()})
+
+    def user_effective_privileges(self, user_id: int, direct=()) -> list:
+        """
+        Effective privileges of a user
+        
+        Args:
+            user_id: The id of the user
+            direct: Privileges granted to the user directly, e.g. the user's PrivilegeSet
+            
+        Returns:
+            list: EffectivePrivilege sorted by schema, object and privilege type
+        """
+        paths = {}
+        for role_name in self.user_roles.get(user_id, ()):
+            for reached, path in self.role_closure(role_name).items():
+                if reached not in paths or len(path) < len(paths[reached]):
+                    paths[reached] = path
+        return self._resolve(paths, direct)
@@ -1,7 +1,10 @@
+import asyncio
 import redshift.sql_queries as sql
-from redshift.database import Redshift
+from redshift.database import Redshift, PAGE_SIZE, map_rows
+from redshift.privilege import Privilege, PrivilegeSet, build_privilege_statements, execute_privilege_statements
+from redshift.role_graph import RoleCycleError, get_role_graph, get_role_graph_async, cached_role_graph
 from dataclasses import dataclass, field
-from typing import Optional, List, Set
+from typing import Optional, Set
 
 @dataclass
 class RedshiftRole:
@@ -11,7 +14,7 @@ class RedshiftRole:
     owner_name: Optional[str] = None
     nested_roles: Set[str] = field(default_factory=set)
     users: Set[str] = field(default_factory=set)
-    privileges: List[dict] = field(default_factory=list)
+    privileges: PrivilegeSet = field(default_factory=PrivilegeSet)
     
     def __post_init__(self):
         # Convert lists to sets for easier manipulation
@@ -20,38 +23,91 @@ class RedshiftRole:
         if isinstance(self.users, list):
             self.users = set(self.users)
     
+    def schema_privileges(self, schema_name: str) -> dict:
+        "Privileges of this role in one schema, as 'TYPE:object_name' -> privilege types. An index lookup."
+        return self.privileges.schema_privileges(schema_name)
+    
+    # List sort options: sort name -> (column, attribute holding the sort key)
+    SORT_COLUMNS = {'name': ('role_name', 'role_name'), 'id': ('role_id', 'role_id')}
+
+    # Query columns mapped to fields of another name, see RowMapper
+    COLUMN_FIELDS = {'role_owner': 'owner_name'}
+
     @classmethod
-    def get_all(cls, rs: Redshift) -> list:
+    def get_all(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                after=None, limit: int = None) -> list:
         """
-        Get all Redshift roles
+        Get all Redshift roles, or a filtered, sorted keyset page of them
+        
+        Args:
+            rs: Redshift connection
+            search: Only roles whose name contains this text, case insensitive
+            sort: Sort on 'name' or 'id'. Without any option, all roles are returned ordered by id
+            desc: Sort descending
+            after: Sort key of the last role of the previous page
+            limit: Max number of roles
         
         Returns:
             list: List of RedshiftRole objects
         """
         try:
-            results = rs.execute_query(sql.GET_ALL_ROLES)
-            roles = []
-            
-            if results:
-                for row in results:
-                    role_id = row[0]
-                    role_name = row[1]
-                    role_owner = row[2] if len(row) > 2 else None
-                    
-                    # Create role object with the available information
-                    role = cls(
-                        role_name=role_name,
-                        role_id=role_id,
-                        owner_name=role_owner
-                    )
-                    roles.append(role)
-                
-                # Users and nested roles are lazily loaded when needed
-                
-            return roles
+            if search is None and sort is None and after is None and limit is None:
+                return rs.fetch_as(cls, sql.GET_ALL_ROLES)
+            # Users and nested roles are loaded in bulk with load_members when needed
+            return rs.fetch_as(cls, *cls.page_query(rs, search, sort, desc, after, limit))
         except Exception as e:
             print(f"Error getting all roles: {e}")
             return []
+
+    @classmethod
+    def page_query(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                   after=None, limit: int = None) -> tuple:
+        'Query and args listing a filtered, sorted keyset page of roles'
+        column = cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[0]
+        if after is not None and column == 'role_id':
+            after = int(after)
+        clauses, page_args = rs.page_clauses(column, desc, after, limit)
+        return sql.GET_ROLES_PAGE.format(**clauses), (rs.like_pattern(search),) + page_args
+
+    @classmethod
+    def iter_pages(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                   page_size: int = PAGE_SIZE):
+        """
+        Yield all matching roles in lists of page_size, with members
+
+        Pages are fetched one keyset query at a time, so each page's connection is back in the
+        pool before the members of its roles are loaded.
+
+        Raises:
+            RuntimeError: If a page cannot be fetched
+        """
+        after = None
+        while True:
+            results = rs.execute_query(*cls.page_query(rs, search, sort, desc, after, page_size))
+            if results is None:
+                raise RuntimeError('Could not load roles')
+            roles = map_rows(results, cls)
+            if roles:
+                yield cls.load_members(roles, rs)
+            if len(roles) < page_size:
+                return
+            after = getattr(roles[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+
+    @classmethod
+    def get_page(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                 after=None, page_size: int = PAGE_SIZE) -> tuple:
+        """
+        One page of roles with their users and nested roles
+        
+        Returns:
+            tuple: (roles, sort key to pass as after for the next page, or None on the last page)
+        """
+        roles = cls.get_all(rs, search, sort, desc, after, page_size + 1)
+        next_after = None
+        if len(roles) > page_size:
+            roles = roles[:page_size]
+            next_after = getattr(roles[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+        return cls.load_members(roles, rs), next_after
     
     @classmethod
     def get_role(cls, role_name: str, rs: Redshift) -> 'RedshiftRole':
@@ -89,15 +145,25 @@ class RedshiftRole:
             return None
     
     @staticmethod
-    def get_all_role_users(rs: Redshift) -> dict:
+    def get_all_role_users(rs: Redshift, role_names: list = None) -> dict:
         """
-        Get all users for all roles
+        Get users of all roles, or only of the given roles, in one query
+        
+        Args:
+            rs: Redshift connection
+            role_names: Optional list of role names to limit the lookup to
         
         Returns:
             dict: Dictionary mapping role names to sets of usernames
         """
         try:
-            results = rs.execute_query(sql.GET_ALL_ROLE_USERS)
+            if role_names is None:
+                results = rs.execute_query(sql.GET_ALL_ROLE_USERS)
+            elif role_names:
+                query = sql.GET_ROLES_USERS.format(names=rs.placeholders(len(role_names)))
+                results = rs.execute_query(query, tuple(role_names))
+            else:
+                return {}
             role_users = {}
             
             if results:
@@ -112,6 +178,27 @@ class RedshiftRole:
             print(f"Error getting role users: {e}")
             return {}
     
+    @classmethod
+    def load_members(cls, roles: list, rs: Redshift, all_roles: bool = False) -> list:
+        """
+        Set users and nested roles of the given roles with one query each
+        
+        Args:
+            roles: List of RedshiftRole objects
+            rs: Redshift connection
+            all_roles: Load members of every role instead of filtering by the roles' names
+            
+        Returns:
+            list: The same roles, with users and nested roles set
+        """
+        role_names = None if all_roles else [r.role_name for r in roles]
+        role_users = cls.get_all_role_users(rs, role_names)
+        role_nested_roles = cls.get_all_role_nested_roles(rs, role_names)
+        for role in roles:
+            role.users = role_users.get(role.role_name, set())
+            role.nested_roles = role_nested_roles.get(role.role_name, set())
+        return roles
+    
     @staticmethod
     def get_role_users(role_name: str, rs: Redshift) -> list:
         """
@@ -132,15 +219,25 @@ class RedshiftRole:
             return []
     
     @staticmethod
-    def get_all_role_nested_roles(rs: Redshift) -> dict:
+    def get_all_role_nested_roles(rs: Redshift, role_names: list = None) -> dict:
         """
-        Get all nested roles for all roles
+        Get nested roles of all roles, or only of the given roles, in one query
+        
+        Args:
+            rs: Redshift connection
+            role_names: Optional list of role names to limit the lookup to
         
         Returns:
             dict: Dictionary mapping role names to sets of nested role names
         """
         try:
-            results = rs.execute_query(sql.GET_ALL_ROLE_NESTED_ROLES)
+            if role_names is None:
+                results = rs.execute_query(sql.GET_ALL_ROLE_NESTED_ROLES)
+            elif role_names:
+                query = sql.GET_ROLES_NESTED_ROLES.format(names=rs.placeholders(len(role_names)))
+                results = rs.execute_query(query, tuple(role_names))
+            else:
+                return {}
             role_nested_roles = {}
             
             if results:
@@ -175,7 +272,7 @@ class RedshiftRole:
             return []
     
     @staticmethod
-    def get_role_privileges(role_name: str, rs: Redshift) -> list:
+    def get_role_privileges(role_name: str, rs: Redshift) -> PrivilegeSet:
         """
         Get all privileges for a specific role
         
@@ -184,27 +281,14 @@ class RedshiftRole:
             rs: Redshift connection
             
         Returns:
-            list: List of privilege dictionaries
+            PrivilegeSet: Privileges of the role
         """
         try:
             results = rs.execute_query(sql.GET_ROLE_PRIVILEGES, (rs.name, role_name, rs.name, role_name,))
-            privileges = []
-            
-            if results:
-                for row in results:
-                    privilege = {
-                        'schema_name': row[0],
-                        'object_name': row[1],
-                        'object_type': row[2],
-                        'privilege_type': row[3],
-                        'is_grantable': row[4]
-                    }
-                    privileges.append(privilege)
-                    
-            return privileges
+            return PrivilegeSet.from_rows(results)
         except Exception as e:
             print(f"Error getting privileges for role {role_name}: {e}")
-            return []
+            return PrivilegeSet()
     
     @classmethod
     def create_role(cls, role_name: str, rs: Redshift) -> 'RedshiftRole':
@@ -226,6 +310,7 @@ class RedshiftRole:
             success = rs.execute_cmd(create_sql)
             
             if success:
+                rs.invalidate_catalog()
                 return cls(role_name=role_name)
             return None
         except Exception as e:
@@ -251,7 +336,12 @@ class RedshiftRole:
             delete_sql = f"DROP ROLE {self.role_name};"
             
             # Execute SQL
-            return rs.execute_cmd(delete_sql)
+            success = rs.execute_cmd(delete_sql)
+            if success:
+                rs.invalidate_catalog()
+                if graph := cached_role_graph(rs):
+                    graph.remove_role(self.role_name)
+            return success
         except Exception as e:
             print(f"Error deleting role {self.role_name}: {e}")
             return False
@@ -265,9 +355,15 @@ class RedshiftRole:
             rs: Redshift connection
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if successful, False otherwise. Also False, without running
+                  anything, if the grant would make a role inherit from itself
         """
         try:
+            graph = get_role_graph(rs)
+            if graph.creates_cycle(self.role_name, nested_role_name):
+                print(f"Not granting role {nested_role_name} to {self.role_name}: it would create a cycle")
+                return False
+            
             # Grant role SQL
             grant_sql = f"GRANT ROLE {nested_role_name} TO ROLE {self.role_name};"
             
@@ -276,6 +372,7 @@ class RedshiftRole:
             
             if success:
                 self.nested_roles.add(nested_role_name)
+                graph.add_edge(self.role_name, nested_role_name)
                 
             return success
         except Exception as e:
@@ -302,6 +399,8 @@ class RedshiftRole:
             
             if success:
                 self.nested_roles.discard(nested_role_name)
+                if graph := cached_role_graph(rs):
+                    graph.remove_edge(self.role_name, nested_role_name)
                 
             return success
         except Exception as e:
@@ -318,6 +417,10 @@ class RedshiftRole:
             
         Returns:
             bool: True if all operations were successful, False otherwise
+            
+        Raises:
+            RoleCycleError: If any of the new nested roles would make a role inherit
+                            from itself. Nothing is changed in that case.
         """
         try:
             # Find roles to add and remove
@@ -325,6 +428,13 @@ class RedshiftRole:
             roles_to_add = new_nested_roles - cur_roles
             roles_to_remove = cur_roles - new_nested_roles
             
+            # Reject cycles before changing anything. Removing this role's own grants
+            # cannot break a path back to it, so each addition is checked on its own.
+            graph = get_role_graph(rs)
+            cycles = sorted(r for r in roles_to_add if graph.creates_cycle(self.role_name, r))
+            if cycles:
+                raise RoleCycleError(f"Granting {', '.join(cycles)} to {self.role_name} would create a cycle.")
+            
             # Remove roles
             for role_name in roles_to_remove:
                 if not self.remove_nested_role(role_name, rs):
@@ -336,6 +446,8 @@ class RedshiftRole:
                     return False
                     
             return True
+        except RoleCycleError:
+            raise
         except Exception as e:
             print(f"Error updating nested roles for {self.role_name}: {e}")
             return False
@@ -369,14 +481,8 @@ class RedshiftRole:
             success = rs.execute_cmd(grant_sql)
             
             if success:
-                # Add to privileges list
-                self.privileges.append({
-                    'schema_name': schema_name,
-                    'object_name': object_name,
-                    'object_type': object_type,
-                    'privilege_type': privilege_type,
-                    'is_grantable': False
-                })
+                # Add to privileges
+                self.privileges.add(Privilege.create(schema_name, object_name, object_type, privilege_type))
                 
             return success
         except Exception as e:
@@ -412,15 +518,107 @@ class RedshiftRole:
             success = rs.execute_cmd(revoke_sql)
             
             if success:
-                # Remove from privileges list
-                self.privileges = [p for p in self.privileges if not (
-                    p['schema_name'] == schema_name and
-                    p['object_name'] == object_name and
-                    p['object_type'] == object_type and
-                    p['privilege_type'] == privilege_type
-                )]
+                # Remove from privileges
+                self.privileges.discard(Privilege(schema_name, object_name, object_type, privilege_type))
                 
             return success
         except Exception as e:
             print(f"Error revoking privilege from {self.role_name}: {e}")
             return False
+
+    def apply_privileges(self, grants: list, revokes: list, rs: Redshift) -> list:
+        """
+        Grant and revoke privileges of this role in one transaction
+        
+        Compatible privileges are merged into multi-object statements and the whole
+        changeset runs on one connection. Either every statement is applied or none is.
+        
+        Args:
+            grants: Privileges to grant
+            revokes: Privileges to revoke
+            rs: Redshift connection
+            
+        Returns:
+            list: PrivilegeStatement objects with per-statement success and error
+        """
+        statements = build_privilege_statements(f'ROLE {self.role_name}', grants, revokes)
+        try:
+            if statements and execute_privilege_statements(statements, rs):
+                # Patch privileges list with what was applied, no reload needed
+                for p in revokes:
+                    self.privileges.discard(p)
+                for p in grants:
+                    self.privileges.add(p._replace(is_grantable=False))
+        except Exception as e:
+            print(f"Error applying privileges for {self.role_name}: {e}")
+        return statements
+
+    # ===== Async loaders =====
+    # Awaitable counterparts of the loaders above, run on the Redshift SQL executor
+
+    @classmethod
+    async def get_all_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all, rs)
+
+    @classmethod
+    async def get_role_async(cls, role_name: str, rs: Redshift) -> 'RedshiftRole':
+        """
+        Get a specific role by name
+        
+        The info, users, nested roles and privileges queries are independent of
+        each other and run concurrently, each on its own pooled connection.
+        """
+        try:
+            results, users, nested_roles, privileges = await asyncio.gather(
+                rs.execute_query_async(sql.GET_ROLE_INFO, (role_name,)),
+                rs.run_async(cls.get_role_users, role_name, rs),
+                rs.run_async(cls.get_role_nested_roles, role_name, rs),
+                rs.run_async(cls.get_role_privileges, role_name, rs),
+            )
+            if not results:
+                return None
+            return cls(role_name=role_name, users=set(users), nested_roles=set(nested_roles),
+                       privileges=privileges)
+        except Exception as e:
+            print(f"Error getting role {role_name}: {e}")
+            return None
+
+    @classmethod
+    async def get_role_page_async(cls, role_name: str, rs: Redshift) -> tuple:
+        """
+        Load everything the role detail page shows, concurrently
+        
+        Args:
+            role_name: The name of the role
+            rs: Redshift connection
+            
+        Returns:
+            tuple: (role, all_roles, schemas, schema_relations, role_graph), role is None if not found.
+                   schema_relations only holds the schemas rendered up front, see get_privileges_catalog_async
+        """
+        role, all_roles, schemas, graph = await asyncio.gather(
+            cls.get_role_async(role_name, rs),
+            cls.get_all_async(rs),
+            rs.get_schema_list_async(),
+            get_role_graph_async(rs),
+        )
+        schema_relations = await rs.get_privileges_catalog_async(schemas, role.privileges.schemas()) if role else {}
+        return role, all_roles, schemas, schema_relations, graph
+
+    @classmethod
+    def iter_pages_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                         page_size: int = PAGE_SIZE):
+        return rs.iter_async(cls.iter_pages(rs, search, sort, desc, page_size))
+
+    @classmethod
+    async def get_page_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                             after=None, page_size: int = PAGE_SIZE) -> tuple:
+        return await rs.run_async(cls.get_page, rs, search, sort, desc, after, page_size)
+
+    @classmethod
+    async def load_members_async(cls, roles: list, rs: Redshift, all_roles: bool = False) -> list:
+        return await rs.run_async(cls.load_members, roles, rs, all_roles)
+
+    @classmethod
+    async def get_role_privileges_async(cls, role_name: str, rs: Redshift) -> PrivilegeSet:
+        return await rs.run_async(cls.get_role_privileges, role_name, rs)
@@ -0,0 +1,184 @@
+import threading
+import redshift.sql_queries as sql
+from redshift.database import Redshift
+from redshift.cache import TTLCache, CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL
+
+
+class RoleCycleError(ValueError):
+    'Raised when granting a role would make it inherit from itself.'
+
+
+class RoleGraph:
+    """
+    In-memory hierarchy of nested roles, built from one svv_role_grants scan
+
+    An edge role -> granted role means role inherits the granted role's privileges.
+    Descendants (roles a role inherits from) and ancestors (roles inheriting from it)
+    are precomputed for every role and updated incrementally as edges are added or
+    removed, so hierarchy questions are set lookups. Edges that would close a cycle
+    are rejected before anything is sent to Redshift.
+    """
+
+    def __init__(self, edges=()):
+        self._children = {}       # role -> {granted role, ...}
+        self._parents = {}        # role -> {role it is granted to, ...}
+        self._descendants = {}    # role -> all roles reachable through _children
+        self._ancestors = {}      # role -> all roles reaching it
+        self._depths = {}         # memoized depth per role, cleared on any change
+        self._lock = threading.RLock()
+        for role_name, granted_role_name in edges:
+            self._children.setdefault(role_name, set()).add(granted_role_name)
+            self._parents.setdefault(granted_role_name, set()).add(role_name)
+        for role_name in list(self._children):
+            self._reach(role_name, self._children, self._descendants)
+        for role_name in list(self._parents):
+            self._reach(role_name, self._parents, self._ancestors)
+
+    @classmethod
+    def load(cls, rs: Redshift) -> 'RoleGraph':
+        'Build the graph from all role grants'
+        return cls(rs.execute_query(sql.GET_ALL_ROLE_NESTED_ROLES) or [])
+
+    @staticmethod
+    def _reach(role_name: str, edges: dict, memo: dict, visiting: set = None) -> set:
+        # Roles reachable from role_name along edges, memoized. Redshift rejects circular
+        # grants, visiting only stops a corrupt graph from looping.
+        if role_name in memo:
+            return memo[role_name]
+        visiting = visiting if visiting is not None else set()
+        visiting.add(role_name)
+        reach = set()
+        for nxt in edges.get(role_name, ()):
+            reach.add(nxt)
+            if nxt not in visiting:
+                reach |= RoleGraph._reach(nxt, edges, memo, visiting)
+        visiting.discard(role_name)
+        memo[role_name] = reach
+        return reach
+
+    # ===== Queries =====
+
+    def nested_roles(self, role_name: str) -> set:
+        'Roles granted directly to a role.'
+        with self._lock:
+            return set(self._children.get(role_name, ()))
+
+    def descendants(self, role_name: str) -> set:
+        'All roles a role inherits privileges from, through any number of levels.'
+        with self._lock:
+            return set(self._descendants.get(role_name, ()))
+
+    def ancestors(self, role_name: str) -> set:
+        'All roles inheriting the privileges of a role, through any number of levels.'
+        with self._lock:
+            return set(self._ancestors.get(role_name, ()))
+
+    def creates_cycle(self, role_name: str, granted_role_name: str) -> bool:
+        'Whether granting granted_role_name to role_name would make a role inherit from itself.'
+        with self._lock:
+            return role_name == granted_role_name or role_name in self._descendants.get(granted_role_name, ())
+
+    def depth(self, role_name: str) -> int:
+        'Levels of nested roles below a role, 0 if it has none.'
+        with self._lock:
+            if role_name not in self._depths:
+                self._depths[role_name] = 0     # placeholder, stops a corrupt graph from looping
+                children = self._children.get(role_name, ())
+                self._depths[role_name] = 1 + max(self.depth(c) for c in children) if children else 0
+            return self._depths[role_name]
+
+    def fan_out(self, role_name: str) -> int:
+        'Number of roles granted directly to a role.'
+        return len(self._children.get(role_name, ()))
+
+    def stats(self, role_name: str) -> dict:
+        'Depth, direct fan-out and fan-in, and number of descendants and ancestors of a role.'
+        with self._lock:
+            return {'depth': self.depth(role_name), 'fan_out': self.fan_out(role_name),
+                    'fan_in': len(self._parents.get(role_name, ())),
+                    'descendants': len(self._descendants.get(role_name, ())),
+                    'ancestors': len(self._ancestors.get(role_name, ()))}
+
+    def edges(self) -> dict:
+        'role -> set of granted roles, a copy of the whole graph.'
+        with self._lock:
+            return {role_name: set(children) for role_name, children in self._children.items()}
+
+    # ===== Incremental updates =====
+
+    def add_edge(self, role_name: str, granted_role_name: str):
+        """
+        Record granted_role_name granted to role_name
+
+        Raises:
+            RoleCycleError: If the grant would make a role inherit from itself
+        """
+        with self._lock:
+            if self.creates_cycle(role_name, granted_role_name):
+                raise RoleCycleError(f'Granting role {granted_role_name} to {role_name} would create a cycle.')
+            if granted_role_name in self._children.get(role_name, ()):
+                return
+            self._children.setdefault(role_name, set()).add(granted_role_name)
+            self._parents.setdefault(granted_role_name, set()).add(role_name)
+            # Everything reaching role_name now also reaches granted_role_name and what it reaches
+            upper = {role_name} | self._ancestors.get(role_name, set())
+            lower = {granted_role_name} | self._descendants.get(granted_role_name, set())
+            for r in upper:
+                self._descendants.setdefault(r, set()).update(lower)
+            for r in lower:
+                self._ancestors.setdefault(r, set()).update(upper)
+            self._depths.clear()
+
+    def remove_edge(self, role_name: str, granted_role_name: str):
+        'Forget granted_role_name granted to role_name, if it was.'
+        with self._lock:
+            if granted_role_name not in self._children.get(role_name, ()):
+                return
+            self._children[role_name].discard(granted_role_name)
+            self._parents[granted_role_name].discard(role_name)
+            # Only reachability through the removed edge can change: recompute the
+            # descendants of role_name and its ancestors, and the ancestors of what was below it
+            upper = {role_name} | self._ancestors.get(role_name, set())
+            lower = {granted_role_name} | self._descendants.get(granted_role_name, set())
+            memo = {r: reach for r, reach in self._descendants.items() if r not in upper}
+            for r in upper:
+                self._descendants[r] = self._reach(r, self._children, memo)
+            memo = {r: reach for r, reach in self._ancestors.items() if r not in lower}
+            for r in lower:
+                self._ancestors[r] = self._reach(r, self._parents, memo)
+            self._depths.clear()
+
+    def remove_role(self, role_name: str):
+        'Forget a dropped role and all its edges.'
+        with self._lock:
+            for granted_role_name in list(self._children.get(role_name, ())):
+                self.remove_edge(role_name, granted_role_name)
+            for parent in list(self._parents.get(role_name, ())):
+                self.remove_edge(parent, role_name)
+            for index in (self._children, self._parents, self._descendants, self._ancestors):
+                index.pop(role_name, None)
+
+
+# Process-wide role graphs, keyed like the catalog cache by cluster, database and user
+role_graph_cache = TTLCache(maxsize=CATALOG_CACHE_SIZE, ttl=CATALOG_CACHE_TTL, name='role_graph')
+
+
+def get_role_graph(rs: Redshift, refresh: bool = False) -> RoleGraph:
+    """
+    Get the role graph of a cluster, built on first use
+
+    RSMate's own grants and revokes update the cached graph in place, changes
+    made outside it show once the cache entry expires.
+    """
+    if refresh:
+        role_graph_cache.pop(rs.catalog_key())
+    return role_graph_cache.get_or_load(rs.catalog_key(), lambda: RoleGraph.load(rs))
+
+
+def cached_role_graph(rs: Redshift):
+    'The role graph of a cluster if it is cached, None otherwise. For updates that should not trigger a load.'
+    return role_graph_cache.get(rs.catalog_key())
+
+
+async def get_role_graph_async(rs: Redshift, refresh: bool = False) -> RoleGraph:
+    return await rs.run_async(get_role_graph, rs, refresh)
@@ -29,12 +29,68 @@ GET_ALL_USERS = """
                 """
 
 
+GET_ALL_USER_NAMES = """
+                    SELECT usename AS user_name FROM pg_user;
+                """
+
+# {names} is filled with one %s placeholder per user name
+GET_USER_IDS_BY_NAMES = """
+                    SELECT usesysid AS user_id, usename AS user_name 
+                    FROM pg_user 
+                    WHERE usename IN ({names});
+                """
+
 GET_ALL_USER_ROLES = """
                     SELECT 
                         user_id, role_name
                     FROM svv_user_grants;
                 """
 
+GET_ALL_USER_GROUPS = """
+                    SELECT 
+                        u.usesysid  AS user_id,
+                        g.groname   AS group_name
+                    FROM pg_group g
+                    JOIN pg_user u ON u.usesysid = ANY(g.grolist)
+                    ORDER BY g.groname;
+                """
+
+# {ids} is filled with one %s placeholder per user id
+GET_USERS_ROLES = """
+                    SELECT 
+                        user_id, role_name
+                    FROM svv_user_grants
+                    WHERE user_id IN ({ids});
+                """
+
+GET_USERS_GROUPS = """
+                    SELECT 
+                        u.usesysid  AS user_id,
+                        g.groname   AS group_name
+                    FROM pg_group g
+                    JOIN pg_user u ON u.usesysid = ANY(g.grolist)
+                    WHERE u.usesysid IN ({ids})
+                    ORDER BY g.groname;
+                """
+
+# Listing pages. {keyset}, {order} and {limit} are filled by Redshift.page_clauses
+# from a fixed sort column, never from user input
+GET_USERS_PAGE = """
+                    SELECT 
+                        usesysid                        AS user_id,
+                        usename                         AS user_name, 
+                        usesuper                        AS super_user, 
+                        usecreatedb                     AS can_create_db, 
+                        usecatupd                       AS can_update_catalog,
+                        valuntil::timestamp::varchar    AS password_expiry,
+                        useconfig                       AS session_defaults,
+                        useconnlimit                    AS connection_limit
+                    FROM pg_user_info
+                    WHERE usename ILIKE %s {keyset}
+                    ORDER BY {order}
+                    {limit};
+                """
+
 # Dynamic queries with placeholders
 GET_USER_GROUPS = """
                     SELECT 
@@ -97,6 +153,34 @@ GET_GROUP_INFO = """
                     SELECT groname AS group_name FROM pg_group WHERE groname = %s;
                 """
 
+GET_ALL_GROUP_USERS = """
+                    SELECT 
+                        g.groname   AS group_name,
+                        u.usename   AS user_name
+                    FROM pg_group g
+                    LEFT JOIN pg_user u ON u.usesysid = ANY(g.grolist)
+                    ORDER BY g.groname, u.usename;
+                """
+
+GET_GROUPS_PAGE = """
+                    SELECT groname AS group_name 
+                    FROM pg_group
+                    WHERE groname ILIKE %s {keyset}
+                    ORDER BY {order}
+                    {limit};
+                """
+
+# {names} is filled with one %s placeholder per group name
+GET_GROUPS_USERS = """
+                    SELECT 
+                        g.groname   AS group_name,
+                        u.usename   AS user_name
+                    FROM pg_group g
+                    LEFT JOIN pg_user u ON u.usesysid = ANY(g.grolist)
+                    WHERE g.groname IN ({names})
+                    ORDER BY g.groname, u.usename;
+                """
+
 GET_GROUP_USERS = """
                     SELECT 
                         u.usename AS user_name
@@ -110,6 +194,14 @@ GET_ALL_ROLES = """
                     SELECT role_id, role_name, role_owner FROM svv_roles ORDER BY role_id;
                 """
 
+GET_ROLES_PAGE = """
+                    SELECT role_id, role_name, role_owner 
+                    FROM svv_roles
+                    WHERE role_name ILIKE %s {keyset}
+                    ORDER BY {order}
+                    {limit};
+                """
+
 # Role queries
 GET_ROLE_INFO = """
                     SELECT role_name FROM svv_roles WHERE role_name = %s;
@@ -120,6 +212,13 @@ GET_ALL_ROLE_USERS = """
                     FROM svv_user_grants;
                 """
 
+# {names} is filled with one %s placeholder per role name
+GET_ROLES_USERS = """
+                    SELECT role_name, user_name 
+                    FROM svv_user_grants
+                    WHERE role_name IN ({names});
+                """
+
 GET_ROLE_USERS = """
                     SELECT user_name 
                     FROM svv_user_grants 
@@ -131,6 +230,12 @@ GET_ALL_ROLE_NESTED_ROLES = """
                     FROM svv_role_grants;
                 """
 
+GET_ROLES_NESTED_ROLES = """
+                    SELECT role_name, granted_role_name 
+                    FROM svv_role_grants
+                    WHERE role_name IN ({names});
+                """
+
 GET_ROLE_NESTED_ROLES = """
                     SELECT granted_role_name 
                     FROM svv_role_grants 
@@ -179,6 +284,94 @@ GET_ROLE_PRIVILEGES = """
                       AND identity_name = %s;
                 """
 
+# Privileges of every role, with the role name first
+GET_ALL_ROLES_PRIVILEGES = """
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.relation_name, 
+                        (CASE WHEN t.table_type = 'BASE TABLE' THEN 'TABLE'
+                            ELSE 'VIEW' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_relation_privileges p
+                    INNER JOIN svv_tables t 
+                        ON t.table_schema = p.namespace_name
+                        AND t.table_name = p.relation_name
+                    WHERE t.table_catalog = %s
+                      AND t.table_schema NOT LIKE 'pg_%' 
+                      AND t.table_schema NOT LIKE 'information_schema'
+                      AND t.table_schema <> 'public'
+                      AND t.table_type IN ('BASE TABLE', 'VIEW')
+                      AND p.identity_type = 'role'
+                    UNION ALL 
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.function_name, 
+                        (CASE WHEN f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION') THEN 'FUNCTION'
+                            ELSE 'PROCEDURE' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_function_privileges p
+                    INNER JOIN svv_redshift_functions f 
+                        ON f.schema_name = p.namespace_name
+                        AND f.function_name = p.function_name
+                    WHERE f.database_name = %s
+                      AND f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                      AND f.schema_name NOT LIKE 'pg_%'
+                      AND f.schema_name NOT LIKE 'information_schema'
+                      AND f.schema_name <> 'public'
+                      AND identity_type = 'role';
+                """
+
+# Privileges of some roles, with the role name first. Both {names} are filled with one %s placeholder per role name
+GET_ROLES_PRIVILEGES = """
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.relation_name, 
+                        (CASE WHEN t.table_type = 'BASE TABLE' THEN 'TABLE'
+                            ELSE 'VIEW' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_relation_privileges p
+                    INNER JOIN svv_tables t 
+                        ON t.table_schema = p.namespace_name
+                        AND t.table_name = p.relation_name
+                    WHERE t.table_catalog = %s
+                      AND t.table_schema NOT LIKE 'pg_%' 
+                      AND t.table_schema NOT LIKE 'information_schema'
+                      AND t.table_schema <> 'public'
+                      AND t.table_type IN ('BASE TABLE', 'VIEW')
+                      AND p.identity_type = 'role'
+                      AND p.identity_name IN ({names})
+                    UNION ALL 
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.function_name, 
+                        (CASE WHEN f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION') THEN 'FUNCTION'
+                            ELSE 'PROCEDURE' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_function_privileges p
+                    INNER JOIN svv_redshift_functions f 
+                        ON f.schema_name = p.namespace_name
+                        AND f.function_name = p.function_name
+                    WHERE f.database_name = %s
+                      AND f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                      AND f.schema_name NOT LIKE 'pg_%'
+                      AND f.schema_name NOT LIKE 'information_schema'
+                      AND f.schema_name <> 'public'
+                      AND identity_type = 'role'
+                      AND identity_name IN ({names});
+                """
+
 GET_USER_PRIVILEGES_BY_NAME = """
                     SELECT 
                         p.namespace_name, 
@@ -221,6 +414,136 @@ GET_USER_PRIVILEGES_BY_NAME = """
                       AND identity_name = %s;
                 """
 
+GET_USER_PRIVILEGES_BY_ID = """
+                    SELECT 
+                        p.namespace_name, 
+                        p.relation_name, 
+                        (CASE WHEN t.table_type = 'BASE TABLE' THEN 'TABLE'
+                            ELSE 'VIEW' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_relation_privileges p
+                    INNER JOIN svv_tables t 
+                        ON t.table_schema = p.namespace_name
+                        AND t.table_name = p.relation_name
+                    WHERE t.table_catalog = %s
+                      AND t.table_schema NOT LIKE 'pg_%' 
+                      AND t.table_schema NOT LIKE 'information_schema'
+                      AND t.table_schema <> 'public'
+                      AND t.table_type IN ('BASE TABLE', 'VIEW')
+                      AND p.identity_type = 'user'
+                      AND p.identity_id = %s
+                    UNION ALL 
+                    SELECT 
+                        p.namespace_name, 
+                        p.function_name, 
+                        (CASE WHEN f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION') THEN 'FUNCTION'
+                            ELSE 'PROCEDURE' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_function_privileges p
+                    INNER JOIN svv_redshift_functions f 
+                        ON f.schema_name = p.namespace_name
+                        AND f.function_name = p.function_name
+                    WHERE f.database_name = %s
+                      AND f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                      AND f.schema_name NOT LIKE 'pg_%'
+                      AND f.schema_name NOT LIKE 'information_schema'
+                      AND f.schema_name <> 'public'
+                      AND identity_type = 'user'
+                      AND identity_id = %s;
+                """
+
+# Privileges of every user, with the user name first
+GET_ALL_USERS_PRIVILEGES = """
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.relation_name, 
+                        (CASE WHEN t.table_type = 'BASE TABLE' THEN 'TABLE'
+                            ELSE 'VIEW' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_relation_privileges p
+                    INNER JOIN svv_tables t 
+                        ON t.table_schema = p.namespace_name
+                        AND t.table_name = p.relation_name
+                    WHERE t.table_catalog = %s
+                      AND t.table_schema NOT LIKE 'pg_%' 
+                      AND t.table_schema NOT LIKE 'information_schema'
+                      AND t.table_schema <> 'public'
+                      AND t.table_type IN ('BASE TABLE', 'VIEW')
+                      AND p.identity_type = 'user'
+                    UNION ALL 
+                    SELECT 
+                        p.identity_name,
+                        p.namespace_name, 
+                        p.function_name, 
+                        (CASE WHEN f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION') THEN 'FUNCTION'
+                            ELSE 'PROCEDURE' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_function_privileges p
+                    INNER JOIN svv_redshift_functions f 
+                        ON f.schema_name = p.namespace_name
+                        AND f.function_name = p.function_name
+                    WHERE f.database_name = %s
+                      AND f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                      AND f.schema_name NOT LIKE 'pg_%'
+                      AND f.schema_name NOT LIKE 'information_schema'
+                      AND f.schema_name <> 'public'
+                      AND identity_type = 'user';
+                """
+
+# Privileges of some users, with the user id first. Both {ids} are filled with one %s placeholder per user id
+GET_USERS_PRIVILEGES = """
+                    SELECT 
+                        p.identity_id,
+                        p.namespace_name, 
+                        p.relation_name, 
+                        (CASE WHEN t.table_type = 'BASE TABLE' THEN 'TABLE'
+                            ELSE 'VIEW' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_relation_privileges p
+                    INNER JOIN svv_tables t 
+                        ON t.table_schema = p.namespace_name
+                        AND t.table_name = p.relation_name
+                    WHERE t.table_catalog = %s
+                      AND t.table_schema NOT LIKE 'pg_%' 
+                      AND t.table_schema NOT LIKE 'information_schema'
+                      AND t.table_schema <> 'public'
+                      AND t.table_type IN ('BASE TABLE', 'VIEW')
+                      AND p.identity_type = 'user'
+                      AND p.identity_id IN ({ids})
+                    UNION ALL 
+                    SELECT 
+                        p.identity_id,
+                        p.namespace_name, 
+                        p.function_name, 
+                        (CASE WHEN f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION') THEN 'FUNCTION'
+                            ELSE 'PROCEDURE' 
+                        END) AS relation_type, 
+                        p.privilege_type, 
+                        p.admin_option 
+                    FROM svv_function_privileges p
+                    INNER JOIN svv_redshift_functions f 
+                        ON f.schema_name = p.namespace_name
+                        AND f.function_name = p.function_name
+                    WHERE f.database_name = %s
+                      AND f.function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                      AND f.schema_name NOT LIKE 'pg_%'
+                      AND f.schema_name NOT LIKE 'information_schema'
+                      AND f.schema_name <> 'public'
+                      AND identity_type = 'user'
+                      AND identity_id IN ({ids});
+                """
+
 GET_ALL_SCHEMAS = """
                     SELECT schema_name 
                     FROM svv_all_schemas
@@ -267,6 +590,62 @@ GET_SCHEMA_PROCEDURES = """
                     ORDER BY function_name;
                 """
 
+GET_ALL_SCHEMA_RELATIONS = """
+                    SELECT 
+                        table_schema                AS schema_name,
+                        (CASE WHEN table_type = 'BASE TABLE' THEN 'tables'
+                            ELSE 'views'
+                        END)                        AS relation_type,
+                        table_name                  AS relation_name
+                    FROM svv_tables
+                    WHERE table_catalog = %s
+                      AND table_schema NOT LIKE 'pg_%' 
+                      AND table_schema NOT LIKE 'information_schema'
+                      AND table_schema <> 'public'
+                      AND table_type IN ('BASE TABLE', 'VIEW')
+                    UNION ALL
+                    SELECT 
+                        schema_name,
+                        (CASE WHEN function_type = 'STORED PROCEDURE' THEN 'procedures'
+                            ELSE 'functions'
+                        END)                        AS relation_type,
+                        function_name               AS relation_name
+                    FROM svv_redshift_functions
+                    WHERE database_name = %s
+                      AND schema_name NOT LIKE 'pg_%'
+                      AND schema_name NOT LIKE 'information_schema'
+                      AND schema_name <> 'public'
+                      AND function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                    ORDER BY 1, 3;
+                """
+
+# Same as GET_ALL_SCHEMA_RELATIONS for some schemas only.
+# Both {names} are filled with one %s placeholder per schema name
+GET_SCHEMAS_RELATIONS = """
+                    SELECT 
+                        table_schema                AS schema_name,
+                        (CASE WHEN table_type = 'BASE TABLE' THEN 'tables'
+                            ELSE 'views'
+                        END)                        AS relation_type,
+                        table_name                  AS relation_name
+                    FROM svv_tables
+                    WHERE table_catalog = %s
+                      AND table_schema IN ({names})
+                      AND table_type IN ('BASE TABLE', 'VIEW')
+                    UNION ALL
+                    SELECT 
+                        schema_name,
+                        (CASE WHEN function_type = 'STORED PROCEDURE' THEN 'procedures'
+                            ELSE 'functions'
+                        END)                        AS relation_type,
+                        function_name               AS relation_name
+                    FROM svv_redshift_functions
+                    WHERE database_name = %s
+                      AND schema_name IN ({names})
+                      AND function_type IN ('REGULAR FUNCTION', 'AGGREGATE FUNCTION', 'STORED PROCEDURE')
+                    ORDER BY 1, 3;
+                """
+
 # ===== Privileges =====
 
 GET_USER_PRIVILEGES = """
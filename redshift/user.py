@@ -1,7 +1,9 @@
+import asyncio
 import redshift.sql_queries as sql
-from redshift.database import Redshift
+from redshift.database import Redshift, PAGE_SIZE, map_rows
+from redshift.privilege import Privilege, PrivilegeSet, build_privilege_statements, execute_privilege_statements
 from dataclasses import dataclass, field
-from typing import Optional, List
+from typing import Optional
 
 # TODO: Groups and roles update might be overwriting each other values.
 @dataclass
@@ -20,7 +22,7 @@ class RedshiftUser:
     password: Optional[str] = None
     groups: list = field(default_factory=list)
     roles: list = field(default_factory=list)
-    privileges: List[dict] = field(default_factory=list)
+    privileges: PrivilegeSet = field(default_factory=PrivilegeSet)
 
     def update_fields(self, data: dict):
         if data:
@@ -28,56 +30,121 @@ class RedshiftUser:
                     if hasattr(self, key):
                         setattr(self, key, value) 
 
-    @classmethod
-    def map_results(cls, results, column_names) -> 'RedshiftUser':
-        return [cls(**dict(zip(column_names, row))) for row in results]
+    def schema_privileges(self, schema_name: str) -> dict:
+        "Privileges of this user in one schema, as 'TYPE:object_name' -> privilege types. An index lookup."
+        return self.privileges.schema_privileges(schema_name)
+
+    # List sort options: sort name -> (column, attribute holding the sort key)
+    SORT_COLUMNS = {'name': ('usename', 'user_name'), 'id': ('usesysid', 'user_id')}
 
     @classmethod
-    def get_all(cls, rs: Redshift) -> list:
+    def get_all(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                after=None, limit: int = None) -> list:
         """
-        get all redshift users
+        get all redshift users, or a filtered, sorted keyset page of them
+        
+        Args:
+            rs: Redshift connection
+            search: Only users whose name contains this text, case insensitive
+            sort: Sort on 'name' or 'id'. Without any option, all users are returned ordered by id
+            desc: Sort descending
+            after: Sort key of the last user of the previous page
+            limit: Max number of users
         
         returns:
             list: list of redshift user objects
         """
         try:
-            results = rs.execute_query(sql.GET_ALL_USERS)
-            cols = ['user_id', 'user_name', 'super_user', 'can_create_db',
-                         'can_update_catalog', 'password_expiry', 
-                         'session_defaults', 'connection_limit']
-
-            return cls.map_results(results, cols) if results else []
+            if search is None and sort is None and after is None and limit is None:
+                return rs.fetch_as(cls, sql.GET_ALL_USERS)
+            return rs.fetch_as(cls, *cls.page_query(rs, search, sort, desc, after, limit))
         except Exception as e: 
             print(e)
             return []
 
+    @classmethod
+    def page_query(cls, rs: Redshift, search: str = None, sort: str = None, desc: bool = False,
+                   after=None, limit: int = None) -> tuple:
+        'Query and args listing a filtered, sorted keyset page of users'
+        column = cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[0]
+        if after is not None and column == 'usesysid':
+            after = int(after)
+        clauses, page_args = rs.page_clauses(column, desc, after, limit)
+        return sql.GET_USERS_PAGE.format(**clauses), (rs.like_pattern(search),) + page_args
+
+    @classmethod
+    def iter_pages(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                   page_size: int = PAGE_SIZE):
+        """
+        Yield all matching users in lists of page_size, with groups and roles
+
+        Pages are fetched one keyset query at a time, so each page's connection is back in the
+        pool before the memberships of its users are loaded.
+
+        Raises:
+            RuntimeError: If a page cannot be fetched
+        """
+        after = None
+        while True:
+            results = rs.execute_query(*cls.page_query(rs, search, sort, desc, after, page_size))
+            if results is None:
+                raise RuntimeError('Could not load users')
+            users = map_rows(results, cls)
+            if users:
+                yield cls.load_memberships(users, rs)
+            if len(users) < page_size:
+                return
+            after = getattr(users[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+
+    @classmethod
+    def get_page(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                 after=None, page_size: int = PAGE_SIZE) -> tuple:
+        """
+        One page of users with their groups and roles
+        
+        Returns:
+            tuple: (users, sort key to pass as after for the next page, or None on the last page)
+        """
+        users = cls.get_all(rs, search, sort, desc, after, page_size + 1)
+        next_after = None
+        if len(users) > page_size:
+            users = users[:page_size]
+            next_after = getattr(users[-1], cls.SORT_COLUMNS.get(sort, cls.SORT_COLUMNS['name'])[1])
+        return cls.load_memberships(users, rs), next_after
+
+    @staticmethod
+    def get_create_user_sql(u: 'RedshiftUser') -> str:
+        'CREATE USER statement for a new user and its properties'
+        create_sql = f"CREATE USER {u.user_name} PASSWORD '{u.password}'"
+        
+        # Add user properties
+        create_sql += f" {'' if u.super_user else 'NO'}CREATEUSER"
+        create_sql += f" {'' if u.can_create_db else 'NO'}CREATEDB"
+            
+        if u.connection_limit and u.connection_limit > 0:
+            create_sql += f" CONNECTION LIMIT {u.connection_limit}"
+            
+        if u.session_timeout and u.session_timeout > 0:
+            create_sql += f" SESSION TIMEOUT {u.session_timeout}"
+            
+        if u.syslog_access:
+            create_sql += f" SYSLOG ACCESS {u.syslog_access}"
+            
+        if u.password_expiry:
+            create_sql += f" VALID UNTIL '{u.password_expiry}'"
+            
+        return create_sql + ";"
+
     @classmethod
     def create_user(cls, u: 'RedshiftUser', rs: Redshift) -> bool:
         """Create a new user in Redshift"""
         try:
             # Build the CREATE USER SQL statement
-            create_sql = f"CREATE USER {u.user_name} PASSWORD '{u.password}'"
-            
-            # Add user properties
-            create_sql += f" {'' if u.super_user else 'NO'}CREATEUSER"
-            create_sql += f" {'' if u.can_create_db else 'NO'}CREATEDB"
-                
-            if u.connection_limit and u.connection_limit > 0:
-                create_sql += f" CONNECTION LIMIT {u.connection_limit}"
-                
-            if u.session_timeout and u.session_timeout > 0:
-                create_sql += f" SESSION TIMEOUT {u.session_timeout}"
-                
-            if u.syslog_access:
-                create_sql += f" SYSLOG ACCESS {u.syslog_access}"
-                
-            if u.password_expiry:
-                create_sql += f" VALID UNTIL '{u.password_expiry}'"
-                
-            create_sql += ";"
+            create_sql = cls.get_create_user_sql(u)
             
             # Execute the SQL command
             if rs.execute_cmd(create_sql):
+                rs.invalidate_catalog()
                 # Get the newly created user to get the user_id
                 user = cls.get_user(-1, rs, user_name=u.user_name, all_info=False)
                 return user if user else None
@@ -101,7 +168,86 @@ class RedshiftUser:
         return [r[0] for r in results] if results else []
 
     @staticmethod
-    def get_user_privileges(user_name: str, rs: Redshift) -> list:
+    def get_all_user_groups(rs: Redshift, user_ids: list = None) -> dict:
+        """
+        Get groups of all users, or only of the given users, in one query
+        
+        Args:
+            rs: Redshift connection
+            user_ids: Optional list of user IDs to limit the lookup to
+            
+        Returns:
+            dict: Dictionary mapping user IDs to lists of group names
+        """
+        try:
+            if user_ids is None:
+                results = rs.execute_query(sql.GET_ALL_USER_GROUPS)
+            elif user_ids:
+                query = sql.GET_USERS_GROUPS.format(ids=rs.placeholders(len(user_ids)))
+                results = rs.execute_query(query, tuple(user_ids))
+            else:
+                return {}
+
+            user_groups = {}
+            for user_id, group_name in results or []:
+                user_groups.setdefault(user_id, []).append(group_name)
+            return user_groups
+        except Exception as e:
+            print(f"Error getting user groups: {e}")
+            return {}
+
+    @staticmethod
+    def get_all_user_roles(rs: Redshift, user_ids: list = None) -> dict:
+        """
+        Get roles of all users, or only of the given users, in one query
+        
+        Args:
+            rs: Redshift connection
+            user_ids: Optional list of user IDs to limit the lookup to
+            
+        Returns:
+            dict: Dictionary mapping user IDs to lists of role names
+        """
+        try:
+            if user_ids is None:
+                results = rs.execute_query(sql.GET_ALL_USER_ROLES)
+            elif user_ids:
+                query = sql.GET_USERS_ROLES.format(ids=rs.placeholders(len(user_ids)))
+                results = rs.execute_query(query, tuple(user_ids))
+            else:
+                return {}
+
+            user_roles = {}
+            for user_id, role_name in results or []:
+                user_roles.setdefault(user_id, []).append(role_name)
+            return user_roles
+        except Exception as e:
+            print(f"Error getting user roles: {e}")
+            return {}
+
+    @classmethod
+    def load_memberships(cls, users: list, rs: Redshift, all_users: bool = False) -> list:
+        """
+        Set groups and roles of the given users with one query each
+        
+        Args:
+            users: List of RedshiftUser objects
+            rs: Redshift connection
+            all_users: Load memberships of every user instead of filtering by the users' IDs
+            
+        Returns:
+            list: The same users, with groups and roles set
+        """
+        user_ids = None if all_users else [u.user_id for u in users]
+        user_groups = cls.get_all_user_groups(rs, user_ids)
+        user_roles = cls.get_all_user_roles(rs, user_ids)
+        for user in users:
+            user.groups = user_groups.get(user.user_id, [])
+            user.roles = user_roles.get(user.user_id, [])
+        return users
+
+    @staticmethod
+    def get_user_privileges(user_name: str, rs: Redshift) -> PrivilegeSet:
         """
         Get all privileges for a specific user
         
@@ -110,44 +256,40 @@ class RedshiftUser:
             rs: Redshift connection
             
         Returns:
-            list: List of privilege dictionaries
+            PrivilegeSet: Privileges of the user
         """
         try:
             results = rs.execute_query(sql.GET_USER_PRIVILEGES_BY_NAME, (rs.name, user_name, rs.name, user_name,))
-            privileges = []
-            
-            if results:
-                for row in results:
-                    privilege = {
-                        'schema_name': row[0],
-                        'object_name': row[1],
-                        'object_type': row[2],
-                        'privilege_type': row[3],
-                        'is_grantable': row[4]
-                    }
-                    privileges.append(privilege)
-                    
-            return privileges
+            return PrivilegeSet.from_rows(results)
         except Exception as e:
             print(f"Error getting privileges for user {user_name}: {e}")
-            return []
+            return PrivilegeSet()
+
+    @staticmethod
+    def get_user_privileges_by_id(user_id: int, rs: Redshift) -> PrivilegeSet:
+        'Get all privileges for a user by id, so they can be loaded without knowing the user name'
+        try:
+            results = rs.execute_query(sql.GET_USER_PRIVILEGES_BY_ID, (rs.name, user_id, rs.name, user_id,))
+            return PrivilegeSet.from_rows(results)
+        except Exception as e:
+            print(f"Error getting privileges for user with ID {user_id}: {e}")
+            return PrivilegeSet()
 
     @staticmethod
     def get_svv_user_info(user_id: int, rs: Redshift) -> dict:
         'Get additional user information. Set to user object and return additional as dict.'
-        results = rs.execute_query(sql.GET_SVV_USER_INFO, (user_id,))
-        cols = ['syslog_access', 'session_timeout', 'last_ddl_time']
-        return dict(zip(cols, results[0])) if results else None
+        rows = rs.fetch_as(None, sql.GET_SVV_USER_INFO, (user_id,))
+        return rows[0]._asdict() if rows else None
 
     @classmethod
     def get_user(cls, user_id: int, rs: Redshift, user_name: str = None, all_info: bool = True) -> 'RedshiftUser':
         'Get complete user information'
         query = sql.GET_USER_INFO if user_name is None else sql.GET_USER_INFO_BY_NAME
         param = (user_name,) if user_name is not None else (user_id,)
-        results = rs.execute_query(query, param)
+        users = rs.fetch_as(cls, query, param)
 
-        if results:
-            user = cls(*results[0])
+        if users:
+            user = users[0]
             if all_info:
                 user.update_fields(RedshiftUser.get_svv_user_info(user_id, rs))
                 user.groups = RedshiftUser.get_user_groups(user_id, rs)
@@ -159,6 +301,14 @@ class RedshiftUser:
             return user
         return None
 
+    @classmethod
+    def get_user_props(cls, user_id: int, rs: Redshift) -> 'RedshiftUser':
+        'Get user properties only, without groups, roles and privileges'
+        user = cls.get_user(user_id, rs, all_info=False)
+        if user:
+            user.update_fields(cls.get_svv_user_info(user_id, rs))
+        return user
+
     @staticmethod
     def get_alt_user_sql(ori_user, upd_user) -> str:
         """
@@ -236,7 +386,8 @@ class RedshiftUser:
     def update(self, rs: Redshift) -> bool:
         'Update user info in Redshift'
         try:
-            ori_user = RedshiftUser.get_user(self.user_id, rs)
+            # Only properties are compared, groups, roles and privileges are not needed
+            ori_user = RedshiftUser.get_user_props(self.user_id, rs)
             query = RedshiftUser.get_alt_user_sql(ori_user, self)
             return rs.execute_cmd(query)
         except Exception as e:
@@ -288,8 +439,7 @@ class RedshiftUser:
     def get_all_roles(rs: Redshift) -> list:
         'Get all roles available in Redshift'
         try:
-            results = rs.execute_query(sql.GET_ALL_ROLES, rs)
-            return [role[1] for role in results] if results else []
+            return [r.role_name for r in rs.fetch_as(None, sql.GET_ALL_ROLES)]
         except Exception as e:
             print(e)
             return []
@@ -337,7 +487,10 @@ class RedshiftUser:
             delete_sql = f"DROP USER {self.user_name};"
             
             # Execute SQL
-            return rs.execute_cmd(delete_sql)
+            success = rs.execute_cmd(delete_sql)
+            if success:
+                rs.invalidate_catalog()
+            return success
         except Exception as e:
             print(f"Error deleting user {self.user_name}: {e}")
             return False
@@ -372,14 +525,8 @@ class RedshiftUser:
             success = rs.execute_cmd(grant_sql)
             
             if success:
-                # Add to privileges list
-                self.privileges.append({
-                    'schema_name': schema_name,
-                    'object_name': object_name,
-                    'object_type': object_type,
-                    'privilege_type': privilege_type,
-                    'is_grantable': False
-                })
+                # Add to privileges
+                self.privileges.add(Privilege.create(schema_name, object_name, object_type, privilege_type))
                 
             return success
         except Exception as e:
@@ -415,15 +562,119 @@ class RedshiftUser:
             success = rs.execute_cmd(revoke_sql)
             
             if success:
-                # Remove from privileges list
-                self.privileges = [p for p in self.privileges if not (
-                    p['schema_name'] == schema_name and
-                    p['object_name'] == object_name and
-                    p['object_type'] == object_type and
-                    p['privilege_type'] == privilege_type
-                )]
+                # Remove from privileges
+                self.privileges.discard(Privilege(schema_name, object_name, object_type, privilege_type))
                 
             return success
         except Exception as e:
             print(f"Error revoking privilege from {self.user_name}: {e}")
             return False
+
+    def apply_privileges(self, grants: list, revokes: list, rs: Redshift) -> list:
+        """
+        Grant and revoke privileges of this user in one transaction
+        
+        Compatible privileges are merged into multi-object statements and the whole
+        changeset runs on one connection. Either every statement is applied or none is.
+        
+        Args:
+            grants: Privileges to grant
+            revokes: Privileges to revoke
+            rs: Redshift connection
+            
+        Returns:
+            list: PrivilegeStatement objects with per-statement success and error
+        """
+        statements = build_privilege_statements(self.user_name, grants, revokes)
+        try:
+            if statements and execute_privilege_statements(statements, rs):
+                # Patch privileges list with what was applied, no reload needed
+                for p in revokes:
+                    self.privileges.discard(p)
+                for p in grants:
+                    self.privileges.add(p._replace(is_grantable=False))
+        except Exception as e:
+            print(f"Error applying privileges for {self.user_name}: {e}")
+        return statements
+
+    # ===== Async loaders =====
+    # Awaitable counterparts of the loaders above, run on the Redshift SQL executor
+
+    @classmethod
+    async def get_all_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all, rs)
+
+    @classmethod
+    def iter_pages_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                         page_size: int = PAGE_SIZE):
+        return rs.iter_async(cls.iter_pages(rs, search, sort, desc, page_size))
+
+    @classmethod
+    async def get_page_async(cls, rs: Redshift, search: str = '', sort: str = 'name', desc: bool = False,
+                             after=None, page_size: int = PAGE_SIZE) -> tuple:
+        return await rs.run_async(cls.get_page, rs, search, sort, desc, after, page_size)
+
+    @classmethod
+    async def get_user_async(cls, user_id: int, rs: Redshift, user_name: str = None, all_info: bool = True) -> 'RedshiftUser':
+        """
+        Get complete user information
+        
+        The info, svv info, groups, roles and privileges queries are independent of
+        each other and run concurrently, each on its own pooled connection.
+        """
+        if user_name is not None or not all_info:
+            return await rs.run_async(cls.get_user, user_id, rs, user_name, all_info)
+
+        users, svv_info, groups, roles, privileges = await asyncio.gather(
+            rs.fetch_as_async(cls, sql.GET_USER_INFO, (user_id,)),
+            rs.run_async(cls.get_svv_user_info, user_id, rs),
+            rs.run_async(cls.get_user_groups, user_id, rs),
+            rs.run_async(cls.get_user_roles, user_id, rs),
+            rs.run_async(cls.get_user_privileges_by_id, user_id, rs),
+        )
+        if not users:
+            return None
+        user = users[0]
+        user.update_fields(svv_info)
+        user.groups = groups
+        user.roles = roles
+        user.privileges = privileges
+        return user
+
+    @classmethod
+    async def get_user_page_async(cls, user_id: int, rs: Redshift) -> tuple:
+        """
+        Load everything the user detail page shows, concurrently
+        
+        Args:
+            user_id: The id of the user
+            rs: Redshift connection
+            
+        Returns:
+            tuple: (user, all_groups, all_roles, schemas, schema_relations), user is None if not found.
+                   schema_relations only holds the schemas rendered up front, see get_privileges_catalog_async
+        """
+        user, all_groups, all_roles, schemas = await asyncio.gather(
+            cls.get_user_async(user_id, rs),
+            cls.get_all_groups_async(rs),
+            cls.get_all_roles_async(rs),
+            rs.get_schema_list_async(),
+        )
+        schema_relations = await rs.get_privileges_catalog_async(schemas, user.privileges.schemas()) if user else {}
+        return user, all_groups, all_roles, schemas, schema_relations
+
+    @classmethod
+    async def load_memberships_async(cls, users: list, rs: Redshift, all_users: bool = False) -> list:
+        return await rs.run_async(cls.load_memberships, users, rs, all_users)
+
+    @classmethod
+    async def get_user_privileges_async(cls, user_name: str, rs: Redshift) -> PrivilegeSet:
+        return await rs.run_async(cls.get_user_privileges, user_name, rs)
+
+    @classmethod
+    async def get_all_groups_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all_groups, rs)
+
+    @classmethod
+    async def get_all_roles_async(cls, rs: Redshift) -> list:
+        return await rs.run_async(cls.get_all_roles, rs)
@@ -0,0 +1,262 @@
+import csv
+import io
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+import redshift.sql_queries as sql
+from redshift.database import Redshift
+from redshift.user import RedshiftUser
+
+# Users created per transaction, overridable through env var
+IMPORT_BATCH_SIZE = int(os.environ.get('RSMATE_IMPORT_BATCH_SIZE', 50))
+
+# Names are put into DDL as is, so only plain identifiers are accepted
+IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_$]{0,126}$')
+# Characters Redshift does not allow in passwords
+PASSWORD_FORBIDDEN = set('\'"\\/@ ')
+SYSLOG_ACCESS = ('RESTRICTED', 'UNRESTRICTED')
+
+
+@dataclass
+class ImportRow:
+    'One user of an import file, with its validation errors and outcome.'
+    line: int
+    user_name: str = ''
+    user: Optional[RedshiftUser] = None
+    groups: list = field(default_factory=list)
+    roles: list = field(default_factory=list)
+    errors: list = field(default_factory=list)
+    status: str = 'pending'     # invalid, created, failed or skipped once the import ran
+    message: str = ''
+
+    def statements(self) -> list:
+        'CREATE USER, ALTER GROUP and GRANT ROLE statements of this user alone'
+        return ([RedshiftUser.get_create_user_sql(self.user)]
+                + [f'ALTER GROUP {g} ADD USER {self.user_name};' for g in self.groups]
+                + [f'GRANT ROLE {r} TO {self.user_name};' for r in self.roles])
+
+
+# ===== Parsing =====
+
+def read_import_file(data, filename: str = ''):
+    """
+    Iterate the user records of an import file
+
+    CSV files have a header row, groups and roles columns hold names separated by ;
+    JSON files hold an array of objects, or one object per line (JSON Lines).
+
+    Args:
+        data: File content, bytes or str
+        filename: File name, .json and .jsonl are read as JSON, anything else as CSV
+
+    Yields:
+        tuple: (line or item number, dict of the record's fields)
+    """
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    if filename.lower().endswith(('.json', '.jsonl')):
+        if text.lstrip().startswith('['):
+            yield from enumerate(json.loads(text), start=1)
+        else:
+            for i, line in enumerate(io.StringIO(text), start=1):
+                if line.strip():
+                    yield i, json.loads(line)
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _names(value, name: str, errors: list) -> list:
+    # Group or role names from a list or a ; separated string, lower case as Redshift folds them
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        errors.append(f'{name} must be a list or ; separated names')
+        return []
+    return list(dict.fromkeys(v.strip().lower() for v in value if v.strip()))
+
+
+def _bool(value, name: str, errors: list) -> bool:
+    if isinstance(value, bool) or value is None:
+        return bool(value)
+    value = str(value).strip().lower()
+    if value in ('', '0', 'false', 'no', 'n', 'f'):
+        return False
+    if value in ('1', 'true', 'yes', 'y', 't'):
+        return True
+    errors.append(f'{name} must be true or false')
+    return False
+
+
+def _int(value, name: str, errors: list) -> Optional[int]:
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        number = int(str(value).strip())
+        if number >= 0:
+            return number
+    except ValueError:
+        pass
+    errors.append(f'{name} must be a whole number of 0 or more')
+    return None
+
+
+def parse_import_row(line: int, record) -> ImportRow:
+    'ImportRow from one record of an import file, with errors for values that are missing or malformed'
+    if not isinstance(record, dict):
+        return ImportRow(line, errors=['Not an object'], status='invalid')
+    get = lambda key: record.get(key) if record.get(key) is not None else ''
+    # Redshift folds unquoted names to lower case, so they are compared and created that way
+    row = ImportRow(line, user_name=str(get('user_name')).strip().lower())
+    errors = row.errors
+
+    if not row.user_name:
+        errors.append('user_name is required')
+    elif not IDENTIFIER_RE.match(row.user_name):
+        errors.append(f'Invalid user name {row.user_name}')
+
+    password = str(get('password'))
+    if not password:
+        errors.append('password is required')
+    elif PASSWORD_FORBIDDEN & set(password):
+        errors.append('password must not contain quotes, \\, /, @ or spaces')
+    elif not (8 <= len(password) <= 64 and any(c.isupper() for c in password)
+              and any(c.islower() for c in password) and any(c.isdigit() for c in password)):
+        errors.append('password must be 8 to 64 characters with upper and lower case letters and a digit')
+
+    syslog_access = str(get('syslog_access')).strip().upper() or None
+    if syslog_access and syslog_access not in SYSLOG_ACCESS:
+        errors.append(f"syslog_access must be one of {', '.join(SYSLOG_ACCESS)}")
+
+    password_expiry = str(get('password_expiry')).strip() or None
+    if password_expiry:
+        try:
+            password_expiry = datetime.fromisoformat(password_expiry).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            errors.append('password_expiry must be a date, e.g. 2025-12-31')
+
+    row.groups = _names(record.get('groups'), 'groups', errors)
+    row.roles = _names(record.get('roles'), 'roles', errors)
+    for name in row.groups + row.roles:
+        if not IDENTIFIER_RE.match(name):
+            errors.append(f'Invalid group or role name {name}')
+
+    row.user = RedshiftUser(
+        user_name=row.user_name, user_id=-1,
+        super_user=_bool(record.get('super_user'), 'super_user', errors),
+        can_create_db=_bool(record.get('can_create_db'), 'can_create_db', errors),
+        connection_limit=_int(record.get('connection_limit'), 'connection_limit', errors),
+        session_timeout=_int(record.get('session_timeout'), 'session_timeout', errors),
+        syslog_access=syslog_access, password_expiry=password_expiry, password=password,
+    )
+    if errors:
+        row.status = 'invalid'
+    return row
+
+
+# ===== Validation and import =====
+
+def validate_import(rows: list, rs: Redshift) -> bool:
+    """
+    Check rows against each other and the cluster: user names must be new and unique,
+    groups and roles must exist. Adds errors to the rows and marks them invalid.
+
+    Returns:
+        bool: True if every row is valid
+    """
+    existing_users = {r[0] for r in rs.execute_query(sql.GET_ALL_USER_NAMES) or []}
+    groups = {r[0] for r in rs.execute_query(sql.GET_ALL_GROUPS) or []}
+    roles = {r.role_name for r in rs.fetch_as(None, sql.GET_ALL_ROLES)}
+    seen = {}
+    for row in rows:
+        if row.user_name in existing_users:
+            row.errors.append(f'User {row.user_name} already exists')
+        if row.user_name and row.user_name in seen:
+            row.errors.append(f'User {row.user_name} is also on line {seen[row.user_name]}')
+        seen.setdefault(row.user_name, row.line)
+        row.errors.extend(f'Group {g} does not exist' for g in row.groups if g not in groups)
+        row.errors.extend(f'Role {r} does not exist' for r in row.roles if r not in roles)
+        if row.errors:
+            row.status = 'invalid'
+    return all(not row.errors for row in rows)
+
+
+def build_import_statements(rows: list) -> list:
+    """
+    Statements creating a batch of users
+
+    All CREATE USER statements come first, then one ALTER GROUP per group
+    adding every user of the batch in it, then the GRANT ROLE statements.
+    """
+    statements = [RedshiftUser.get_create_user_sql(row.user) for row in rows]
+    group_users = {}
+    for row in rows:
+        for group in row.groups:
+            group_users.setdefault(group, []).append(row.user_name)
+    statements += [f"ALTER GROUP {group} ADD USER {', '.join(users)};" for group, users in group_users.items()]
+    statements += [f'GRANT ROLE {role} TO {row.user_name};' for row in rows for role in row.roles]
+    return statements
+
+
+def run_import(rows: list, rs: Redshift, batch_size: int = IMPORT_BATCH_SIZE):
+    """
+    Create validated users in batches, each batch in one transaction
+
+    When a batch fails it is rolled back and its users are retried one
+    transaction each, so one bad user only fails itself. Sets status and message on each row.
+    """
+    for i in range(0, len(rows), batch_size):
+        batch = rows[i:i + batch_size]
+        results = rs.execute_batch(build_import_statements(batch))
+        if all(r.success for r in results):
+            for row in batch:
+                row.status, row.message = 'created', 'Created'
+            continue
+        for row in batch:
+            results = rs.execute_batch(row.statements())
+            failed = next((r for r in results if r.error and r.error not in ('Rolled back', 'Not executed')), None)
+            if failed is None and all(r.success for r in results):
+                row.status, row.message = 'created', 'Created'
+            else:
+                row.status = 'failed'
+                row.message = failed.error if failed else results[0].error
+    if any(row.status == 'created' for row in rows):
+        rs.invalidate_catalog()
+
+
+def import_users(data, filename: str, rs: Redshift, batch_size: int = IMPORT_BATCH_SIZE) -> list:
+    """
+    Import users with their properties, groups and roles from a CSV or JSON file
+
+    Every row is validated before anything runs. If any row is invalid nothing is
+    created, so the file can be fixed and imported again as a whole.
+
+    Args:
+        data: File content, see read_import_file for the formats
+        filename: File name, its extension tells the format
+        rs: Redshift connection
+        batch_size: Users created per transaction
+
+    Returns:
+        list: ImportRow per record, with status invalid, skipped, created or failed and a message
+    """
+    try:
+        rows = [parse_import_row(line, record) for line, record in read_import_file(data, filename)]
+    except (ValueError, csv.Error) as e:
+        # json.JSONDecodeError and UnicodeDecodeError are ValueErrors
+        return [ImportRow(0, errors=[f'Could not read file: {e}'], status='invalid', message=f'Could not read file: {e}')]
+
+    if validate_import(rows, rs):
+        run_import(rows, rs, batch_size)
+    else:
+        for row in rows:
+            if row.errors:
+                row.message = '; '.join(row.errors)
+            else:
+                row.status, row.message = 'skipped', 'Not run, other rows are invalid'
+    return rows